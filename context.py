@@ -8,6 +8,7 @@ import torch
 import numpy as np
 import pickle
 import shutil
+from collections import OrderedDict
 
 import torch.nn
 
@@ -18,6 +19,7 @@ from strategy import StrategyAbstractClass
 from singleVis.utils import *
 from singleVis.trajectory_manager import Recommender
 from singleVis.active_sampling import random_sampling, uncerainty_sampling
+from singleVis.attribute_index import AttributeTable, ATTRIBUTES, LABELED, UNLABELED, TEST
 
 # active_learning_path = "../../ActiveLearning"
 # sys.path.append(active_learning_path)
@@ -44,6 +46,12 @@ class Context(ABC):
 
 class VisContext(Context):
     '''Normal setting'''
+    def __init__(self, strategy: StrategyAbstractClass) -> None:
+        super().__init__(strategy)
+        # attribute tables of the recently queried epochs
+        self.table_capacity = 8
+        self._tables = OrderedDict()
+
     #################################################################################################################
     #                                                                                                               #
     #                                                  Adapter                                                      #
@@ -55,6 +63,10 @@ class VisContext(Context):
     
     def test_representation_data(self, EPOCH):
         return self.strategy.data_provider.test_representation(EPOCH)
+
+    def pred_data(self, EPOCH):
+        # logits of train_representation_data and test_representation_data, persisted by the data provider
+        return np.concatenate((self.strategy.data_provider.train_pred(EPOCH), self.strategy.data_provider.test_pred(EPOCH)), axis=0)
     
     def train_labels(self, EPOCH):
         return self.strategy.data_provider.train_labels(EPOCH)
@@ -103,48 +115,86 @@ class VisContext(Context):
     #                                                                                                               #
     #################################################################################################################
 
-    # TODO: fix bugs accroding to new api
     # customized features
-    def filter_label(self, label, epoch_id):
-        try:
-            index = self.strategy.data_provider.classes.index(label)
-        except:
-            index = -1
-        train_labels = self.strategy.data_provider.train_labels(epoch_id)
-        test_labels = self.strategy.data_provider.test_labels(epoch_id)
+    def _attribute_sources(self, epoch_id):
+        save_dir = self.strategy.data_provider.checkpoint_path(epoch_id)
+        file_names = ["subject_model.pth", "train_data.npy", "test_data.npy", "index.json", "test_index.json"]
+        return os.path.join(save_dir, "attributes.npz"), [os.path.join(save_dir, f) for f in file_names]
+
+    def _build_attribute_table(self, epoch_id):
+        train_labels = self.train_labels(epoch_id)
+        test_labels = self.test_labels(epoch_id)
         labels = np.concatenate((train_labels, test_labels), 0)
-        idxs = np.argwhere(labels == index)
-        idxs = np.squeeze(idxs)
-        return idxs
+        return AttributeTable.build(labels, self.pred_data(epoch_id), len(train_labels), len(test_labels), self.get_epoch_index(epoch_id))
+
+    def attribute_table(self, epoch_id):
+        """
+        per-sample attributes of train and test data at epoch_id, see singleVis.attribute_index
+        the table is built once, saved as attributes.npz in the checkpoint and rebuilt when the checkpoint changes
+        :param epoch_id: int
+        :return: AttributeTable
+        """
+        path, sources = self._attribute_sources(epoch_id)
+        stamp = tuple(os.path.getmtime(f) if os.path.exists(f) else None for f in sources + [path])
+        cached = self._tables.get(epoch_id)
+        if cached is not None and cached[0] == stamp:
+            self._tables.move_to_end(epoch_id)
+            return cached[1]
+        table = AttributeTable.load_or_build(path, sources, lambda: self._build_attribute_table(epoch_id))
+        stamp = tuple(os.path.getmtime(f) if os.path.exists(f) else None for f in sources + [path])
+        self._tables[epoch_id] = (stamp, table)
+        while len(self._tables) > self.table_capacity:
+            self._tables.popitem(last=False)
+        return table
+
+    def predicate_mask(self, key, value, epoch_id):
+        """
+        boolean mask over train+test data of one predicate
+        :param key: str, "label" (class name), "type" ("train", "test", "unlabel" or all), or a registered attribute
+        :param value: a value of the attribute, [min, max] for a range
+        :param epoch_id: int
+        :return: ndarray of bool, all True for unknown keys
+        """
+        table = self.attribute_table(epoch_id)
+        if key == "label":
+            try:
+                index = self.strategy.data_provider.classes.index(value)
+            except:
+                index = -1
+            return table.equal("label", index)
+        if key == "type":
+            split = {"train": LABELED, "unlabel": UNLABELED, "test": TEST}.get(value)
+            return table.all() if split is None else table.equal("split", split)
+        if key not in ATTRIBUTES:
+            return table.all()
+        if isinstance(value, (list, tuple)):
+            if len(value) == 2 and key in table.orders:
+                return table.between(key, value[0], value[1])
+            return table.isin(key, value)
+        return table.equal(key, value)
+
+    def filter_points(self, predicates, epoch_id, mask=None):
+        """
+        index of train+test data satisfying all predicates
+        :param predicates: dict, key -> value, see predicate_mask
+        :param epoch_id: int
+        :param mask: ndarray of bool, the candidates, all data if None
+        :return: ndarray of int
+        """
+        table = self.attribute_table(epoch_id)
+        masks = [self.predicate_mask(key, value, epoch_id) for key, value in predicates.items()]
+        if mask is not None:
+            masks.append(mask)
+        return table.select(masks)
+
+    def filter_label(self, label, epoch_id):
+        return np.flatnonzero(self.predicate_mask("label", label, epoch_id))
 
     def filter_type(self, type, epoch_id):
-        if type == "train":
-            res = self.get_epoch_index(epoch_id)
-        elif type == "test":
-            train_num = self.strategy.data_provider.train_num
-            test_num = self.strategy.data_provider.test_num
-            res = list(range(train_num, train_num+ test_num, 1))
-        elif type == "unlabel":
-            labeled = np.array(self.get_epoch_index(epoch_id))
-            train_num = self.strategy.data_provider.train_num
-            all_data = np.arange(train_num)
-            unlabeled = np.setdiff1d(all_data, labeled)
-            res = unlabeled.tolist()
-        else:
-            # all data
-            train_num = self.strategy.data_provider.train_num
-            test_num = self.strategy.data_provider.test_num
-            res = list(range(0, train_num + test_num, 1))
-        return res
+        return np.flatnonzero(self.predicate_mask("type", type, epoch_id))
     
     def filter_conf(self, conf_min, conf_max, epoch_id):
-        train_data = self.strategy.data_provider.train_representation(epoch_id)
-        test_data =self.strategy.data_provider.test_representation(epoch_id)
-        data = np.concatenate((train_data, test_data), axis=0)
-        pred = self.strategy.data_provider.get_pred(epoch_id, data)
-        scores = np.amax(softmax(pred, axis=1), axis=1)
-        res = np.argwhere(np.logical_and(scores<=conf_max, scores>=conf_min)).squeeze().tolist()
-        return res
+        return np.flatnonzero(self.predicate_mask("confidence", [conf_min, conf_max], epoch_id))
 
 
     #################################################################################################################
@@ -193,6 +243,10 @@ class ActiveLearningContext(VisContext):
 
     def train_representation_data(self, iteration):
         return self.strategy.data_provider.train_representation_all(iteration)
+
+    def pred_data(self, iteration):
+        data = np.concatenate((self.train_representation_data(iteration), self.test_representation_data(iteration)), axis=0)
+        return self.strategy.data_provider.get_pred(iteration, data)
     
     def train_labels(self, iteration):
         labels = self.strategy.data_provider.train_labels_all()
@@ -434,18 +488,13 @@ class ActiveLearningContext(VisContext):
             print("Load trajectories from cache!")
         else:
             # extract samples
-            TOTAL_EPOCH = self.strategy.config["TRAINING"]["total_epoch"]
             EPOCH_START = self.strategy.config["TRAINING"]["epoch_start"]
             EPOCH_END = self.strategy.config["TRAINING"]["epoch_end"]
             EPOCH_PERIOD = self.strategy.config["TRAINING"]["epoch_period"]
-            train_num = len(self.train_labels(None))
-            # change epoch_NUM
-            embeddings_2d = np.zeros((TOTAL_EPOCH, train_num, 2))
-            for i in range(EPOCH_START, EPOCH_END+1, EPOCH_PERIOD):
-                id = (i - EPOCH_START)//EPOCH_PERIOD
-                embeddings_2d[id] = self.strategy.projector.batch_project(iteration, i, self.strategy.data_provider.train_representation_all(iteration, i))
-            trajectories = np.transpose(embeddings_2d, [1,0,2])
-            np.save(embedding_path, trajectories)
+            all_representation = self.strategy.data_provider.all_representation(iteration)
+            # (train_num, epoch_num, 2), streamed into embedding_path
+            epochs = list(range(EPOCH_START, EPOCH_END+1, EPOCH_PERIOD))
+            trajectories = self.strategy.projector.project_all_epochs(iteration, epochs, lambda i: np.array(all_representation.epoch(i)), save_path=embedding_path)
         # prepare uncertainty
         uncertainty_path = os.path.join(self.strategy.data_provider.checkpoint_path(iteration), 'uncertainties.npy')
         if os.path.exists(uncertainty_path):
@@ -533,16 +582,9 @@ class AnormalyContext(VisContext):
         if os.path.exists(embedding_path):
             trajectories = np.load(embedding_path)
         else:
-            # extract samples
-            train_num = self.strategy.data_provider.train_num
-            # change epoch_NUM
-            epoch_num = (self.strategy.data_provider.e - self.strategy.data_provider.s)//self.strategy.data_provider.p + 1
-            embeddings_2d = np.zeros((epoch_num, train_num, 2))
-            for i in range(self.strategy.data_provider.s, self.strategy.data_provider.e+1, self.strategy.data_provider.p):
-                id = (i - self.strategy.data_provider.s)//self.strategy.data_provider.p
-                embeddings_2d[id] = self.strategy.projector.batch_project(i, self.strategy.data_provider.train_representation(i))
-            trajectories = np.transpose(embeddings_2d, [1,0,2])
-            np.save(embedding_path, trajectories)
+            # (train_num, epoch_num, 2), streamed into embedding_path
+            epochs = list(range(self.strategy.data_provider.s, self.strategy.data_provider.e+1, self.strategy.data_provider.p))
+            trajectories = self.strategy.projector.project_all_epochs(epochs, self.strategy.data_provider.train_representation, save_path=embedding_path)
         # prepare uncertainty scores
         uncertainty_path = os.path.join(self.strategy.data_provider.content_path, 'uncertainties.npy')
         if os.path.exists(uncertainty_path):
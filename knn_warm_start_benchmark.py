@@ -0,0 +1,80 @@
+"""Benchmark warm-started NNDescent against cold builds over a long run of slowly drifting epochs and check the recall of both"""
+import time
+import argparse
+
+import numpy as np
+from sklearn.neighbors import NearestNeighbors
+
+from singleVis.knn_graph import KNNGraphService, map_init_graph
+
+########################################################################################################################
+#                                                    SYNTHETIC DATA                                                    #
+########################################################################################################################
+def synthetic_run(epochs, train_num, dim, drift, seed=0):
+    """
+    representations of a training run walked backward like the k-center loops, each epoch is a small drift of the next one
+    :return: generator of (epoch, representation)
+    """
+    rng = np.random.RandomState(seed)
+    centers = rng.normal(scale=5., size=(10, dim))
+    data = centers[rng.randint(0, 10, size=train_num)] + rng.normal(size=(train_num, dim))
+    for epoch in range(epochs, 0, -1):
+        yield epoch, data.astype(np.float32)
+        data = data + rng.normal(scale=drift, size=data.shape)
+
+
+def synthetic_selection(selected_idxs, train_num, grow, rng):
+    """the selection of the previous epoch followed by grow new samples, as kCenterGreedy extends already_selected"""
+    candidates = np.setdiff1d(np.arange(train_num), selected_idxs)
+    new_idxs = rng.choice(candidates, size=min(grow, len(candidates)), replace=False)
+    return np.concatenate((selected_idxs, new_idxs))
+
+
+def recall(knn_indices, data, rows, n_neighbors):
+    """fraction of the exact n_neighbors of rows found in knn_indices"""
+    exact = NearestNeighbors(n_neighbors=n_neighbors).fit(data).kneighbors(data[rows], return_distance=False)
+    hits = [len(np.intersect1d(knn_indices[r], e)) for r, e in zip(rows, exact)]
+    return np.sum(hits) / exact.size
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark warm-started NNDescent...')
+    parser.add_argument('--epochs', type=int, default=200)
+    parser.add_argument('--train_num', type=int, default=20000)
+    parser.add_argument('--init_num', type=int, default=5000)
+    parser.add_argument('--grow', type=int, default=50)
+    parser.add_argument('--dim', type=int, default=512)
+    parser.add_argument('--drift', type=float, default=0.02)
+    parser.add_argument('--n_neighbors', type=int, default=15)
+    parser.add_argument('--recall_samples', type=int, default=500)
+    parser.add_argument('--report_every', type=int, default=20)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    selected_idxs = rng.choice(args.train_num, size=args.init_num, replace=False)
+    prev = None
+    cold_time, warm_time, cold_recall, warm_recall = 0., 0., list(), list()
+    for epoch, representation in synthetic_run(args.epochs, args.train_num, args.dim, args.drift):
+        if prev is not None:
+            selected_idxs = synthetic_selection(selected_idxs, args.train_num, args.grow, rng)
+        data = representation[selected_idxs]
+
+        # fresh services, so that neither build is served from a cache
+        t0 = time.time()
+        cold_indices, _ = KNNGraphService().neighbor_graph(data, args.n_neighbors)
+        t1 = time.time()
+        init_graph = None if prev is None else map_init_graph(prev[1], prev[0], selected_idxs, args.n_neighbors)
+        warm_indices, _ = KNNGraphService().neighbor_graph(data, args.n_neighbors, init_graph=init_graph)
+        t2 = time.time()
+        prev = (selected_idxs, warm_indices)
+
+        cold_time += t1 - t0
+        warm_time += t2 - t1
+        rows = rng.choice(len(data), size=min(args.recall_samples, len(data)), replace=False)
+        cold_recall.append(recall(cold_indices, data, rows, args.n_neighbors))
+        warm_recall.append(recall(warm_indices, data, rows, args.n_neighbors))
+        if epoch % args.report_every == 0:
+            print("epoch {:d}:\t{:d} samples\tcold {:.2f}s recall {:.4f}\twarm {:.2f}s recall {:.4f}".format(epoch, len(data), t1-t0, cold_recall[-1], t2-t1, warm_recall[-1]))
+
+    print("total:\tcold {:.2f}s\twarm {:.2f}s\tspeedup {:.1f}x".format(cold_time, warm_time, cold_time/max(warm_time, 1e-6)))
+    print("recall:\tcold mean {:.4f} min {:.4f}\twarm mean {:.4f} min {:.4f}".format(np.mean(cold_recall), np.min(cold_recall), np.mean(warm_recall), np.min(warm_recall)))
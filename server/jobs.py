@@ -0,0 +1,238 @@
+"""Local background jobs for long-running server operations (al_train, cold projections), no external broker needed
+
+A job runs in a thread pool of the server process, so it shares the pooled backends (and their GPU state) with the requests.
+Its status is written to jobs_dir/{job_id}.json on every change and its result to jobs_dir/{job_id}.result.json
+(or .result.bin for packed payloads), so that finished jobs can still be polled after a restart.
+Finished jobs are kept for max_age seconds and at most max_finished of them, older ones are dropped with their files.
+"""
+import os
+import json
+import time
+import uuid
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    '''Handle of a submitted job, passed to the job function to report progress and to check for cancellation'''
+    def __init__(self, job_id, name, jobs_dir):
+        self.job_id = job_id
+        self.name = name
+        self.jobs_dir = jobs_dir
+        self.status = QUEUED
+        self.progress = 0.
+        self.message = ""
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self.future = None
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def status_path(self):
+        return os.path.join(self.jobs_dir, "{}.json".format(self.job_id))
+
+    def remove(self):
+        """delete the persisted status and result"""
+        for path in [self.status_path, self.result_path(True), self.result_path(False)]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def result_path(self, binary):
+        return os.path.join(self.jobs_dir, "{}.result.{}".format(self.job_id, "bin" if binary else "json"))
+
+    def to_dict(self):
+        return {
+            "job_id": self.job_id,
+            "name": self.name,
+            "status": self.status,
+            "progress": self.progress,
+            "message": self.message,
+            "error": self.error,
+            "created": self.created,
+            "finished": self.finished,
+        }
+
+    def save(self):
+        with self._lock:
+            tmp_path = self.status_path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.to_dict(), f)
+            os.replace(tmp_path, self.status_path)
+
+    def update(self, progress=None, message=None):
+        """
+        report progress, also a cancellation point
+        :param progress: float, in [0, 1]
+        :param message: str, the current step
+        """
+        self.check_cancelled()
+        if progress is not None:
+            self.progress = float(progress)
+        if message is not None:
+            self.message = message
+        self.save()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def check_cancelled(self):
+        """raise JobCancelled if the job was cancelled, long job functions should call it between their steps"""
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    def save_result(self, result):
+        """persist result, bytes (e.g. a packed projection) or anything json serializable"""
+        binary = isinstance(result, (bytes, bytearray))
+        path = self.result_path(binary)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb" if binary else "w") as f:
+            if binary:
+                f.write(result)
+            else:
+                json.dump(result, f)
+        os.replace(tmp_path, path)
+
+    def load_result(self):
+        """the persisted result, bytes or the loaded json, None if there is none"""
+        if os.path.exists(self.result_path(True)):
+            with open(self.result_path(True), "rb") as f:
+                return f.read()
+        if os.path.exists(self.result_path(False)):
+            with open(self.result_path(False), "r") as f:
+                return json.load(f)
+        return None
+
+    @classmethod
+    def load(cls, jobs_dir, job_id):
+        job = cls(job_id, None, jobs_dir)
+        with open(job.status_path, "r") as f:
+            d = json.load(f)
+        for key in ["name", "status", "progress", "message", "error", "created", "finished"]:
+            setattr(job, key, d[key])
+        return job
+
+
+class JobQueue:
+    '''Thread pool running submitted functions as jobs with ids, progress, cancellation and persisted results'''
+    def __init__(self, jobs_dir="./jobs", max_workers=2, max_age=7*24*3600, max_finished=100):
+        """
+        Parameters
+        ----------
+        jobs_dir : str
+            where the status and the results of jobs are persisted, by default ./jobs
+        max_workers : int
+            number of jobs running at the same time, by default 2
+        max_age : float
+            seconds a finished job is kept after it finished, by default a week
+        max_finished : int
+            number of finished jobs kept, the ones finished earliest are dropped first, by default 100
+        """
+        self.jobs_dir = jobs_dir
+        self.max_age = max_age
+        self.max_finished = max_finished
+        os.makedirs(jobs_dir, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs = dict()
+        self._lock = threading.Lock()
+        self._recover()
+
+    def _recover(self):
+        # jobs that did not finish before the last shutdown will never finish
+        with self._lock:
+            for file_name in os.listdir(self.jobs_dir):
+                if not file_name.endswith(".json") or ".result." in file_name:
+                    continue
+                try:
+                    job = Job.load(self.jobs_dir, file_name[:-len(".json")])
+                except (ValueError, KeyError):
+                    continue
+                if job.status not in FINISHED:
+                    job.status = FAILED
+                    job.error = "interrupted by a server restart"
+                    job.finished = time.time()
+                    job.save()
+                self._jobs[job.job_id] = job
+        self._prune()
+
+    def _prune(self):
+        # drop finished jobs older than max_age and all but the max_finished latest ones
+        with self._lock:
+            finished = sorted((job for job in self._jobs.values() if job.status in FINISHED), key=lambda job: job.finished or 0.)
+            expired = time.time() - self.max_age
+            drop = finished[:max(len(finished) - self.max_finished, 0)]
+            drop += [job for job in finished[len(drop):] if (job.finished or 0.) < expired]
+            for job in drop:
+                del self._jobs[job.job_id]
+        for job in drop:
+            job.remove()
+
+    def submit(self, name, fn, *args, **kwargs):
+        """
+        run fn(job, *args, **kwargs) in the background, its return value is persisted as the result of the job
+        :param name: str, e.g. "al_train"
+        :param fn: function, its first argument is the Job to report progress to
+        :return: Job
+        """
+        self._prune()
+        job = Job(uuid.uuid4().hex, name, self.jobs_dir)
+        job.save()
+        with self._lock:
+            self._jobs[job.job_id] = job
+        job.future = self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def _run(self, job, fn, args, kwargs):
+        try:
+            job.check_cancelled()
+            job.status = RUNNING
+            job.save()
+            result = fn(job, *args, **kwargs)
+            job.save_result(result)
+            job.status = DONE
+            job.progress = 1.
+        except JobCancelled:
+            job.status = CANCELLED
+        except Exception as e:
+            job.status = FAILED
+            job.error = "{}: {}".format(type(e).__name__, e)
+            traceback.print_exc()
+        job.finished = time.time()
+        job.save()
+
+    def get(self, job_id):
+        """the job of job_id, also the finished ones persisted before a restart, None if there is no such job or it was dropped"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """
+        cancel a job, a queued one never starts and a running one stops at its next progress update
+        :return: Job, None if there is no such job
+        """
+        job = self.get(job_id)
+        if job is None or job.status in FINISHED:
+            return job
+        job._cancel.set()
+        if job.future is not None and job.future.cancel():
+            job.status = CANCELLED
+            job.finished = time.time()
+            job.save()
+        return job
+
+    def shutdown(self, wait=False):
+        self._executor.shutdown(wait=wait)
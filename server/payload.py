@@ -0,0 +1,87 @@
+"""Packed binary encoding of the projection of an epoch, the compact alternative to the json response of /updateProjection
+
+Layout (little endian):
+    b"DVIP" | uint32 header length | json header (utf-8, padded with spaces to 8 bytes) | buffers
+the header lists every buffer with its name, dtype, shape and byte offset from the start of the buffers,
+each buffer starts at a multiple of 8 bytes so that it can be viewed as a typed array without copying.
+"""
+import gzip
+import json
+import struct
+
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+PROJECTION_MIMETYPE = "application/vnd.deepdebugger.projection"
+MAGIC = b"DVIP"
+VERSION = 1
+
+
+def id_dtype(num):
+    """the smallest unsigned integer type holding ids in [0, num)"""
+    return np.uint8 if num <= 256 else np.uint16
+
+
+def pack(header, buffers):
+    """
+    pack typed arrays behind a json header
+    :param header: dict, json serializable
+    :param buffers: dict, name -> numpy.ndarray
+    :return: bytes
+    """
+    header = dict(header, version=VERSION, buffers=list())
+    blobs = list()
+    offset = 0
+    for name, array in buffers.items():
+        array = np.ascontiguousarray(array)
+        # typed arrays on the client are little endian
+        array = array.astype(array.dtype.newbyteorder("<"), copy=False)
+        header["buffers"].append({"name": name, "dtype": array.dtype.name, "shape": list(array.shape), "offset": offset})
+        blob = array.tobytes()
+        pad = -len(blob) % 8
+        blobs.append(blob + b"\0" * pad)
+        offset += len(blob) + pad
+
+    head = json.dumps(header).encode("utf-8")
+    # magic and length take 8 bytes, so a header padded to 8 keeps the buffers aligned
+    head += b" " * (-len(head) % 8)
+    return MAGIC + struct.pack("<I", len(head)) + head + b"".join(blobs)
+
+
+def unpack(payload):
+    """
+    inverse of pack
+    :param payload: bytes, uncompressed
+    :return: (dict, dict), the header and name -> numpy.ndarray
+    """
+    if payload[:4] != MAGIC:
+        raise ValueError("Not a projection payload...")
+    length, = struct.unpack("<I", payload[4:8])
+    header = json.loads(payload[8:8 + length].decode("utf-8"))
+    start = 8 + length
+    buffers = dict()
+    for b in header.pop("buffers"):
+        dtype = np.dtype(b["dtype"]).newbyteorder("<")
+        count = int(np.prod(b["shape"], dtype=np.int64))
+        buffers[b["name"]] = np.frombuffer(payload, dtype=dtype, count=count, offset=start + b["offset"]).reshape(b["shape"])
+    return header, buffers
+
+
+def compress(payload, accept_encoding="", level=3):
+    """
+    compress payload with the best encoding the client accepts, zstd when zstandard is installed, then gzip
+    :param payload: bytes
+    :param accept_encoding: str, the Accept-Encoding header of the request
+    :param level: int, compression level
+    :return: (bytes, str), the body and its Content-Encoding, None if it is not compressed
+    """
+    accepted = {e.split(";")[0].strip().lower() for e in accept_encoding.split(",")}
+    if zstandard is not None and "zstd" in accepted:
+        return zstandard.ZstdCompressor(level=level).compress(payload), "zstd"
+    if "gzip" in accepted:
+        return gzip.compress(payload, compresslevel=level), "gzip"
+    return payload, None
@@ -1,4 +1,4 @@
-from flask import request, Flask, jsonify, make_response
+from flask import request, Flask, jsonify, make_response, send_file
 from flask_cors import CORS, cross_origin
 
 import base64
@@ -9,7 +9,12 @@ import pickle
 import numpy as np
 import gc
 import shutil
-from utils import update_epoch_projection, initialize_backend, add_line
+import hashlib
+from utils import update_epoch_projection, pack_epoch_projection, context_pool, add_line
+from payload import PROJECTION_MIMETYPE, compress
+from singleVis.attribute_index import UNLABELED
+from jobs import JobQueue, DONE, FINISHED
+from sprite_store import read_sprite, read_sprites, ATLAS_NAME, ATLAS_META_NAME
 
 
 # flask for API server
@@ -18,6 +23,64 @@ cors = CORS(app, supports_credentials=True)
 app.config['CORS_HEADERS'] = 'Content-Type'
 
 API_result_path = "./admin_API_result.csv"
+# long operations requested with "async": true run here, see /jobs
+job_queue = JobQueue(jobs_dir="./jobs", max_workers=2)
+
+def accepts_packed():
+    """whether the client asked for the packed projection (see payload.py) instead of json"""
+    return request.accept_mimetypes.best_match(["application/json", PROJECTION_MIMETYPE]) == PROJECTION_MIMETYPE
+
+def packed_response(body):
+    body, encoding = compress(body, request.headers.get("Accept-Encoding", ""))
+    response = make_response(body, 200)
+    response.mimetype = PROJECTION_MIMETYPE
+    response.headers["Vary"] = "Accept, Accept-Encoding"
+    if encoding is not None:
+        response.headers["Content-Encoding"] = encoding
+    return response
+
+def body_response(body):
+    """response of a projection body, see projection_body"""
+    if isinstance(body, (bytes, bytearray)):
+        return packed_response(body)
+    return make_response(jsonify(body), 200)
+
+def projection_body(context, EPOCH, predicates, packed, progress=None):
+    """the projection of EPOCH, packed bytes or a json serializable dict, progress is passed on to epoch_projection"""
+    if packed:
+        return pack_epoch_projection(context, EPOCH, predicates, progress)
+    embedding_2d, grid, decision_view, label_name_dict, label_color_list, label_list, max_iter, training_data_index, \
+    testing_data_index, eval_new, prediction_list, selected_points, properties = update_epoch_projection(context, EPOCH, predicates, progress)
+    return {'result': embedding_2d, 
+            'grid_index': grid, 
+            'grid_color': 'data:image/png;base64,' + decision_view,
+            'label_name_dict':label_name_dict,
+            'label_color_list': label_color_list, 
+            'label_list': label_list,
+            'maximum_iteration': max_iter, 
+            'training_data': training_data_index,
+            'testing_data': testing_data_index, 
+            'evaluation': eval_new,
+            'prediction_list': prediction_list,
+            "selectedPoints":selected_points.tolist(),
+            "properties":properties.tolist()}
+
+def report(job, progress, message, cancellable=True):
+    """report the progress of a background job, nothing for synchronous requests"""
+    if job is None:
+        return
+    if cancellable:
+        job.update(progress, message)
+    else:
+        job.progress = progress
+        job.message = message
+        job.save()
+
+def run_projection(job, CONTENT_PATH, VIS_METHOD, SETTING, EPOCH, predicates, packed):
+    """the body of /updateProjection, job is None when it runs inside the request"""
+    with context_pool.context(CONTENT_PATH, VIS_METHOD, SETTING) as context:
+        report(job, 0., "projecting epoch {}".format(EPOCH))
+        return projection_body(context, EPOCH, predicates, packed, progress=lambda p, m: report(job, p, m))
 
 @app.route('/updateProjection', methods=["POST", "GET"])
 @cross_origin()
@@ -31,30 +94,14 @@ def update_projection():
     predicates = res["predicates"]
     username = res['username']
     
-    # sys.path.append(CONTENT_PATH)
-    context = initialize_backend(CONTENT_PATH, VIS_METHOD, SETTING)
     # use the true one
     # EPOCH = (iteration-1)*context.strategy.data_provider.p + context.strategy.data_provider.s
     EPOCH = int(iteration)
-
-    embedding_2d, grid, decision_view, label_name_dict, label_color_list, label_list, max_iter, training_data_index, \
-    testing_data_index, eval_new, prediction_list, selected_points, properties = update_epoch_projection(context, EPOCH, predicates)
-
-    # sys.path.remove(CONTENT_PATH)
+    if res.get("async", False):
+        job = job_queue.submit("updateProjection", run_projection, CONTENT_PATH, VIS_METHOD, SETTING, EPOCH, predicates, accepts_packed())
+        return make_response(jsonify(job.to_dict()), 202)
     # add_line(API_result_path,['TT',username])
-    return make_response(jsonify({'result': embedding_2d, 
-                                  'grid_index': grid, 
-                                  'grid_color': 'data:image/png;base64,' + decision_view,
-                                  'label_name_dict':label_name_dict,
-                                  'label_color_list': label_color_list, 
-                                  'label_list': label_list,
-                                  'maximum_iteration': max_iter, 
-                                  'training_data': training_data_index,
-                                  'testing_data': testing_data_index, 
-                                  'evaluation': eval_new,
-                                  'prediction_list': prediction_list,
-                                  "selectedPoints":selected_points.tolist(),
-                                  "properties":properties.tolist()}), 200)
+    return body_response(run_projection(None, CONTENT_PATH, VIS_METHOD, SETTING, EPOCH, predicates, accepts_packed()))
 
 @app.route('/query', methods=["POST"])
 @cross_origin()
@@ -69,27 +116,14 @@ def filter():
     username = res['username']
 
     sys.path.append(CONTENT_PATH)
-    context = initialize_backend(CONTENT_PATH, VIS_METHOD, SETTING)
-    # TODO: fix when active learning
-    EPOCH = (iteration-1)*context.strategy.data_provider.p + context.strategy.data_provider.s
-
-    training_data_number = context.strategy.config["TRAINING"]["train_num"]
-    testing_data_number = context.strategy.config["TRAINING"]["test_num"]
-
-    current_index = context.get_epoch_index(EPOCH)
-    selected_points = np.arange(training_data_number)[current_index]
-    selected_points = np.concatenate((selected_points, np.arange(training_data_number, training_data_number + testing_data_number, 1)), axis=0)
-    # selected_points = np.arange(training_data_number + testing_data_number)
-    for key in predicates.keys():
-        if key == "label":
-            tmp = np.array(context.filter_label(predicates[key], int(EPOCH)))
-        elif key == "type":
-            tmp = np.array(context.filter_type(predicates[key], int(EPOCH)))
-        elif key == "confidence":
-            tmp = np.array(context.filter_conf(predicates[key][0],predicates[key][1],int(EPOCH)))
-        else:
-            tmp = np.arange(training_data_number + testing_data_number)
-        selected_points = np.intersect1d(selected_points, tmp)
+    with context_pool.context(CONTENT_PATH, VIS_METHOD, SETTING) as context:
+        # TODO: fix when active learning
+        EPOCH = (iteration-1)*context.strategy.data_provider.p + context.strategy.data_provider.s
+
+        # labeled train data and test data, as bitmasks over the attribute table of the epoch
+        table = context.attribute_table(EPOCH)
+        candidates = table["split"] != UNLABELED
+        selected_points = context.filter_points(predicates, EPOCH, candidates)
     sys.path.remove(CONTENT_PATH)
     add_line(API_result_path,['SQ',username])
     return make_response(jsonify({"selectedPoints": selected_points.tolist()}), 200)
@@ -106,11 +140,7 @@ def sprite_image():
     CONTENT_PATH = os.path.normpath(path)
     print('index', index)
     idx = int(index)
-    pic_save_dir_path = os.path.join(CONTENT_PATH, "sprites", "{}.png".format(idx))
-    img_stream = ''
-    with open(pic_save_dir_path, 'rb') as img_f:
-        img_stream = img_f.read()
-        img_stream = base64.b64encode(img_stream).decode()
+    img_stream = base64.b64encode(read_sprite(CONTENT_PATH, idx)).decode()
     add_line(API_result_path,['SI',username])
     return make_response(jsonify({"imgUrl":'data:image/png;base64,' + img_stream}), 200)
 
@@ -123,21 +153,59 @@ def sprite_list_image():
     path = data["path"]
 
     CONTENT_PATH = os.path.normpath(path)
-    length = len(indices)
     urlList = {}
-
-    for i in range(length):
-        idx = indices[i]
-        pic_save_dir_path = os.path.join(CONTENT_PATH, "sprites", "{}.png".format(idx))
-        img_stream = ''
-        with open(pic_save_dir_path, 'rb') as img_f:
-            img_stream = img_f.read()
-            img_stream = base64.b64encode(img_stream).decode()
-            urlList[idx] = 'data:image/png;base64,' + img_stream
-            # urlList.append('data:image/png;base64,' + img_stream)
+    for idx in indices:
+        img_stream = base64.b64encode(read_sprite(CONTENT_PATH, int(idx))).decode()
+        urlList[idx] = 'data:image/png;base64,' + img_stream
     return make_response(jsonify({"urlList":urlList}), 200)
 
 
+@app.route('/spriteBatch', methods=["POST", "GET"])
+@cross_origin()
+def sprite_batch():
+    """raw png bytes of many sprites in one response, see sprite_store.SpriteStore.get_many for the layout"""
+    if request.method == "POST":
+        data = request.get_json()
+        path = data["path"]
+        indices = data["index"]
+    else:
+        path = request.args.get("path")
+        indices = [i for i in request.args.get("index", "").split(",") if i]
+    try:
+        indices = [int(i) for i in indices]
+    except (TypeError, ValueError):
+        return make_response(jsonify({"message": "Sprite indices must be integers..."}), 400)
+    # indices are packed as uint32
+    if any(i < 0 or i >= 2**32 for i in indices):
+        return make_response(jsonify({"message": "Sprite indices must be in [0, 2^32)..."}), 400)
+
+    CONTENT_PATH = os.path.normpath(path)
+    body, version = read_sprites(CONTENT_PATH, indices)
+    response = make_response(body, 200)
+    response.mimetype = "application/octet-stream"
+    response.cache_control.private = True
+    response.cache_control.max_age = 3600
+    response.set_etag(hashlib.sha1("{}|{}|{}".format(CONTENT_PATH, version, indices).encode("utf-8")).hexdigest())
+    return response.make_conditional(request)
+
+
+@app.route('/spriteAtlas', methods=["GET"])
+@cross_origin()
+def sprite_atlas():
+    """the grid atlas saved by sprite_store.py --atlas, its layout is in the X-Sprite-Atlas header"""
+    CONTENT_PATH = os.path.normpath(request.args.get("path"))
+    atlas_path = os.path.join(CONTENT_PATH, ATLAS_NAME)
+    meta_path = os.path.join(CONTENT_PATH, ATLAS_META_NAME)
+    if not os.path.exists(atlas_path) or not os.path.exists(meta_path):
+        return make_response(jsonify({"message": "The sprites of {} are not packed into an atlas...".format(CONTENT_PATH)}), 404)
+    with open(meta_path, "r") as f:
+        meta = f.read()
+    response = send_file(atlas_path, mimetype="image/png", conditional=True, max_age=3600)
+    response.headers["X-Sprite-Atlas"] = meta.replace("\n", "")
+    response.headers["Access-Control-Expose-Headers"] = "X-Sprite-Atlas"
+    return response
+
+
 @app.route('/al_query', methods=["POST"])
 @cross_origin()
 def al_query():
@@ -156,14 +224,14 @@ def al_query():
     isRecommend = data["isRecommend"]
 
     sys.path.append(CONTENT_PATH)
-    context = initialize_backend(CONTENT_PATH, VIS_METHOD, SETTING, dense=True)
-    # TODO add new sampling rule
-    indices, labels, scores = context.al_query(iteration, budget, strategy, np.array(acc_idxs).astype(np.int64), np.array(rej_idxs).astype(np.int64))
+    with context_pool.context(CONTENT_PATH, VIS_METHOD, SETTING, dense=True) as context:
+        # TODO add new sampling rule
+        indices, labels, scores = context.al_query(iteration, budget, strategy, np.array(acc_idxs).astype(np.int64), np.array(rej_idxs).astype(np.int64))
 
-    sort_i = np.argsort(-scores)
-    indices = indices[sort_i]
-    labels = labels[sort_i]
-    scores = scores[sort_i]
+        sort_i = np.argsort(-scores)
+        indices = indices[sort_i]
+        labels = labels[sort_i]
+        scores = scores[sort_i]
 
     sys.path.remove(CONTENT_PATH)
     if not isRecommend: 
@@ -188,16 +256,15 @@ def anomaly_query():
     isRecommend = data["isRecommend"]
 
     sys.path.append(CONTENT_PATH)
-    context = initialize_backend(CONTENT_PATH, VIS_METHOD, SETTING)
+    with context_pool.context(CONTENT_PATH, VIS_METHOD, SETTING) as context:
+        context.save_acc_and_rej(acc_idxs, rej_idxs, user_name)
+        indices, scores, labels = context.suggest_abnormal(strategy, np.array(acc_idxs).astype(np.int64), np.array(rej_idxs).astype(np.int64), budget)
+        clean_list,_ = context.suggest_normal(strategy, np.array(acc_idxs).astype(np.int64), np.array(rej_idxs).astype(np.int64), 1)
 
-    context.save_acc_and_rej(acc_idxs, rej_idxs, user_name)
-    indices, scores, labels = context.suggest_abnormal(strategy, np.array(acc_idxs).astype(np.int64), np.array(rej_idxs).astype(np.int64), budget)
-    clean_list,_ = context.suggest_normal(strategy, np.array(acc_idxs).astype(np.int64), np.array(rej_idxs).astype(np.int64), 1)
-
-    sort_i = np.argsort(-scores)
-    indices = indices[sort_i]
-    labels = labels[sort_i]
-    scores = scores[sort_i]
+        sort_i = np.argsort(-scores)
+        indices = indices[sort_i]
+        labels = labels[sort_i]
+        scores = scores[sort_i]
 
     sys.path.remove(CONTENT_PATH)
     if not isRecommend: 
@@ -219,45 +286,46 @@ def al_train():
     iteration = data["iteration"]
     user_name = data["username"]
 
-    sys.path.append(CONTENT_PATH)
-    # default setting al_train is light version, we only save the last epoch
-    
-    context = initialize_backend(CONTENT_PATH, VIS_METHOD, SETTING)
-    context.save_acc_and_rej(iteration, acc_idxs, rej_idxs, user_name)
-    context.al_train(iteration, acc_idxs)
-    NEW_ITERATION =  context.get_max_iter()
-    context.vis_train(NEW_ITERATION, iteration)
-
-    # update iteration projection
-    embedding_2d, grid, decision_view, label_name_dict, label_color_list, label_list, _, training_data_index, \
-    testing_data_index, eval_new, prediction_list, selected_points, properties = update_epoch_projection(context, NEW_ITERATION, dict())
-    
-    # rewirte json =========
-    res_json_path = os.path.join(CONTENT_PATH, "iteration_structure.json")
-    with open(res_json_path,encoding='utf8')as fp:
-        json_data = json.load(fp)
+    if data.get("async", False):
+        job = job_queue.submit("al_train", run_al_train, CONTENT_PATH, VIS_METHOD, SETTING, iteration, acc_idxs, rej_idxs, user_name, accepts_packed())
+        return make_response(jsonify(job.to_dict()), 202)
+    return body_response(run_al_train(None, CONTENT_PATH, VIS_METHOD, SETTING, iteration, acc_idxs, rej_idxs, user_name, accepts_packed()))
 
-        json_data.append({'value': NEW_ITERATION, 'name': 'iteration', 'pid': iteration})
-        print('json_data',json_data)
-    with open(res_json_path,'w')as r:
-      json.dump(json_data, r)
-    r.close()
-    # rewirte json =========
-
-    del config
-    gc.collect()
-
-    sys.path.remove(CONTENT_PATH)
- 
-    add_line(API_result_path,['al_train', user_name])
-    return make_response(jsonify({'result': embedding_2d, 'grid_index': grid, 'grid_color': 'data:image/png;base64,' + decision_view,
-                                  'label_name_dict': label_name_dict,
-                                  'label_color_list': label_color_list, 'label_list': label_list,
-                                  'maximum_iteration': NEW_ITERATION, 'training_data': training_data_index,
-                                  'testing_data': testing_data_index, 'evaluation': eval_new,
-                                  'prediction_list': prediction_list,
-                                  "selectedPoints":selected_points.tolist(),
-                                  "properties":properties.tolist()}), 200)
+def run_al_train(job, CONTENT_PATH, VIS_METHOD, SETTING, iteration, acc_idxs, rej_idxs, user_name, packed):
+    """train the next iteration and project it, the body of /al_train, job is None when it runs inside the request"""
+    sys.path.append(CONTENT_PATH)
+    try:
+        # default setting al_train is light version, we only save the last epoch
+        with context_pool.context(CONTENT_PATH, VIS_METHOD, SETTING) as context:
+            report(job, 0., "training the subject model")
+            context.save_acc_and_rej(iteration, acc_idxs, rej_idxs, user_name)
+            # from here on the new iteration is written, so the job is not cancelled halfway
+            context.al_train(iteration, acc_idxs)
+            NEW_ITERATION =  context.get_max_iter()
+            report(job, .5, "training the visualization model", cancellable=False)
+            context.vis_train(NEW_ITERATION, iteration)
+
+            # rewirte json =========
+            res_json_path = os.path.join(CONTENT_PATH, "iteration_structure.json")
+            with open(res_json_path,encoding='utf8')as fp:
+                json_data = json.load(fp)
+
+                json_data.append({'value': NEW_ITERATION, 'name': 'iteration', 'pid': iteration})
+                print('json_data',json_data)
+            with open(res_json_path,'w')as r:
+                json.dump(json_data, r)
+            # rewirte json =========
+            add_line(API_result_path,['al_train', user_name])
+
+            # the new iteration is complete, cancelling its projection leaves a consistent content path
+            report(job, .9, "projecting iteration {}".format(NEW_ITERATION))
+            body = projection_body(context, NEW_ITERATION, dict(), packed, progress=lambda p, m: report(job, .9 + .1 * p, m))
+        gc.collect()
+    finally:
+        # the pooled backends still see the iterations before training
+        context_pool.invalidate(CONTENT_PATH)
+        sys.path.remove(CONTENT_PATH)
+    return body
 
 def clear_cache(con_paths):
     for CONTENT_PATH in con_paths.values():
@@ -320,43 +388,40 @@ def get_res():
     gridlist = dict()
 
     sys.path.append(CONTENT_PATH)
-    context = initialize_backend(CONTENT_PATH, VIS_METHOD, SETTING)
-    
-    EPOCH_START = context.strategy.config["EPOCH_START"]
-    EPOCH_PERIOD = context.strategy.config["EPOCH_PERIOD"]
-    EPOCH_END = context.strategy.config["EPOCH_END"]
-
-    # TODO Interval to be decided
-    epoch_num = (EPOCH_END - EPOCH_START)// EPOCH_PERIOD + 1
-
-    for i in range(1, epoch_num+1, 1):
-        EPOCH = (i-1)*EPOCH_PERIOD + EPOCH_START
-
-        timevis = initialize_backend(CONTENT_PATH)
-
-        # detect whether we have query before
-        fname = "Epoch" if timevis.data_provider.mode == "normal" or timevis.data_provider.mode == "abnormal" else "Iteration"
-        checkpoint_path = context.strategy.data_provider.checkpoint_path(EPOCH)
-        bgimg_path = os.path.join(checkpoint_path, "bgimg.png")
-        embedding_path = os.path.join(checkpoint_path, "embedding.npy")
-        grid_path = os.path.join(checkpoint_path, "grid.pkl")
-        if os.path.exists(bgimg_path) and os.path.exists(embedding_path) and os.path.exists(grid_path):
-            path = os.path.join(timevis.data_provider.model_path, "{}_{}".format(fname, EPOCH))
-            result_path = os.path.join(path,"embedding.npy")
-            results[str(i)] = np.load(result_path).tolist()
-            with open(os.path.join(path, "grid.pkl"), "rb") as f:
-                grid = pickle.load(f)
-            gridlist[str(i)] = grid
-        else:
-            embedding_2d, grid, _, _, _, _, _, _, _, _, _, _, _ = update_epoch_projection(timevis, EPOCH, predicates)
-            results[str(i)] = embedding_2d
-            gridlist[str(i)] = grid
-        # read background img
-        with open(bgimg_path, 'rb') as img_f:
-            img_stream = img_f.read()
-        img_stream = base64.b64encode(img_stream).decode()
-        imglist[str(i)] = 'data:image/png;base64,' + img_stream
-        # imglist[str(i)] = "http://{}{}".format(ip_adress, bgimg_path)
+    with context_pool.context(CONTENT_PATH, VIS_METHOD, SETTING) as context:
+        EPOCH_START = context.strategy.config["EPOCH_START"]
+        EPOCH_PERIOD = context.strategy.config["EPOCH_PERIOD"]
+        EPOCH_END = context.strategy.config["EPOCH_END"]
+
+        # TODO Interval to be decided
+        epoch_num = (EPOCH_END - EPOCH_START)// EPOCH_PERIOD + 1
+
+        for i in range(1, epoch_num+1, 1):
+            EPOCH = (i-1)*EPOCH_PERIOD + EPOCH_START
+
+            # detect whether we have query before
+            fname = "Epoch" if context.strategy.data_provider.mode == "normal" or context.strategy.data_provider.mode == "abnormal" else "Iteration"
+            checkpoint_path = context.strategy.data_provider.checkpoint_path(EPOCH)
+            bgimg_path = os.path.join(checkpoint_path, "bgimg.png")
+            embedding_path = os.path.join(checkpoint_path, "embedding.npy")
+            grid_path = os.path.join(checkpoint_path, "grid.pkl")
+            if os.path.exists(bgimg_path) and os.path.exists(embedding_path) and os.path.exists(grid_path):
+                path = os.path.join(context.strategy.data_provider.model_path, "{}_{}".format(fname, EPOCH))
+                result_path = os.path.join(path,"embedding.npy")
+                results[str(i)] = np.load(result_path).tolist()
+                with open(os.path.join(path, "grid.pkl"), "rb") as f:
+                    grid = pickle.load(f)
+                gridlist[str(i)] = grid
+            else:
+                embedding_2d, grid, _, _, _, _, _, _, _, _, _, _, _ = update_epoch_projection(context, EPOCH, predicates)
+                results[str(i)] = embedding_2d
+                gridlist[str(i)] = grid
+            # read background img
+            with open(bgimg_path, 'rb') as img_f:
+                img_stream = img_f.read()
+            img_stream = base64.b64encode(img_stream).decode()
+            imglist[str(i)] = 'data:image/png;base64,' + img_stream
+            # imglist[str(i)] = "http://{}{}".format(ip_adress, bgimg_path)
     sys.path.remove(CONTENT_PATH)
     
     del config
@@ -365,6 +430,33 @@ def get_res():
     add_line(API_result_path,['animation', username])  
     return make_response(jsonify({"results":results,"bgimgList":imglist, "grid": gridlist}), 200)
 
+@app.route('/jobs/<job_id>', methods=["GET"])
+@cross_origin()
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return make_response(jsonify({"message": "No job {}...".format(job_id)}), 404)
+    return make_response(jsonify(job.to_dict()), 200)
+
+@app.route('/jobs/<job_id>/result', methods=["GET"])
+@cross_origin()
+def job_result(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return make_response(jsonify({"message": "No job {}...".format(job_id)}), 404)
+    if job.status != DONE:
+        # still running (202), or failed/cancelled without a result (409)
+        return make_response(jsonify(job.to_dict()), 409 if job.status in FINISHED else 202)
+    return body_response(job.load_result())
+
+@app.route('/jobs/<job_id>/cancel', methods=["POST"])
+@cross_origin()
+def job_cancel(job_id):
+    job = job_queue.cancel(job_id)
+    if job is None:
+        return make_response(jsonify({"message": "No job {}...".format(job_id)}), 404)
+    return make_response(jsonify(job.to_dict()), 200)
+
 @app.route('/get_itertaion_structure', methods=["POST", "GET"])
 @cross_origin()
 def get_tree():
@@ -0,0 +1,190 @@
+"""Packed sprite store: all sprites/{idx}.png of a content path in one memory-mapped file with an offset index
+
+Layout of sprites.bin (little endian):
+    b"DVIS" | uint32 version | uint64 count | uint64 offsets[count+1] | png blobs
+sprite idx is blob[offsets[idx]:offsets[idx+1]], an empty blob means the sprite is missing.
+
+Usage (one-off, converts an existing sprites/ directory):
+    python sprite_store.py --content_path /path/to/content [--atlas]
+"""
+import os
+import io
+import re
+import json
+import mmap
+import struct
+import argparse
+import threading
+
+import numpy as np
+
+MAGIC = b"DVIS"
+VERSION = 1
+STORE_NAME = "sprites.bin"
+ATLAS_NAME = "sprite_atlas.png"
+ATLAS_META_NAME = "sprite_atlas.json"
+
+
+def pack_sprites(sprite_dir, store_path, atlas=False, columns=None):
+    """
+    pack sprite_dir/{idx}.png into store_path
+    :param sprite_dir: str, directory with the sprites
+    :param store_path: str, location of the packed file
+    :param atlas: bool, also save a grid atlas image (and its meta data) next to store_path, sprites need to have the same size
+    :param columns: int, number of sprites in each row of the atlas, by default the square root of the number of sprites
+    :return: int, the number of sprites
+    """
+    idxs = [int(m.group(1)) for m in (re.fullmatch(r"(\d+)\.png", f) for f in os.listdir(sprite_dir)) if m]
+    count = max(idxs) + 1 if len(idxs) else 0
+    present = set(idxs)
+
+    offsets = np.zeros(count + 1, dtype="<u8")
+    tmp_path = store_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC + struct.pack("<IQ", VERSION, count))
+        f.write(offsets.tobytes())
+        start = f.tell()
+        for idx in range(count):
+            if idx in present:
+                with open(os.path.join(sprite_dir, "{}.png".format(idx)), "rb") as img_f:
+                    f.write(img_f.read())
+            offsets[idx + 1] = f.tell() - start
+        f.seek(len(MAGIC) + struct.calcsize("<IQ"))
+        f.write(offsets.tobytes())
+    os.replace(tmp_path, store_path)
+
+    if atlas:
+        save_atlas(SpriteStore(store_path), os.path.dirname(store_path), columns)
+    return count
+
+
+def save_atlas(store, save_dir, columns=None):
+    """tile all sprites of store into one grid image, missing sprites are left transparent"""
+    from PIL import Image
+
+    count = len(store)
+    first = next(i for i in range(count) if store.has(i))
+    width, height = Image.open(io.BytesIO(store.get(first))).size
+    if columns is None:
+        columns = int(np.ceil(np.sqrt(count)))
+    rows = int(np.ceil(count / columns))
+    atlas = Image.new("RGBA", (columns * width, rows * height))
+    for idx in range(count):
+        if store.has(idx):
+            img = Image.open(io.BytesIO(store.get(idx))).convert("RGBA")
+            atlas.paste(img, ((idx % columns) * width, (idx // columns) * height))
+    atlas.save(os.path.join(save_dir, ATLAS_NAME))
+    with open(os.path.join(save_dir, ATLAS_META_NAME), "w") as f:
+        json.dump({"count": count, "columns": columns, "tile_width": width, "tile_height": height}, f)
+
+
+def _pack_blobs(idxs, blobs):
+    head = struct.pack("<I", len(idxs)) + b"".join(struct.pack("<II", idx, len(b)) for idx, b in zip(idxs, blobs))
+    return head + b"".join(blobs)
+
+
+class SpriteStore:
+    '''Read-only, memory-mapped view of a packed sprite file'''
+    def __init__(self, store_path):
+        """
+        Parameters
+        ----------
+        store_path : str
+            location of the packed file, see pack_sprites
+        """
+        self.store_path = store_path
+        self.mtime = os.stat(store_path).st_mtime_ns
+        with open(store_path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:4] != MAGIC:
+            raise ValueError("Not a packed sprite file...")
+        _, count = struct.unpack_from("<IQ", self._mm, 4)
+        head = len(MAGIC) + struct.calcsize("<IQ")
+        self.offsets = np.frombuffer(self._mm, dtype="<u8", count=count + 1, offset=head)
+        self._start = head + 8 * (count + 1)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def has(self, idx):
+        return 0 <= idx < len(self) and self.offsets[idx + 1] > self.offsets[idx]
+
+    def get(self, idx):
+        """png bytes of sprite idx"""
+        if not self.has(idx):
+            raise KeyError(idx)
+        return self._mm[self._start + int(self.offsets[idx]):self._start + int(self.offsets[idx + 1])]
+
+    def get_many(self, idxs):
+        """
+        pack the sprites of idxs into one binary body
+        layout: uint32 n | n x (uint32 idx, uint32 length) | png blobs in the same order, missing sprites have length 0
+        :param idxs: list of int
+        :return: bytes
+        """
+        blobs = [self.get(idx) if self.has(idx) else b"" for idx in idxs]
+        return _pack_blobs(idxs, blobs)
+
+
+_stores = dict()
+_lock = threading.Lock()
+
+def open_store(content_path):
+    """
+    the packed sprites of content_path, reopened when the packed file changes
+    :return: SpriteStore, None if the sprites are not packed
+    """
+    store_path = os.path.join(content_path, STORE_NAME)
+    if not os.path.exists(store_path):
+        return None
+    mtime = os.stat(store_path).st_mtime_ns
+    with _lock:
+        store = _stores.get(store_path)
+        if store is None or store.mtime != mtime:
+            store = SpriteStore(store_path)
+            _stores[store_path] = store
+        return store
+
+
+def read_sprite(content_path, idx):
+    """png bytes of sprite idx, from the packed file when there is one and from sprites/{idx}.png otherwise"""
+    store = open_store(content_path)
+    if store is not None and store.has(idx):
+        return store.get(idx)
+    with open(os.path.join(content_path, "sprites", "{}.png".format(idx)), "rb") as img_f:
+        return img_f.read()
+
+
+def read_sprites(content_path, idxs):
+    """
+    the sprites of idxs in one binary body, see SpriteStore.get_many
+    :return: (bytes, str), the body and a version tag of the sprites it was read from
+    """
+    store = open_store(content_path)
+    if store is not None:
+        return store.get_many(idxs), "{}".format(store.mtime)
+    sprite_dir = os.path.join(content_path, "sprites")
+    blobs = list()
+    # overwriting a png in place does not touch the directory, so the version comes from the files read
+    version = os.stat(sprite_dir).st_mtime_ns
+    for idx in idxs:
+        sprite_path = os.path.join(sprite_dir, "{}.png".format(idx))
+        if os.path.exists(sprite_path):
+            with open(sprite_path, "rb") as img_f:
+                version = max(version, os.fstat(img_f.fileno()).st_mtime_ns)
+                blobs.append(img_f.read())
+        else:
+            blobs.append(b"")
+    return _pack_blobs(idxs, blobs), "{}".format(version)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Pack the sprites of a content path into one file...')
+    parser.add_argument('--content_path', type=str)
+    parser.add_argument('--atlas', action='store_true', help='also save a grid atlas image')
+    parser.add_argument('--columns', type=int, default=None, help='sprites in each row of the atlas')
+    args = parser.parse_args()
+
+    CONTENT_PATH = args.content_path
+    num = pack_sprites(os.path.join(CONTENT_PATH, "sprites"), os.path.join(CONTENT_PATH, STORE_NAME), atlas=args.atlas, columns=args.columns)
+    print("Successfully pack {} sprites into {}...".format(num, os.path.join(CONTENT_PATH, STORE_NAME)))
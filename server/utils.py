@@ -6,10 +6,14 @@ import numpy as np
 import sys
 import pickle
 import base64
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 
 vis_path = ".."
 sys.path.append(vis_path)
 from context import VisContext, ActiveLearningContext, AnormalyContext
+import payload
 from strategy import DeepDebugger, TimeVis, tfDeepVisualInsight, DVIAL, tfDVIDenseAL, TimeVisDenseAL
 
 """Interface align"""
@@ -57,8 +61,8 @@ def initialize_context(strategy, setting):
         raise NotImplementedError
     return context
 
-def initialize_backend(CONTENT_PATH, VIS_METHOD, SETTING, dense=False):
-    """ initialize backend for visualization
+def build_backend(CONTENT_PATH, VIS_METHOD, SETTING, dense=False):
+    """ initialize a new backend for visualization, see ContextPool.context for the pooled one
 
     Args:
         CONTENT_PATH (str): the directory to training process
@@ -78,7 +82,119 @@ def initialize_backend(CONTENT_PATH, VIS_METHOD, SETTING, dense=False):
     return context
 
 
-def update_epoch_projection(context, EPOCH, predicates):
+def context_nbytes(context):
+    """bytes held in the caches of the data provider and projector of a context, an estimate for the memory budget of the pool"""
+    strategy = context.strategy
+    nbytes = getattr(strategy.data_provider, "cache_nbytes", 0)
+    nbytes += getattr(strategy.projector, "cache_nbytes", 0)
+    return nbytes
+
+
+class _PoolEntry:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.context = None
+        # size of the caches when the backend was last released, see context_nbytes
+        self.nbytes = 0
+
+
+class ContextPool:
+    '''Process-wide pool of initialized backends keyed by (content_path, vis_method, setting, dense).
+
+    Each backend is built once and then served to every request.
+    Requests on the same backend are serialized by its lock, requests on different backends run in parallel.
+    The least recently used idle backends are evicted once their caches exceed max_bytes.
+    '''
+    def __init__(self, max_bytes=8*1024**3):
+        """
+        Parameters
+        ----------
+        max_bytes : int
+            memory budget over the caches of all pooled backends, by default 8GB
+        """
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def _entry(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = _PoolEntry()
+                self._entries[key] = entry
+            self._entries.move_to_end(key)
+            return entry
+
+    @contextmanager
+    def context(self, CONTENT_PATH, VIS_METHOD, SETTING, dense=False):
+        """
+        hold the backend of (CONTENT_PATH, VIS_METHOD, SETTING, dense), built on first use
+        :return: context manager yielding the backend, no other request uses it until the with block exits
+        """
+        key = (os.path.normpath(CONTENT_PATH), VIS_METHOD, SETTING, dense)
+        entry = self._entry(key)
+        try:
+            with entry.lock:
+                if entry.context is None:
+                    # strategies import Model.model from the content path
+                    sys.path.append(key[0])
+                    try:
+                        entry.context = build_backend(key[0], VIS_METHOD, SETTING, dense)
+                    finally:
+                        sys.path.remove(key[0])
+                try:
+                    yield entry.context
+                finally:
+                    # measured under the lock of the backend, no other thread mutates its caches meanwhile
+                    entry.nbytes = context_nbytes(entry.context)
+        finally:
+            self.evict()
+
+    def invalidate(self, CONTENT_PATH=None):
+        """
+        drop the backends of CONTENT_PATH (all backends if None), e.g. after al_train produces a new iteration
+        requests holding one of them keep using it, the next request builds a new one
+        """
+        with self._lock:
+            for key in list(self._entries.keys()):
+                if CONTENT_PATH is None or key[0] == os.path.normpath(CONTENT_PATH):
+                    del self._entries[key]
+
+    def evict(self):
+        """
+        drop the least recently used idle backends until the pool fits in max_bytes, the most recent one is always kept
+        sizes are the ones recorded when the backends were last released, busy backends are not measured
+        """
+        with self._lock:
+            sizes = OrderedDict((key, entry.nbytes) for key, entry in self._entries.items() if entry.context is not None)
+            total = sum(sizes.values())
+            for key in list(sizes.keys())[:-1]:
+                if total <= self.max_bytes:
+                    break
+                entry = self._entries[key]
+                # a backend in use is never evicted
+                if not entry.lock.acquire(blocking=False):
+                    continue
+                try:
+                    del self._entries[key]
+                finally:
+                    entry.lock.release()
+                total -= sizes[key]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+context_pool = ContextPool()
+
+
+def epoch_projection(context, EPOCH, predicates, progress=None):
+    """
+    the projection of EPOCH as arrays, shared by the json and the packed response
+    :param progress: function, (fraction, message) -> None, called between the steps, e.g. Job.update, which may raise to cancel
+    """
+    if progress is None:
+        progress = lambda fraction, message: None
     # TODO consider active learning setting
 
     train_data = context.train_representation_data(EPOCH)
@@ -93,13 +209,12 @@ def update_epoch_projection(context, EPOCH, predicates):
     if os.path.exists(embedding_path):
         embedding_2d = np.load(embedding_path)
     else:
+        progress(.1, "projecting epoch {}".format(EPOCH))
         embedding_2d = context.strategy.projector.batch_project(EPOCH, all_data)
         np.save(embedding_path, embedding_2d)
 
     training_data_number = context.strategy.config["TRAINING"]["train_num"]
     testing_data_number = context.strategy.config["TRAINING"]["test_num"]
-    training_data_index = list(range(training_data_number))
-    testing_data_index = list(range(training_data_number, training_data_number + testing_data_number))
 
     # return the image of background
     # read cache if exists
@@ -112,6 +227,7 @@ def update_epoch_projection(context, EPOCH, predicates):
             img_stream = img_f.read()
         b_fig = base64.b64encode(img_stream).decode()
     else:
+        progress(.4, "rendering the background of epoch {}".format(EPOCH))
         x_min, y_min, x_max, y_max, b_fig = context.strategy.vis.get_background(EPOCH, context.strategy.config["VISUALIZATION"]["RESOLUTION"])
         grid = [x_min, y_min, x_max, y_max]
         # formating
@@ -122,6 +238,7 @@ def update_epoch_projection(context, EPOCH, predicates):
             pickle.dump(grid, f)
         np.save(embedding_path, embedding_2d)
     
+    progress(.8, "collecting the attributes of epoch {}".format(EPOCH))
     # TODO fix its structure
     file_name = context.strategy.config["VISUALIZATION"]["EVALUATION_NAME"]
     evaluation = context.strategy.evaluator.get_eval(file_name=file_name)
@@ -133,36 +250,77 @@ def update_epoch_projection(context, EPOCH, predicates):
     color = color.astype(int)
 
     CLASSES = np.array(context.strategy.config["CLASSES"])
-    label_color_list = color[labels].tolist()
-    label_list = CLASSES[labels].tolist()
-    label_name_dict = dict(enumerate(CLASSES))
-
-    prediction_list = []
-    prediction = context.strategy.data_provider.get_pred(EPOCH, all_data).argmax(1)
+    table = context.attribute_table(EPOCH)
+    prediction = table["pred"]
 
-    for i in range(len(prediction)):
-        prediction_list.append(CLASSES[prediction[i]])
-    
     max_iter = context.get_max_iter()
     
     # current_index = timevis.get_epoch_index(EPOCH)
     # selected_points = np.arange(training_data_number + testing_data_number)[current_index]
-    selected_points = np.arange(training_data_number + testing_data_number)
-    for key in predicates.keys():
-        if key == "label":
-            tmp = np.array(context.filter_label(predicates[key]))
-        elif key == "type":
-            tmp = np.array(context.filter_type(predicates[key], int(EPOCH)))
-        else:
-            tmp = np.arange(training_data_number + testing_data_number)
-        selected_points = np.intersect1d(selected_points, tmp)
-    
-    properties = np.concatenate((np.zeros(training_data_number, dtype=np.int16), 2*np.ones(testing_data_number, dtype=np.int16)), axis=0)
-    lb = context.get_epoch_index(EPOCH)
-    ulb = np.setdiff1d(training_data_index, lb)
-    properties[ulb] = 1
-    
-    return embedding_2d.tolist(), grid, b_fig, label_name_dict, label_color_list, label_list, max_iter, training_data_index, testing_data_index, eval_new, prediction_list, selected_points, properties
+    selected_points = context.filter_points(predicates, EPOCH)
+    # 0 labeled, 1 unlabeled, 2 test
+    properties = table["split"].astype(np.int16)
+
+    return {
+        "embedding": embedding_2d,
+        "grid": grid,
+        "decision_view": b_fig,
+        "classes": CLASSES,
+        "colors": color,
+        "labels": labels,
+        "predictions": prediction,
+        "max_iter": max_iter,
+        "train_num": training_data_number,
+        "test_num": testing_data_number,
+        "evaluation": eval_new,
+        "selected_points": selected_points,
+        "properties": properties,
+    }
+
+
+def update_epoch_projection(context, EPOCH, predicates, progress=None):
+    proj = epoch_projection(context, EPOCH, predicates, progress)
+    CLASSES = proj["classes"]
+    labels = proj["labels"]
+
+    training_data_index = list(range(proj["train_num"]))
+    testing_data_index = list(range(proj["train_num"], proj["train_num"] + proj["test_num"]))
+    label_color_list = proj["colors"][labels].tolist()
+    label_list = CLASSES[labels].tolist()
+    label_name_dict = dict(enumerate(CLASSES))
+    prediction_list = CLASSES[proj["predictions"]].tolist()
+
+    return proj["embedding"].tolist(), proj["grid"], proj["decision_view"], label_name_dict, label_color_list, label_list, proj["max_iter"], \
+        training_data_index, testing_data_index, proj["evaluation"], prediction_list, proj["selected_points"], proj["properties"]
+
+
+def pack_epoch_projection(context, EPOCH, predicates, progress=None):
+    """
+    the projection of EPOCH as typed arrays behind a small json header, see payload.pack
+    train samples come first and test samples last, as in the json response
+    :return: bytes
+    """
+    proj = epoch_projection(context, EPOCH, predicates, progress)
+    classes = proj["classes"]
+    header = {
+        "grid_index": proj["grid"],
+        "grid_color": 'data:image/png;base64,' + proj["decision_view"],
+        "label_name_dict": dict(enumerate(classes.tolist())),
+        "label_color_table": proj["colors"].tolist(),
+        "maximum_iteration": proj["max_iter"],
+        "train_num": proj["train_num"],
+        "test_num": proj["test_num"],
+        "evaluation": proj["evaluation"],
+    }
+    ids = payload.id_dtype(len(classes))
+    buffers = {
+        "result": proj["embedding"].astype(np.float32),
+        "label_list": proj["labels"].astype(ids),
+        "prediction_list": proj["predictions"].astype(ids),
+        "properties": proj["properties"].astype(np.uint8),
+        "selectedPoints": proj["selected_points"].astype(np.uint32),
+    }
+    return payload.pack(header, buffers)
 
 
 def add_line(path, data_row):
@@ -0,0 +1,195 @@
+"""Columnar per-epoch attribute table of all (train+test) samples, predicates are evaluated as boolean masks over its columns"""
+import os
+from collections import OrderedDict
+
+import numpy as np
+from scipy.special import softmax
+
+from singleVis.utils import is_B
+
+# split codes, same as the properties of the frontend
+LABELED = 0
+UNLABELED = 1
+TEST = 2
+
+# name -> (function, whether a sorted index is kept for range queries)
+ATTRIBUTES = OrderedDict()
+
+
+def attribute(name, sort=False):
+    """
+    register a column of the attribute table
+    the function gets the inputs of a table (see AttributeTable.build) and returns one value per sample
+    :param name: str, the column name, also the predicate key in queries
+    :param sort: bool, keep a sorted index of the column for range queries
+    """
+    def register(fn):
+        ATTRIBUTES[name] = (fn, sort)
+        return fn
+    return register
+
+
+@attribute("label")
+def _label(inputs):
+    return inputs["labels"].astype(np.int64)
+
+
+@attribute("pred")
+def _pred(inputs):
+    return inputs["pred"].argmax(1)
+
+
+@attribute("confidence", sort=True)
+def _confidence(inputs):
+    return inputs["prob"].max(1).astype(np.float32)
+
+
+@attribute("margin", sort=True)
+def _margin(inputs):
+    top = np.sort(inputs["prob"], axis=1)
+    if top.shape[1] < 2:
+        return top[:, -1].astype(np.float32)
+    return (top[:, -1] - top[:, -2]).astype(np.float32)
+
+
+@attribute("split")
+def _split(inputs):
+    split = np.full(inputs["train_num"] + inputs["test_num"], UNLABELED, dtype=np.uint8)
+    split[inputs["labeled"]] = LABELED
+    split[inputs["train_num"]:] = TEST
+    return split
+
+
+@attribute("border")
+def _border(inputs):
+    return is_B(inputs["pred"])
+
+
+class AttributeTable:
+    '''Columns of per-sample attributes of an epoch, persisted as one .npz file next to the epoch.
+
+    Columns registered with sort=True also keep the argsort of the column,
+    so that a range query is two binary searches instead of a scan.
+    '''
+    def __init__(self, columns, orders=None):
+        """
+        Parameters
+        ----------
+        columns : dict
+            name -> ndarray of shape (N,)
+        orders : dict, optional
+            name -> argsort of the column, for the sorted columns
+        """
+        self.columns = dict(columns)
+        self.orders = dict() if orders is None else dict(orders)
+        self._sorted = dict()
+
+    def __len__(self):
+        return len(next(iter(self.columns.values())))
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    @classmethod
+    def build(cls, labels, pred, train_num, test_num, labeled):
+        """
+        compute every registered attribute
+        :param labels: ndarray, (N,), train labels followed by test labels
+        :param pred: ndarray, (N, class_num), logits of the same samples
+        :param train_num: int
+        :param test_num: int
+        :param labeled: ndarray of int, index of the labeled train samples
+        :return: AttributeTable
+        """
+        inputs = {
+            "labels": np.asarray(labels),
+            "pred": pred,
+            "prob": softmax(pred, axis=1),
+            "train_num": train_num,
+            "test_num": test_num,
+            "labeled": np.asarray(labeled, dtype=np.int64),
+        }
+        columns = dict()
+        orders = dict()
+        for name, (fn, sort) in ATTRIBUTES.items():
+            columns[name] = np.asarray(fn(inputs))
+            if sort:
+                orders[name] = np.argsort(columns[name], kind="stable")
+        return cls(columns, orders)
+
+    def save(self, path):
+        arrays = {"col_" + name: value for name, value in self.columns.items()}
+        arrays.update({"ord_" + name: value for name, value in self.orders.items()})
+        # np.savez appends .npz to other names
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            columns = {k[4:]: f[k] for k in f.files if k.startswith("col_")}
+            orders = {k[4:]: f[k] for k in f.files if k.startswith("ord_")}
+        return cls(columns, orders)
+
+    @classmethod
+    def load_or_build(cls, path, sources, build):
+        """
+        the table saved in path, rebuilt by build() if it is missing, older than any of sources or misses a registered attribute
+        :param path: str, location of the .npz file
+        :param sources: list of str, files the table is computed from, missing ones are ignored
+        :param build: function, () -> AttributeTable
+        :return: AttributeTable
+        """
+        if os.path.exists(path):
+            mtime = os.path.getmtime(path)
+            if all(not os.path.exists(s) or os.path.getmtime(s) <= mtime for s in sources):
+                table = cls.load(path)
+                if all(name in table.columns for name in ATTRIBUTES):
+                    return table
+        table = build()
+        table.save(path)
+        return table
+
+    #################################################################################################################
+    #                                                                                                               #
+    #                                                  Predicates                                                   #
+    #                                                                                                               #
+    #################################################################################################################
+
+    def all(self):
+        return np.ones(len(self), dtype=bool)
+
+    def equal(self, name, value):
+        """mask of samples whose attribute name is value"""
+        return self.columns[name] == value
+
+    def isin(self, name, values):
+        """mask of samples whose attribute name is one of values"""
+        return np.isin(self.columns[name], values)
+
+    def between(self, name, lo, hi):
+        """mask of samples with lo <= attribute name <= hi, through the sorted index when there is one"""
+        column = self.columns[name]
+        order = self.orders.get(name)
+        if order is None:
+            return np.logical_and(column >= lo, column <= hi)
+        if name not in self._sorted:
+            self._sorted[name] = column[order]
+        sorted_column = self._sorted[name]
+        start = np.searchsorted(sorted_column, lo, side="left")
+        end = np.searchsorted(sorted_column, hi, side="right")
+        mask = np.zeros(len(column), dtype=bool)
+        mask[order[start:end]] = True
+        return mask
+
+    def select(self, masks):
+        """
+        index of the samples satisfying all masks
+        :param masks: list of boolean ndarray
+        :return: ndarray of int
+        """
+        mask = self.all()
+        for m in masks:
+            mask &= m
+        return np.flatnonzero(mask)
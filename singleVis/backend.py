@@ -7,7 +7,8 @@ import time
 import numpy as np
 import tensorflow as tf
 from scipy.special import softmax
-from pynndescent import NNDescent
+# kept importable from backend
+from singleVis.utils import find_neighbor_preserving_rate
 
 
 def get_graph_elements(graph_, n_epochs):
@@ -118,76 +119,56 @@ def compute_cross_entropy_tf(
     return attraction_term, repellent_term, CE
 
 
-def find_neighbor_preserving_rate(prev_data, train_data, n_neighbors):
-    """
-    neighbor preserving rate, (0, 1)
-    :param prev_data: ndarray, shape(N,2) low dimensional embedding from last epoch
-    :param train_data: ndarray, shape(N,2) low dimensional embedding from current epoch
-    :param n_neighbors:
-    :return alpha: ndarray, shape (N,)
-    """
-    if prev_data is None:
-        return np.zeros(len(train_data))
-    # number of trees in random projection forest
-    n_trees = min(64, 5 + int(round((train_data.shape[0]) ** 0.5 / 20.0)))
-    # max number of nearest neighbor iters to perform
-    n_iters = max(5, int(round(np.log2(train_data.shape[0]))))
-    # distance metric
-    metric = "euclidean"
-
-    # get nearest neighbors
-    nnd = NNDescent(
-        train_data,
-        n_neighbors=n_neighbors,
-        metric=metric,
-        n_trees=n_trees,
-        n_iters=n_iters,
-        max_candidates=60,
-        verbose=False
-    )
-    train_indices, _ = nnd.neighbor_graph
-    prev_nnd = NNDescent(
-        prev_data,
-        n_neighbors=n_neighbors,
-        metric="euclidean",
-        n_trees=n_trees,
-        n_iters=n_iters,
-        max_candidates=60,
-        verbose=False
-    )
-    prev_indices, _ = prev_nnd.neighbor_graph
-    temporal_pres = np.zeros(len(train_data))
-    for i in range(len(train_indices)):
-        pres = np.intersect1d(train_indices[i], prev_indices[i])
-        temporal_pres[i] = len(pres) / float(n_neighbors)
-    return temporal_pres
+def _top2_gradients(model, b):
+    """gradients of the top-1 and top-2 logits w.r.t. a batch b, one backward pass each"""
+    b.requires_grad = True
+    out = model(b)
+    order = torch.argsort(out, dim=1)
+    top1 = out.gather(1, order[:, -1:]).sum()
+    top2 = out.gather(1, order[:, -2:-1]).sum()
+    # samples are independent (model in eval mode), so the gradient of the sum is the per-sample gradient
+    grad1, = torch.autograd.grad(top1, b, retain_graph=True)
+    grad2, = torch.autograd.grad(top2, b)
+    return grad1, grad2
+
+
+def _top2_gradients_vmap(model, b):
+    """per-sample gradients of the top-1 and top-2 logits with torch.func.vmap"""
+    from torch.func import grad, vmap
 
+    with torch.no_grad():
+        order = torch.argsort(model(b), dim=1)
 
-def get_attention(model, data, device, temperature=.01, verbose=1):
+    def logit(x, k):
+        return model(x.unsqueeze(0))[0, k]
+
+    grad_fn = vmap(grad(logit))
+    return grad_fn(b, order[:, -1]), grad_fn(b, order[:, -2])
+
+
+def get_attention(model, data, device, temperature=.01, verbose=1, batch_size=1000, method="autograd"):
+    """
+    attention of each sample, softmax(|d top1 / dx| + |d top2 / dx|) with temperature
+    :param model: function, the prediction function of subject model in eval mode
+    :param data: numpy.ndarray, representations
+    :param device: torch.device
+    :param temperature: float
+    :param verbose: int
+    :param batch_size: int, number of samples per forward/backward pass
+    :param method: str, "autograd" (one backward pass per logit and batch) or "vmap" (torch.func)
+    :return: numpy.ndarray, same shape as data
+    """
     t0 = time.time()
-    grad_list = []
-
-    for i in range(len(data)):
-        b = torch.from_numpy(data[i:i + 1]).to(device=device, dtype=torch.float)
-        b.requires_grad = True
-        out = model(b)
-        top1 = torch.argsort(out)[0][-1]
-        out[0][top1].backward()
-        grad_list.append(b.grad.data.detach().cpu().numpy())
-    grad_list2 = []
-
-    for i in range(len(data)):
-        b = torch.from_numpy(data[i:i + 1]).to(device=device, dtype=torch.float)
-        b.requires_grad = True
-        out = model(b)
-        top2 = torch.argsort(out)[0][-2]
-        out[0][top2].backward()
-        grad_list2.append(b.grad.data.detach().cpu().numpy())
+    top2_gradients = _top2_gradients_vmap if method == "vmap" else _top2_gradients
+    grad1 = np.empty(data.shape, dtype=np.float32)
+    grad2 = np.empty(data.shape, dtype=np.float32)
+
+    for i in range(0, len(data), batch_size):
+        b = torch.from_numpy(np.ascontiguousarray(data[i:i + batch_size])).to(device=device, dtype=torch.float)
+        g1, g2 = top2_gradients(model, b)
+        grad1[i:i + batch_size] = g1.detach().cpu().numpy()
+        grad2[i:i + batch_size] = g2.detach().cpu().numpy()
     t1 = time.time()
-    grad1 = np.array(grad_list)
-    grad2 = np.array(grad_list2)
-    grad1 = grad1.squeeze(axis=1)
-    grad2 = grad2.squeeze(axis=1)
     grad = np.abs(grad1) + np.abs(grad2)
     grad = softmax(grad/temperature, axis=1)
     t2 = time.time()
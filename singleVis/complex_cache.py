@@ -0,0 +1,112 @@
+"""The ComplexCache keeps constructed complexes on disk so that re-training a visualization model with other loss or optimizer settings does not rebuild them"""
+import os
+import json
+import shutil
+import hashlib
+import time
+
+import numpy as np
+
+
+class ComplexCache:
+    '''Persistent cache of constructed complexes, one directory of .npy files per entry.
+
+    Entries are keyed by a hash of the construction parameters and of the files the complex is built from
+    (path, size and modification time), so regenerating representations or changing a parameter misses the cache.
+    The least recently used entries are evicted once the cache grows over max_bytes.
+    '''
+    def __init__(self, cache_dir, max_bytes=20*2**30):
+        """
+        Parameters
+        ----------
+        cache_dir : str
+            directory of the cache, e.g. content_path/complex_cache
+        max_bytes : int
+            size cap of the cache, by default 20GB
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, params, files=()):
+        """
+        key of a complex
+        :param params: dict, json serializable construction parameters
+        :param files: list of str, the files the complex is built from
+        :return: str
+        """
+        h = hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode())
+        for path in files:
+            stat = os.stat(path)
+            h.update("{}:{}:{}".format(os.path.abspath(path), stat.st_size, stat.st_mtime_ns).encode())
+        return h.hexdigest()
+
+    def _entry(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def load(self, key, mmap_mode=None):
+        """
+        load a cached complex
+        :param key: str
+        :param mmap_mode: None to read the arrays into memory, "r" to memory-map them
+        :return: dict of arrays and values, None if not cached
+        """
+        entry = self._entry(key)
+        meta_path = os.path.join(entry, "meta.json")
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, "r") as f:
+            meta = json.load(f)
+        outputs = dict(meta["values"])
+        for name in meta["arrays"]:
+            outputs[name] = np.load(os.path.join(entry, name + ".npy"), mmap_mode=mmap_mode)
+        # mark as recently used
+        os.utime(meta_path)
+        return outputs
+
+    def save(self, key, outputs):
+        """
+        cache a complex and evict old entries
+        :param key: str
+        :param outputs: dict, numpy arrays are saved as .npy, other values must be json serializable
+        """
+        entry = self._entry(key)
+        tmp = entry + ".tmp{}".format(os.getpid())
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        arrays = [name for name, value in outputs.items() if isinstance(value, np.ndarray)]
+        for name in arrays:
+            np.save(os.path.join(tmp, name + ".npy"), outputs[name])
+        values = {name: value for name, value in outputs.items() if name not in arrays}
+        with open(os.path.join(tmp, "meta.json"), "w") as f:
+            json.dump({"arrays": arrays, "values": values, "time": time.time()}, f)
+        shutil.rmtree(entry, ignore_errors=True)
+        os.replace(tmp, entry)
+        self.evict(keep=key)
+
+    def invalidate(self, key=None):
+        """remove the entry key, or every entry if key is None"""
+        if key is not None:
+            shutil.rmtree(self._entry(key), ignore_errors=True)
+            return
+        for name in os.listdir(self.cache_dir):
+            shutil.rmtree(self._entry(name), ignore_errors=True)
+
+    def evict(self, keep=None):
+        """remove the least recently used entries until the cache fits in max_bytes, except keep"""
+        entries = list()
+        for name in os.listdir(self.cache_dir):
+            entry = self._entry(name)
+            meta_path = os.path.join(entry, "meta.json")
+            if not os.path.exists(meta_path):
+                continue
+            size = sum(os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry))
+            entries.append((os.stat(meta_path).st_mtime, name, size))
+        total = sum(size for _, _, size in entries)
+        for _, name, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            shutil.rmtree(self._entry(name), ignore_errors=True)
+            total -= size
@@ -3,10 +3,13 @@ from abc import ABC, abstractmethod
 
 import os
 import gc
+import copy
 import time
+from collections import OrderedDict
 
 from singleVis.utils import *
 from singleVis.eval.evaluate import evaluate_inv_accu
+from singleVis.representation_store import RepresentationStore
 
 """
 DataContainder module
@@ -58,6 +61,11 @@ class DataProvider(DataProviderAbstractClass):
         self.verbose = verbose
         self.epoch_name = epoch_name
         self.model_path = os.path.join(self.content_path, "Model")
+        self.store = RepresentationStore()
+        # subject model state dicts kept in memory
+        self.state_cache_size = 8
+        self._subject_states = OrderedDict()
+        self._subject_loaded = None
         if verbose:
             print("Finish initialization...")
 
@@ -83,167 +91,369 @@ class DataProvider(DataProviderAbstractClass):
     def _estimate_boundary(self):
         raise NotImplementedError
 
+    def _generate_border_sets(self, training_data, confs, preds, repr_model, num, l_bound, save_dir, share_pool=True, reuse_pool=False):
+        """
+        generate the border points for both border_centers.npy and test_border_centers.npy
+        :param training_data: torch.Tensor, inputs to mix
+        :param confs: numpy.ndarray, logits of training_data
+        :param preds: numpy.ndarray, predictions of training_data
+        :param repr_model: feature function of the subject model
+        :param num: int, the number of border points in each set
+        :param l_bound: lower bound to conduct mix-up attack
+        :param save_dir: str, the checkpoint directory of this epoch
+        :param share_pool: bool, generate one pool of 2*num points in a single pass and split it deterministically
+        :param reuse_pool: bool, reuse ori_border_centers.npy and test_ori_border_centers.npy if they are already written
+        :return: border_points, border_centers, test_border_points, test_border_centers, the generation time,
+            the mode ("reused", "shared_pool" or "separate") and the number of mix-up attacks run
+        """
+        train_loc = os.path.join(save_dir, "ori_border_centers.npy")
+        test_loc = os.path.join(save_dir, "test_ori_border_centers.npy")
+        t0 = time.time()
+        if reuse_pool and os.path.exists(train_loc) and os.path.exists(test_loc):
+            train_pool = np.load(train_loc)[:num]
+            pool = np.concatenate((train_pool, np.load(test_loc)[:num]), axis=0)
+            pool = torch.from_numpy(pool).to(self.DEVICE)
+            split = len(train_pool)
+            mode, attacks = "reused", 0
+        elif share_pool:
+            pool, _, tot_num = get_border_points(model=self.model, input_x=training_data, confs=confs, predictions=preds, device=self.DEVICE, l_bound=l_bound, num_adv_eg=2*num, lambd=0.05, verbose=0)
+            # deterministic split, successes are ordered by attack direction
+            perm = np.random.RandomState(0).permutation(len(pool))
+            pool = pool[torch.from_numpy(perm).to(pool.device)]
+            # halves even if fewer than 2*num points were found
+            split = (len(pool) + 1) // 2
+            mode, attacks = "shared_pool", int(tot_num.sum())
+        else:
+            border_points, _, tot_num = get_border_points(model=self.model, input_x=training_data, confs=confs, predictions=preds, device=self.DEVICE, l_bound=l_bound, num_adv_eg=num, lambd=0.05, verbose=0)
+            test_border_points, _, test_tot_num = get_border_points(model=self.model, input_x=training_data, confs=confs, predictions=preds, device=self.DEVICE, l_bound=l_bound, num_adv_eg=num, lambd=0.05, verbose=0)
+            pool = torch.cat((border_points, test_border_points), dim=0)
+            split = len(border_points)
+            mode, attacks = "separate", int(tot_num.sum() + test_tot_num.sum())
+        t1 = time.time()
 
-class NormalDataProvider(DataProvider):
-    def __init__(self, content_path, model, epoch_start, epoch_end, epoch_period, device, classes, epoch_name, verbose=1):
-        super().__init__(content_path, model, epoch_start, epoch_end, epoch_period, device, classes, epoch_name, verbose)
-        self.mode = "normal"
-    
-    @property
-    def representation_dim(self):
-        train_data_loc = os.path.join(self.model_path, "{}_{:d}".format(self.epoch_name, self.s), "train_data.npy")
-        try:
-            train_data = np.load(train_data_loc)
-            repr_dim = np.prod(train_data.shape[1:])
-            return repr_dim
-        except Exception as e:
-            return None
-
-    def _meta_data(self):
-        time_inference = list()
+        # get gap layer data
+        pool = pool.to(self.DEVICE)
+        pool_centers = batch_run(repr_model, pool)
+        pool = pool.cpu().numpy()
+        return pool[:split], pool_centers[:split], pool[split:], pool_centers[split:], t1 - t0, mode, attacks
+
+    def _save_border_sets(self, save_dir, border_points, border_centers, test_border_points, test_border_centers):
+        np.save(os.path.join(save_dir, "border_centers.npy"), border_centers)
+        np.save(os.path.join(save_dir, "ori_border_centers.npy"), border_points)
+        np.save(os.path.join(save_dir, "test_border_centers.npy"), test_border_centers)
+        np.save(os.path.join(save_dir, "test_ori_border_centers.npy"), test_border_points)
+
+    def _load_training_data(self):
         training_data_path = os.path.join(self.content_path, "Training_data")
         training_data = torch.load(os.path.join(training_data_path, "training_dataset_data.pth"),
-                                        map_location="cpu")
-        training_data = training_data.to(self.DEVICE)
+                                   map_location="cpu")
+        return training_data.to(self.DEVICE)
+
+    def _load_testing_data(self):
         testing_data_path = os.path.join(self.content_path, "Testing_data")
         testing_data = torch.load(os.path.join(testing_data_path, "testing_dataset_data.pth"),
-                                       map_location="cpu")
-        testing_data = testing_data.to(self.DEVICE)
+                                  map_location="cpu")
+        return testing_data.to(self.DEVICE)
 
-        for n_epoch in range(self.s, self.e + 1, self.p):
-            t_s = time.time()
+    def fork(self):
+        """
+        shallow copy with caches of its own, for another thread, e.g. a producer building complexes ahead of training
+        the store and the subject state cache are not locked, so the copy must not share them with self,
+        it still shares self.model, whose loaded state is tracked on the model itself (see _subject_loaded)
+        """
+        data_provider = copy.copy(self)
+        data_provider.store = RepresentationStore(self.store.capacity)
+        data_provider._subject_states = OrderedDict()
+        return data_provider
 
-            # make it possible to choose a subset of testing data for testing
-            test_index_file = os.path.join(self.model_path, "{}_{:d}".format(self.epoch_name, n_epoch), "test_index.json")
-            if os.path.exists(test_index_file):
-                test_index = load_labelled_data_index(test_index_file)
-            else:
-                test_index = range(len(testing_data))
-            testing_data = testing_data[test_index]
+    @property
+    def cache_nbytes(self):
+        """bytes held by the in-memory caches (gathered representations and subject model state dicts)"""
+        states = sum(t.numel()*t.element_size() for state_dict in self._subject_states.values() for t in state_dict.values() if torch.is_tensor(t))
+        return self.store.nbytes + states
+
+    def _subject_state(self, model_location):
+        """state dict saved in model_location, the last state_cache_size of them are kept in memory"""
+        key = (model_location, os.stat(model_location).st_mtime_ns)
+        if key in self._subject_states:
+            self._subject_states.move_to_end(key)
+        else:
+            self._subject_states[key] = torch.load(model_location, map_location=torch.device("cpu"))
+            while len(self._subject_states) > self.state_cache_size:
+                self._subject_states.popitem(last=False)
+        return key, self._subject_states[key]
+
+    @property
+    def _subject_loaded(self):
+        # the key of the state dict in self.model, kept on the model since copies of a provider share it
+        return getattr(self.model, "_subject_loaded", None)
+
+    @_subject_loaded.setter
+    def _subject_loaded(self, key):
+        self.model._subject_loaded = key
+
+    def _load_subject_model(self, save_dir):
+        """load the state dict saved in save_dir into self.model, unless it is there already"""
+        model_location = os.path.join(save_dir, "subject_model.pth")
+        key, state_dict = self._subject_state(model_location)
+        if key == self._subject_loaded:
+            return
+        self.model.load_state_dict(state_dict)
+        self.model = self.model.to(self.DEVICE)
+        self.model.eval()
+        self._subject_loaded = key
 
-            model_location = os.path.join(self.model_path, "{}_{:d}".format(self.epoch_name, n_epoch), "subject_model.pth")
-            self.model.load_state_dict(torch.load(model_location, map_location=torch.device("cpu")))
-            self.model = self.model.to(self.DEVICE)
-            self.model.eval()
+    def _head_keys(self):
+        """state dict keys of self.model for the parameters and buffers of the prediction head, None if it is not a module"""
+        head = self.model.prediction
+        if not isinstance(head, torch.nn.Module):
+            return None
+        names = dict()
+        for name, value in self.model.state_dict(keep_vars=True).items():
+            names.setdefault(id(value), name)
+        return {name: names[id(value)] for name, value in head.state_dict(keep_vars=True).items()}
 
-            repr_model = self.feature_function(n_epoch)
-            # repr_model = torch.nn.Sequential(*(list(self.model.children())[:self.split]))
+    def _stacked_pred(self, save_dirs, data, batch_size=1000):
+        """
+        logits of data[i] by the subject model saved in save_dirs[i], the prediction heads evaluated together with their weights stacked
+        :param save_dirs: list of str, checkpoint directories
+        :param data: list of ndarray, (N, dim) each
+        :return: ndarray, (len(save_dirs), N, classes)
+        """
+        # load any of them, for the architecture and the device
+        self._load_subject_model(save_dirs[0])
+        head = self.model.prediction
+        keys = self._head_keys()
+        state_dicts = [self._subject_state(os.path.join(save_dir, "subject_model.pth"))[1] for save_dir in save_dirs]
+        params = {name: torch.stack([state_dict[key] for state_dict in state_dicts]).to(self.DEVICE) for name, key in keys.items()}
+        stacked_head = torch.func.vmap(lambda p, x: torch.func.functional_call(head, p, (x,)))
+
+        rows = max(batch_size // len(save_dirs), 1)
+        preds = list()
+        with torch.no_grad():
+            for row in range(0, max(len(data[0]), 1), rows):
+                x = torch.from_numpy(np.stack([d[row:row+rows] for d in data])).to(dtype=torch.float, device=self.DEVICE)
+                preds.append(stacked_head(params, x).cpu().numpy())
+        return np.concatenate(preds, axis=1)
+
+    def _pred_path(self, epoch, split):
+        return os.path.join(self.checkpoint_path(epoch), "{}_pred.npy".format(split))
+
+    def _fresh_pred(self, epoch, split):
+        """persisted logits of split in epoch, None if missing or older than the subject model or the representations"""
+        pred_path = self._pred_path(epoch, split)
+        if not os.path.exists(pred_path):
+            return None
+        save_dir = self.checkpoint_path(epoch)
+        index_name = "index.json" if split == "train" else "test_index.json"
+        for file_name in ["subject_model.pth", "{}_data.npy".format(split), index_name]:
+            source = os.path.join(save_dir, file_name)
+            if os.path.exists(source) and os.path.getmtime(source) > os.path.getmtime(pred_path):
+                return None
+        return np.load(pred_path)
+
+    def _split_representation(self, epoch, split):
+        if split == "train":
+            return self.train_representation(epoch)
+        elif split == "test":
+            return self.test_representation(epoch)
+        raise NotImplementedError
 
-            # training data clustering
-            data_pool_representation = batch_run(repr_model, training_data)
-            location = os.path.join(self.model_path, "{}_{:d}".format(self.epoch_name, n_epoch), "train_data.npy")
-            np.save(location, data_pool_representation)
+    def train_pred(self, epoch):
+        """logits of the train representation of epoch, persisted as train_pred.npy in the checkpoint"""
+        return self._split_pred(epoch, "train")
 
-            # test data
-            test_data_representation = batch_run(repr_model, testing_data)
-            location = os.path.join(self.model_path, "{}_{:d}".format(self.epoch_name, n_epoch), "test_data.npy")
-            np.save(location, test_data_representation)
+    def test_pred(self, epoch):
+        """logits of the test representation of epoch, persisted as test_pred.npy in the checkpoint"""
+        return self._split_pred(epoch, "test")
 
-            t_e = time.time()
-            time_inference.append(t_e-t_s)
-            if self.verbose > 0:
-                print("Finish inferencing data for Epoch {:d}...".format(n_epoch))
-        print(
-            "Average time for inferencing data: {:.4f}".format(sum(time_inference) / len(time_inference)))
+    def _split_pred(self, epoch, split):
+        pred = self._fresh_pred(epoch, split)
+        if pred is None:
+            pred = self.get_pred(epoch, self._split_representation(epoch, split))
+            np.save(self._pred_path(epoch, split), pred)
+        return pred
 
-        # save result
-        save_dir = os.path.join(self.model_path, "time.json")
+    def get_pred_all_epochs(self, epochs, split="train", stack_size=8):
+        """
+        logits of the representations of split in every epoch, e.g. for temporal analyses
+        persisted logits are reused, the others are computed stack_size epochs at a time with stacked prediction heads and persisted
+        :param epochs: list of int
+        :param split: "train" or "test"
+        :param stack_size: int, number of epochs evaluated together
+        :return: ndarray, (N, len(epochs), classes)
+        """
+        preds = [self._fresh_pred(epoch, split) for epoch in epochs]
+        todo = [t for t in range(len(epochs)) if preds[t] is None]
+        for start in range(0, len(todo), stack_size):
+            cols = todo[start:start+stack_size]
+            data = [self._split_representation(epochs[t], split) for t in cols]
+            if self._head_keys() is None:
+                stacked = [self.get_pred(epochs[t], d) for t, d in zip(cols, data)]
+            else:
+                stacked = self._stacked_pred([self.checkpoint_path(epochs[t]) for t in cols], data)
+            for t, pred in zip(cols, stacked):
+                preds[t] = pred
+                np.save(self._pred_path(epochs[t], split), pred)
+        return np.stack(preds, axis=1)
+
+    def _infer_checkpoint(self, save_dir, training_data, testing_data):
+        """save train_data.npy and test_data.npy with the subject model already loaded"""
+        repr_model = self.model.feature
+        # training data clustering
+        data_pool_representation = batch_run(repr_model, training_data)
+        np.save(os.path.join(save_dir, "train_data.npy"), data_pool_representation)
+        # test data
+        test_data_representation = batch_run(repr_model, testing_data)
+        np.save(os.path.join(save_dir, "test_data.npy"), test_data_representation)
+
+    def _estimate_checkpoint_boundary(self, save_dir, training_data, num, l_bound, share_pool=True, reuse_pool=False):
+        """
+        generate and save border points with the subject model already loaded
+        :return: the time spent on logits and border points generation, and (generation time, mode, attacks) of _generate_border_sets
+        """
+        t0 = time.time()
+        confs = batch_run(self.model, training_data)
+        preds = np.argmax(confs, axis=1).squeeze()
+        t1 = time.time()
+        # TODO how to choose the number of boundary points?
+        border_points, border_centers, test_border_points, test_border_centers, t_gene, mode, attacks = self._generate_border_sets(training_data, confs, preds, self.model.feature, num, l_bound, save_dir, share_pool, reuse_pool)
+        self._save_border_sets(save_dir, border_points, border_centers, test_border_points, test_border_centers)
+        return t1 - t0 + t_gene, (t_gene, mode, attacks)
+
+    def _save_border_time(self, file_name, records, iteration=None):
+        """
+        save the time of border points generation, also per mode with the number of mix-up attacks,
+        and the saving of the shared pool over separate generation once both modes were measured
+        :param records: list of (total time, (generation time, mode, attacks)), one for each checkpoint
+        """
+        times = [t for t, _ in records]
+        # time to generate both train and test border points
+        self._save_time(file_name, "data_B_gene", round(sum(times) / len(times), 3), iteration)
+        modes = sorted(set(mode for _, (_, mode, _) in records))
+        self._save_time(file_name, "data_B_gene_mode", "+".join(modes), iteration)
+        for mode in modes:
+            gene = [(t, a) for _, (t, m, a) in records if m == mode]
+            self._save_time(file_name, "data_B_gene_{}".format(mode), round(sum(t for t, _ in gene) / len(gene), 3), iteration)
+            self._save_time(file_name, "data_B_attacks_{}".format(mode), int(round(sum(a for _, a in gene) / len(gene))), iteration)
+
+        with open(os.path.join(self.model_path, file_name), "r") as f:
+            evaluation = json.load(f)
+        measured = [evaluation.get("data_B_gene_{}".format(mode)) for mode in ["shared_pool", "separate"]]
+        if iteration is not None:
+            measured = [None if m is None else m.get(str(iteration)) for m in measured]
+        shared, separate = measured
+        if shared is not None and separate:
+            saving = round(1 - shared / separate, 3)
+            self._save_time(file_name, "data_B_gene_saving", saving, iteration)
+            print("The shared border pool saves {:.1%} of the generation time...".format(saving))
+
+    def _save_time(self, file_name, key, value, iteration=None):
+        save_dir = os.path.join(self.model_path, file_name)
         if not os.path.exists(save_dir):
             evaluation = dict()
         else:
             f = open(save_dir, "r")
             evaluation = json.load(f)
             f.close()
-        evaluation["data_inference"] = round(sum(time_inference) / len(time_inference), 3)
+        if iteration is None:
+            evaluation[key] = value
+        else:
+            if key not in evaluation.keys():
+                evaluation[key] = dict()
+            evaluation[key][str(iteration)] = value
         with open(save_dir, 'w') as f:
             json.dump(evaluation, f)
 
+
+class NormalDataProvider(DataProvider):
+    def __init__(self, content_path, model, epoch_start, epoch_end, epoch_period, device, classes, epoch_name, verbose=1):
+        super().__init__(content_path, model, epoch_start, epoch_end, epoch_period, device, classes, epoch_name, verbose)
+        self.mode = "normal"
+    
+    @property
+    def representation_dim(self):
+        train_data_loc = os.path.join(self.model_path, "{}_{:d}".format(self.epoch_name, self.s), "train_data.npy")
+        try:
+            train_data = self.store.array(train_data_loc)
+            repr_dim = np.prod(train_data.shape[1:])
+            return repr_dim
+        except Exception as e:
+            return None
+
+    def _preprocess(self, num, l_bound, inference=True, estimate_boundary=True, share_pool=True, reuse_pool=False):
+        '''
+        Stream the checkpoints in order. The input tensors stay on device and each subject_model.pth is loaded once,
+        representations, logits and border points of that epoch are all computed from that single load.
+        '''
+        time_inference = list()
+        time_borders_gen = list()
+        training_data = self._load_training_data()
+        testing_data = self._load_testing_data() if inference else None
+
+        for n_epoch in range(self.s, self.e + 1, self.p):
+            save_dir = self.checkpoint_path(n_epoch)
+            self._load_subject_model(save_dir)
+
+            if inference:
+                t_s = time.time()
+                # make it possible to choose a subset of testing data for testing
+                test_index_file = os.path.join(save_dir, "test_index.json")
+                if os.path.exists(test_index_file):
+                    test_index = load_labelled_data_index(test_index_file)
+                    self._infer_checkpoint(save_dir, training_data, testing_data[test_index])
+                else:
+                    self._infer_checkpoint(save_dir, training_data, testing_data)
+                t_e = time.time()
+                time_inference.append(t_e-t_s)
+                if self.verbose > 0:
+                    print("Finish inferencing data for Epoch {:d}...".format(n_epoch))
+
+            if estimate_boundary:
+                index = load_labelled_data_index(os.path.join(save_dir, "index.json"))
+                t_gene, gene = self._estimate_checkpoint_boundary(save_dir, training_data[index], num, l_bound, share_pool, reuse_pool)
+                time_borders_gen.append((round(t_gene, 4), gene))
+                if self.verbose > 0:
+                    print("Finish generating borders for Epoch {:d}...".format(n_epoch))
+
+        # save result
+        if inference:
+            print(
+                "Average time for inferencing data: {:.4f}".format(sum(time_inference) / len(time_inference)))
+            self._save_time("time.json", "data_inference", round(sum(time_inference) / len(time_inference), 3))
+        if estimate_boundary:
+            print(
+                "Average time for generate border points: {:.4f}".format(sum(t for t, _ in time_borders_gen) / len(time_borders_gen)))
+            self._save_border_time("time.json", time_borders_gen)
+
         del training_data
         del testing_data
         gc.collect()
 
-    def _estimate_boundary(self, num, l_bound):
+    def _meta_data(self):
+        self._preprocess(0, 0, inference=True, estimate_boundary=False)
+
+    def _estimate_boundary(self, num, l_bound, share_pool=True, reuse_pool=False):
         '''
         Preprocessing data. This process includes find_border_points and find_border_centers
         save data for later training
         '''
+        self._preprocess(num, l_bound, inference=False, estimate_boundary=True, share_pool=share_pool, reuse_pool=reuse_pool)
 
-        time_borders_gen = list()
-        training_data_path = os.path.join(self.content_path, "Training_data")
-        training_data = torch.load(os.path.join(training_data_path, "training_dataset_data.pth"),
-                                   map_location="cpu")
-        training_data = training_data.to(self.DEVICE)
-        for n_epoch in range(self.s, self.e + 1, self.p):
-            index_file = os.path.join(self.model_path, "{}_{:d}".format(self.epoch_name, n_epoch), "index.json")
-            index = load_labelled_data_index(index_file)
-            training_data = training_data[index]
-
-            # model_location = os.path.join(self.model_path, "Epoch_{:d}".format(n_epoch), "subject_model.pth")
-            # self.model.load_state_dict(torch.load(model_location, map_location=torch.device("cpu")))
-            # self.model = self.model.to(self.DEVICE)
-            # self.model.eval()
-            # repr_model = torch.nn.Sequential(*(list(self.model.children())[:self.split]))
-            repr_model = self.feature_function(n_epoch)
-
-            t0 = time.time()
-            confs = batch_run(self.model, training_data)
-            preds = np.argmax(confs, axis=1).squeeze()
-            # TODO how to choose the number of boundary points?
-            num_adv_eg = num
-            border_points, _, _ = get_border_points(model=self.model, input_x=training_data, confs=confs, predictions=preds, device=self.DEVICE, l_bound=l_bound, num_adv_eg=num_adv_eg, lambd=0.05, verbose=0)
-            t1 = time.time()
-            time_borders_gen.append(round(t1 - t0, 4))
-
-            # get gap layer data
-            border_points = border_points.to(self.DEVICE)
-            border_centers = batch_run(repr_model, border_points)
-            location = os.path.join(self.model_path, "{}_{:d}".format(self.epoch_name, n_epoch), "border_centers.npy")
-            np.save(location, border_centers)
-
-            location = os.path.join(self.model_path, "{}_{:d}".format(self.epoch_name, n_epoch), "ori_border_centers.npy")
-            np.save(location, border_points.cpu().numpy())
-
-            num_adv_eg = num
-            border_points, _, _ = get_border_points(model=self.model, input_x=training_data, confs=confs, predictions=preds, device=self.DEVICE, l_bound=l_bound, num_adv_eg=num_adv_eg, lambd=0.05, verbose=0)
-
-            # get gap layer data
-            border_points = border_points.to(self.DEVICE)
-            border_centers = batch_run(repr_model, border_points)
-            location = os.path.join(self.model_path, "{}_{:d}".format(self.epoch_name, n_epoch), "test_border_centers.npy")
-            np.save(location, border_centers)
-
-            location = os.path.join(self.model_path, "{}_{:d}".format(self.epoch_name, n_epoch), "test_ori_border_centers.npy")
-            np.save(location, border_points.cpu().numpy())
-
-            if self.verbose > 0:
-                print("Finish generating borders for Epoch {:d}...".format(n_epoch))
-        print(
-            "Average time for generate border points: {:.4f}".format(sum(time_borders_gen) / len(time_borders_gen)))
-
-        # save result
-        save_dir = os.path.join(self.model_path, "time.json")
-        if not os.path.exists(save_dir):
-            evaluation = dict()
-        else:
-            f = open(save_dir, "r")
-            evaluation = json.load(f)
-            f.close()
-        evaluation["data_B_gene"] = round(sum(time_borders_gen) / len(time_borders_gen), 3)
-        with open(save_dir, 'w') as f:
-            json.dump(evaluation, f)
-
-    def initialize(self, num, l_bound):
-        self._meta_data()
-        self._estimate_boundary(num, l_bound)
+    def initialize(self, num, l_bound, estimate_boundary=True, share_pool=True, reuse_pool=False):
+        """
+        inference and border points of every epoch, see _generate_border_sets for share_pool and reuse_pool
+        the generation time of each mode is recorded in time.json, once a run with share_pool=False and one with
+        share_pool=True are recorded, data_B_gene_saving holds the saving of the shared pool
+        """
+        self._preprocess(num, l_bound, inference=True, estimate_boundary=estimate_boundary, share_pool=share_pool, reuse_pool=reuse_pool)
 
     def train_representation(self, epoch):
         # load train data
         train_data_loc = os.path.join(self.model_path, "{}_{:d}".format(self.epoch_name, epoch), "train_data.npy")
         index_file = os.path.join(self.model_path, "{}_{:d}".format(self.epoch_name, epoch), "index.json")
-        index = load_labelled_data_index(index_file)
         try:
-            train_data = np.load(train_data_loc)
-            train_data = train_data[index]
+            train_data = self.store.get(train_data_loc, index_file)
         except Exception as e:
             print("no train data saved for Epoch {}".format(epoch))
             train_data = None
@@ -253,7 +463,7 @@ class NormalDataProvider(DataProvider):
         # load train data
         training_data_loc = os.path.join(self.content_path, "Training_data", "training_dataset_label.pth")
         index_file = os.path.join(self.model_path, "{}_{:d}".format(self.epoch_name, epoch), "index.json")
-        index = load_labelled_data_index(index_file)
+        index = self.store.index(index_file)
         try:
             training_labels = torch.load(training_data_loc, map_location="cpu")
             training_labels = training_labels[index]
@@ -265,11 +475,11 @@ class NormalDataProvider(DataProvider):
     def test_representation(self, epoch):
         data_loc = os.path.join(self.model_path, "{}_{:d}".format(self.epoch_name, epoch), "test_data.npy")
         try:
-            test_data = np.load(data_loc)
             index_file = os.path.join(self.model_path, "{}_{:d}".format(self.epoch_name, epoch), "test_index.json")
             if os.path.exists(index_file):
-                index = load_labelled_data_index(index_file)
-                test_data = test_data[index]
+                test_data = self.store.get(data_loc, index_file)
+            else:
+                test_data = self.store.get(data_loc)
         except Exception as e:
             print("no test data saved for Epoch {}".format(epoch))
             test_data = None
@@ -284,7 +494,7 @@ class NormalDataProvider(DataProvider):
             index_file = os.path.join(self.model_path, "{}_{:d}".format(self.epoch_name, epoch), "test_index.json")
             print(index_file)
             if os.path.exists(index_file):
-                idxs = load_labelled_data_index(index_file)
+                idxs = self.store.index(index_file)
                 testing_labels = testing_labels[idxs]
         except Exception as e:
             print("no test labels saved for Epoch {}".format(epoch))
@@ -295,7 +505,7 @@ class NormalDataProvider(DataProvider):
         border_centers_loc = os.path.join(self.model_path, "{}_{:d}".format(self.epoch_name, epoch),
                                           "border_centers.npy")
         try:
-            border_centers = np.load(border_centers_loc)
+            border_centers = self.store.get(border_centers_loc)
         except Exception as e:
             print("no border points saved for Epoch {}".format(epoch))
             border_centers = np.array([])
@@ -305,7 +515,7 @@ class NormalDataProvider(DataProvider):
         border_centers_loc = os.path.join(self.model_path, "{}_{:d}".format(self.epoch_name, epoch),
                                           "test_border_centers.npy")
         try:
-            border_centers = np.load(border_centers_loc)
+            border_centers = self.store.get(border_centers_loc)
         except Exception as e:
             print("no border points saved for Epoch {}".format(epoch))
             border_centers = np.array([])
@@ -314,21 +524,50 @@ class NormalDataProvider(DataProvider):
     def max_norm(self, epoch):
         train_data_loc = os.path.join(self.model_path, "{}_{:d}".format(self.epoch_name, epoch), "train_data.npy")
         index_file = os.path.join(self.model_path, "{}_{:d}".format(self.epoch_name, epoch), "index.json")
-        index = load_labelled_data_index(index_file)
         try:
-            train_data = np.load(train_data_loc)
-            train_data = train_data[index]
+            train_data = self.store.get(train_data_loc, index_file)
             max_x = np.linalg.norm(train_data, axis=1).max()
         except Exception as e:
             print("no train data saved for Epoch {}".format(epoch))
             max_x = None
         return max_x
 
+    def all_representation(self, split="train", rebuild=False):
+        """
+        stack the representations of all epochs into one memory-mapped file Model/all_{split}_data_{s}_{e}_{p}.npy
+        the file is named by the epoch range, so providers narrowed to a segment do not rewrite the one of the full range
+        :param split: "train" or "test"
+        :param rebuild: bool, rewrite the file even if it is up to date
+        :return: RepresentationTensor of shape (epochs, samples, dim)
+        """
+        if split == "train":
+            data_name, index_name = "train_data.npy", "index.json"
+        elif split == "test":
+            data_name, index_name = "test_data.npy", "test_index.json"
+        else:
+            raise NotImplementedError
+
+        epochs = list(range(self.s, self.e + 1, self.p))
+        sources = list()
+        for epoch in epochs:
+            sources.append(os.path.join(self.checkpoint_path(epoch), data_name))
+            if os.path.exists(os.path.join(self.checkpoint_path(epoch), index_name)):
+                sources.append(os.path.join(self.checkpoint_path(epoch), index_name))
+
+        def load(epoch):
+            # read through the memory map directly to keep the LRU for hot epochs
+            data = self.store.array(os.path.join(self.checkpoint_path(epoch), data_name))
+            index_file = os.path.join(self.checkpoint_path(epoch), index_name)
+            if os.path.exists(index_file):
+                return data[self.store.index(index_file)]
+            return data
+
+        path = os.path.join(self.model_path, "all_{}_data_{}_{}_{}.npy".format(split, self.s, self.e, self.p))
+        return self.store.consolidate(path, epochs, sources, load, rebuild)
+
     def prediction_function(self, epoch):
         model_location = os.path.join(self.model_path, "{}_{:d}".format(self.epoch_name, epoch), "subject_model.pth")
-        self.model.load_state_dict(torch.load(model_location, map_location=torch.device("cpu")))
-        self.model.to(self.DEVICE)
-        self.model.eval()
+        self._load_subject_model(os.path.dirname(model_location))
 
         pred_fn = self.model.prediction
         return pred_fn
@@ -336,9 +575,7 @@ class NormalDataProvider(DataProvider):
 
     def feature_function(self, epoch):
         model_location = os.path.join(self.model_path, "{}_{:d}".format(self.epoch_name, epoch), "subject_model.pth")
-        self.model.load_state_dict(torch.load(model_location, map_location=torch.device("cpu")))
-        self.model = self.model.to(self.DEVICE)
-        self.model.eval()
+        self._load_subject_model(os.path.dirname(model_location))
 
         fea_fn = self.model.feature
         return fea_fn
@@ -358,20 +595,18 @@ class NormalDataProvider(DataProvider):
         return pred
 
     def training_accu(self, epoch):
-        data = self.train_representation(epoch)
         labels = self.train_labels(epoch)
-        pred = self.get_pred(epoch, data).argmax(-1)
+        pred = self.train_pred(epoch).argmax(-1)
         val = evaluate_inv_accu(labels, pred)
         return val
 
     def testing_accu(self, epoch):
-        data = self.test_representation(epoch)
         labels = self.test_labels(epoch)
         test_index_file = os.path.join(self.model_path, "{}_{}".format(self.epoch_name, epoch), "test_index.json")
         if os.path.exists(test_index_file):
-            index = load_labelled_data_index(test_index_file)
+            index = self.store.index(test_index_file)
             labels = labels[index]
-        pred = self.get_pred(epoch, data).argmax(-1)
+        pred = self.test_pred(epoch).argmax(-1)
         val = evaluate_inv_accu(labels, pred)
         return val
     
@@ -408,7 +643,7 @@ class ActiveLearningDataProvider(DataProvider):
     def representation_dim(self, iteration):
         train_data_loc = os.path.join(self.model_path, "{}_{:d}".format(self.iteration_name, iteration), "train_data.npy")
         try:
-            train_data = np.load(train_data_loc)
+            train_data = self.store.array(train_data_loc)
             repr_dim = np.prod(train_data.shape[1:])
             return repr_dim
         except Exception as e:
@@ -416,7 +651,7 @@ class ActiveLearningDataProvider(DataProvider):
     
     def get_labeled_idx(self, iteration):
         index_file = os.path.join(self.model_path, "{}_{:d}".format(self.iteration_name, iteration), "index.json")
-        lb_idxs = np.array(load_labelled_data_index(index_file))
+        lb_idxs = self.store.index(index_file)
         return lb_idxs
 
     def get_unlabeled_idx(self, pool_num, lb_idx):
@@ -425,125 +660,55 @@ class ActiveLearningDataProvider(DataProvider):
         ulb_idx = np.setdiff1d(tot_idx, lb_idx)
         return ulb_idx
 
-    def _meta_data(self, iteration):
-        training_data_path = os.path.join(self.content_path, "Training_data")
-        training_data = torch.load(os.path.join(training_data_path, "training_dataset_data.pth"),
-                                        map_location="cpu")
-        training_data = training_data.to(self.DEVICE)
-        testing_data_path = os.path.join(self.content_path, "Testing_data")
-        testing_data = torch.load(os.path.join(testing_data_path, "testing_dataset_data.pth"),
-                                       map_location="cpu")
-        testing_data = testing_data.to(self.DEVICE)
-
-        t_s = time.time()
-        repr_model = self.feature_function(iteration)
-
-        # training data clustering
-        data_pool_representation = batch_run(repr_model, training_data)
-        location = os.path.join(self.model_path, "{}_{:d}".format(self.iteration_name, iteration), "train_data.npy")
-        np.save(location, data_pool_representation)
-
-        # test data
-        test_data_representation = batch_run(repr_model, testing_data)
-        location = os.path.join(self.model_path, "{}_{:d}".format(self.iteration_name, iteration), "test_data.npy")
-        np.save(location, test_data_representation)
-
-        t_e = time.time()
+    def _preprocess(self, iteration, num, l_bound, inference=True, estimate_boundary=True, share_pool=True, reuse_pool=False):
+        '''
+        Load the input tensors and subject_model.pth of this iteration once,
+        compute representations, logits and border points from that single load.
+        '''
+        training_data = self._load_training_data()
+        testing_data = self._load_testing_data() if inference else None
+        save_dir = self.checkpoint_path(iteration)
+        self._load_subject_model(save_dir)
 
-        if self.verbose > 0:
-            print("Finish inferencing data for Iteration {:d} in {:.2f} seconds...".format(iteration, t_e-t_s))
+        if inference:
+            t_s = time.time()
+            self._infer_checkpoint(save_dir, training_data, testing_data)
+            t_e = time.time()
+            if self.verbose > 0:
+                print("Finish inferencing data for Iteration {:d} in {:.2f} seconds...".format(iteration, t_e-t_s))
+            self._save_time("time_al.json", "data_inference", round(t_e - t_s, 3), iteration)
 
-        # save result
-        save_dir = os.path.join(self.model_path, "time_al.json")
-        if not os.path.exists(save_dir):
-            evaluation = dict()
-            
-        else:
-            f = open(save_dir, "r")
-            evaluation = json.load(f)
-            f.close()
-        if "data_inference" not in evaluation.keys():
-            evaluation["data_inference"] = dict()
-        evaluation["data_inference"][str(iteration)] = round(t_e - t_s, 3)
-        with open(save_dir, 'w') as f:
-            json.dump(evaluation, f)
+        if estimate_boundary:
+            index = load_labelled_data_index(os.path.join(save_dir, "index.json"))
+            t_gene, gene = self._estimate_checkpoint_boundary(save_dir, training_data[index], num, l_bound, share_pool, reuse_pool)
+            if self.verbose > 0:
+                print("Finish generating borders for Iteration {:d} in {:.2f} seconds ...".format(iteration, t_gene))
+            self._save_border_time("time_al.json", [(t_gene, gene)], iteration)
 
         del training_data
         del testing_data
         gc.collect()
 
-    def _estimate_boundary(self, iteration, num, l_bound):
+    def _meta_data(self, iteration):
+        self._preprocess(iteration, 0, 0, inference=True, estimate_boundary=False)
+
+    def _estimate_boundary(self, iteration, num, l_bound, share_pool=True, reuse_pool=False):
         '''
         Preprocessing data. This process includes find_border_points and find_border_centers
         save data for later training
         '''
+        self._preprocess(iteration, num, l_bound, inference=False, estimate_boundary=True, share_pool=share_pool, reuse_pool=reuse_pool)
 
-        training_data_path = os.path.join(self.content_path, "Training_data")
-        training_data = torch.load(os.path.join(training_data_path, "training_dataset_data.pth"),
-                                   map_location="cpu")
-        training_data = training_data.to(self.DEVICE)
-        index_file = os.path.join(self.model_path, "{}_{:d}".format(self.iteration_name, iteration), "index.json")
-        index = load_labelled_data_index(index_file)
-        training_data = training_data[index]
-
-        repr_model = self.feature_function(iteration)
-
-        t0 = time.time()
-        confs = batch_run(self.model, training_data)
-        preds = np.argmax(confs, axis=1).squeeze()
-        # TODO how to choose the number of boundary points?
-        num_adv_eg = num
-        border_points, _, _ = get_border_points(model=self.model, input_x=training_data, confs=confs, predictions=preds, device=self.DEVICE, l_bound=l_bound, num_adv_eg=num_adv_eg, lambd=0.05, verbose=0)
-        t1 = time.time()
-
-        # get gap layer data
-        border_points = border_points.to(self.DEVICE)
-        border_centers = batch_run(repr_model, border_points)
-        location = os.path.join(self.model_path, "{}_{:d}".format(self.iteration_name, iteration), "border_centers.npy")
-        np.save(location, border_centers)
-
-        location = os.path.join(self.model_path, "{}_{:d}".format(self.iteration_name, iteration), "ori_border_centers.npy")
-        np.save(location, border_points.cpu().numpy())
-
-        num_adv_eg = num
-        border_points, _, _ = get_border_points(model=self.model, input_x=training_data, confs=confs, predictions=preds, device=self.DEVICE, l_bound=l_bound, num_adv_eg=num_adv_eg, lambd=0.05, verbose=0)
-
-        # get gap layer data
-        border_points = border_points.to(self.DEVICE)
-        border_centers = batch_run(repr_model, border_points)
-        location = os.path.join(self.model_path, "{}_{:d}".format(self.iteration_name, iteration), "test_border_centers.npy")
-        np.save(location, border_centers)
-
-        location = os.path.join(self.model_path, "{}_{:d}".format(self.iteration_nameiteration), "test_ori_border_centers.npy")
-        np.save(location, border_points.cpu().numpy())
-
-        if self.verbose > 0:
-            print("Finish generating borders for Iteration {:d} in {:.2f} seconds ...".format(iteration, t1-t0))
-
-        # save result
-        save_dir = os.path.join(self.model_path, "time_al.json")
-        if not os.path.exists(save_dir):
-            evaluation = dict()
-        else:
-            f = open(save_dir, "r")
-            evaluation = json.load(f)
-            f.close()
-        if "data_B_gene" not in evaluation.keys():
-            evaluation["data_B_gene"] = dict()
-        evaluation["data_B_gene"][str(iteration)] = round(t1-t0, 3)
-        with open(save_dir, 'w') as f:
-            json.dump(evaluation, f)
-
-    def initialize_iteration(self, iteration, num, l_bound):
-        self._meta_data(iteration)
-        self._estimate_boundary(iteration, num, l_bound)
+    def initialize_iteration(self, iteration, num, l_bound, estimate_boundary=True, share_pool=True, reuse_pool=False):
+        """inference and border points of iteration, see initialize"""
+        self._preprocess(iteration, num, l_bound, inference=True, estimate_boundary=estimate_boundary, share_pool=share_pool, reuse_pool=reuse_pool)
 
     def train_representation(self, iteration):
         # load labelled train data
         train_data_loc = os.path.join(self.model_path, "{}_{:d}".format(self.iteration_name, iteration), "train_data.npy")
         try:
-            idxs = self.get_labeled_idx(iteration)
-            train_data = np.load(train_data_loc)[idxs]
+            index_file = os.path.join(self.model_path, "{}_{:d}".format(self.iteration_name, iteration), "index.json")
+            train_data = self.store.get(train_data_loc, index_file)
         except Exception as e:
             print("no train data saved for Iteration {}".format(iteration))
             train_data = None
@@ -563,11 +728,9 @@ class ActiveLearningDataProvider(DataProvider):
     def train_representation_ulb(self, iteration):
         # load train data
         train_data_loc = os.path.join(self.model_path, "{}_{:d}".format(self.iteration_name, iteration), "train_data.npy")
-        lb_idxs = self.get_labeled_idx(iteration)
+        index_file = os.path.join(self.model_path, "{}_{:d}".format(self.iteration_name, iteration), "index.json")
         try:
-            train_data = np.load(train_data_loc)
-            ulb_idxs = self.get_unlabeled_idx(len(train_data), lb_idxs)
-            train_data = train_data[ulb_idxs]
+            train_data = self.store.get(train_data_loc, index_file, complement=True)
         except Exception as e:
             print("no train data saved for Iteration {}".format(iteration))
             train_data = None
@@ -590,7 +753,7 @@ class ActiveLearningDataProvider(DataProvider):
         # load train data
         train_data_loc = os.path.join(self.model_path, "{}_{:d}".format(self.iteration_name, iteration), "train_data.npy")
         try:
-            train_data = np.load(train_data_loc)
+            train_data = self.store.get(train_data_loc)
         except Exception as e:
             print("no train data saved for Iteration {}".format(iteration))
             train_data = None
@@ -609,11 +772,11 @@ class ActiveLearningDataProvider(DataProvider):
     def test_representation(self, epoch):
         data_loc = os.path.join(self.model_path, "{}_{:d}".format(self.iteration_name, epoch), "test_data.npy")
         try:
-            test_data = np.load(data_loc)
             index_file = os.path.join(self.model_path, "{}_{:d}".format(self.iteration_name, epoch), "test_index.json")
             if os.path.exists(index_file):
-                index = load_labelled_data_index(index_file)
-                test_data = test_data[index]
+                test_data = self.store.get(data_loc, index_file)
+            else:
+                test_data = self.store.get(data_loc)
         except Exception as e:
             print("no test data saved for Iteration {}".format(epoch))
             test_data = None
@@ -627,7 +790,7 @@ class ActiveLearningDataProvider(DataProvider):
             testing_labels = torch.load(testing_data_loc, map_location="cpu").numpy()
             index_file = os.path.join(self.model_path, "{}_{:d}".format(self.iteration_name, epoch), "test_index.json")
             if os.path.exists(index_file):
-                idxs = load_labelled_data_index(index_file)
+                idxs = self.store.index(index_file)
                 testing_labels = testing_labels[idxs]
         except Exception as e:
             print("no test labels saved for Iteration {}".format(epoch))
@@ -638,7 +801,7 @@ class ActiveLearningDataProvider(DataProvider):
         border_centers_loc = os.path.join(self.model_path, "{}_{:d}".format(self.iteration_name, epoch),
                                           "border_centers.npy")
         try:
-            border_centers = np.load(border_centers_loc)
+            border_centers = self.store.get(border_centers_loc)
         except Exception as e:
             print("no border points saved for Iteration {}".format(epoch))
             border_centers = np.array([])
@@ -648,7 +811,7 @@ class ActiveLearningDataProvider(DataProvider):
         border_centers_loc = os.path.join(self.model_path, "{}_{:d}".format(self.iteration_name, epoch),
                                           "test_border_centers.npy")
         try:
-            border_centers = np.load(border_centers_loc)
+            border_centers = self.store.get(border_centers_loc)
         except Exception as e:
             print("no border points saved for Epoch {}".format(epoch))
             border_centers = np.array([])
@@ -661,18 +824,14 @@ class ActiveLearningDataProvider(DataProvider):
 
     def prediction_function(self, iteration):
         model_location = os.path.join(self.model_path, "{}_{:d}".format(self.iteration_name, iteration), "subject_model.pth")
-        self.model.load_state_dict(torch.load(model_location, map_location=torch.device("cpu")))
-        self.model.to(self.DEVICE)
-        self.model.eval()
+        self._load_subject_model(os.path.dirname(model_location))
 
         pred_fn = self.model.prediction
         return pred_fn
 
     def feature_function(self, epoch):
         model_location = os.path.join(self.model_path, "{}_{:d}".format(self.iteration_name, epoch), "subject_model.pth")
-        self.model.load_state_dict(torch.load(model_location, map_location=torch.device("cpu")))
-        self.model.to(self.DEVICE)
-        self.model.eval()
+        self._load_subject_model(os.path.dirname(model_location))
 
         fea_fn = self.model.feature
         return fea_fn
@@ -733,141 +892,68 @@ class DenseActiveLearningDataProvider(ActiveLearningDataProvider):
     def representation_dim(self):
         train_data_loc = os.path.join(self.model_path, "{}_{}".format(self.iteration_name, self.s), "{}_{:d}".format(self.epoch_name, self.epoch_num), "train_data.npy")
         try:
-            train_data = np.load(train_data_loc)
+            train_data = self.store.array(train_data_loc)
             repr_dim = np.prod(train_data.shape[1:])
             return repr_dim
         except Exception as e:
             return None
 
-    def _meta_data(self, iteration):
+    def _preprocess(self, iteration, num, l_bound, inference=True, estimate_boundary=True, share_pool=True, reuse_pool=False):
+        '''
+        Stream the epochs of this iteration in order. The input tensors stay on device and each subject_model.pth is loaded once,
+        representations, logits and border points of that epoch are all computed from that single load.
+        '''
         time_inference = list()
-        training_data_path = os.path.join(self.content_path, "Training_data")
-        training_data = torch.load(os.path.join(training_data_path, "training_dataset_data.pth"),
-                                        map_location="cpu")
-        training_data = training_data.to(self.DEVICE)
-        testing_data_path = os.path.join(self.content_path, "Testing_data")
-        testing_data = torch.load(os.path.join(testing_data_path, "testing_dataset_data.pth"),
-                                       map_location="cpu")
-        testing_data = testing_data.to(self.DEVICE)
-
-        t_s = time.time()
-
-        # make it possible to choose a subset of testing data for testing
-        test_index_file = os.path.join(self.model_path, "{}_{:d}".format(self.iteration_name, iteration), "test_index.json")
-        if os.path.exists(test_index_file):
-            test_index = load_labelled_data_index(test_index_file)
-        else:
-            test_index = range(len(testing_data))
-        testing_data = testing_data[test_index]
+        time_borders_gen = list()
+        iteration_dir = os.path.join(self.model_path, "{}_{}".format(self.iteration_name, iteration))
+        training_data = self._load_training_data()
+        index = load_labelled_data_index(os.path.join(iteration_dir, "index.json"))
+        lb_training_data = training_data[index]
+        testing_data = None
+        if inference:
+            testing_data = self._load_testing_data()
+            # make it possible to choose a subset of testing data for testing
+            test_index_file = os.path.join(iteration_dir, "test_index.json")
+            if os.path.exists(test_index_file):
+                testing_data = testing_data[load_labelled_data_index(test_index_file)]
 
         for n_epoch in range(1, self.epoch_num+1, 1):
-            repr_model = self.feature_function(iteration, n_epoch)
+            save_dir = self.single_checkpoint_path(iteration, n_epoch)
+            self._load_subject_model(save_dir)
 
-            # training data clustering
-            data_pool_representation = batch_run(repr_model, training_data)
-            location = os.path.join(self.model_path, "{}_{}".format(self.iteration_name, iteration), "{}_{:d}".format(self.epoch_name, n_epoch), "train_data.npy")
-            np.save(location, data_pool_representation)
+            if inference:
+                t_s = time.time()
+                self._infer_checkpoint(save_dir, training_data, testing_data)
+                time_inference.append(time.time() - t_s)
 
-            # test data
-            test_data_representation = batch_run(repr_model, testing_data)
-            location = os.path.join(self.model_path, "{}_{}".format(self.iteration_name, iteration), "{}_{:d}".format(self.epoch_name, n_epoch), "test_data.npy")
-            np.save(location, test_data_representation)
-
-        t_e = time.time()
-        time_inference.append(t_e-t_s)
-        if self.verbose > 0:
-            print("Finish inferencing data for Iteration {:d}...".format(iteration))
-        print(
-            "Average time for inferencing data: {:.4f}...".format(sum(time_inference) / len(time_inference)))
+            if estimate_boundary:
+                t_gene, gene = self._estimate_checkpoint_boundary(save_dir, lb_training_data, num, l_bound, share_pool, reuse_pool)
+                time_borders_gen.append((round(t_gene, 4), gene))
+                if self.verbose > 0:
+                    print("Finish generating borders for Epoch {:d}...".format(n_epoch))
 
         # save result
-        save_dir = os.path.join(self.model_path, "SV_time.json")
-        if not os.path.exists(save_dir):
-            evaluation = dict()
-        else:
-            f = open(save_dir, "r")
-            evaluation = json.load(f)
-            f.close()
-        evaluation["data_inference"] = round(sum(time_inference) / len(time_inference), 3)
-        with open(save_dir, 'w') as f:
-            json.dump(evaluation, f)
+        if inference:
+            if self.verbose > 0:
+                print("Finish inferencing data for Iteration {:d}...".format(iteration))
+            print("Time for inferencing data: {:.4f}...".format(sum(time_inference)))
+            self._save_time("SV_time.json", "data_inference", round(sum(time_inference), 3))
+        if estimate_boundary:
+            print(
+                "Average time for generate border points for each iteration: {:.4f}".format(sum(t for t, _ in time_borders_gen) / len(time_borders_gen)))
+            self._save_border_time("SV_time.json", time_borders_gen)
 
         del training_data
+        del lb_training_data
         del testing_data
         gc.collect()
 
-    def _estimate_boundary(self, iteration, num, l_bound):
-        '''
-        Preprocessing data. This process includes find_border_points and find_border_centers
-        save data for later training
-        '''
-
-        time_borders_gen = list()
-        training_data_path = os.path.join(self.content_path, "Training_data")
-        training_data = torch.load(os.path.join(training_data_path, "training_dataset_data.pth"),
-                                   map_location="cpu")
-        training_data = training_data.to(self.DEVICE)
-
-        for n_epoch in range(1, self.epoch_num+1, 1):
-            index_file = os.path.join(self.model_path, "{}_{}".format(self.iteration_name, iteration), "index.json")
-            index = load_labelled_data_index(index_file)
-            training_data = training_data[index]
-
-            repr_model = self.feature_function(iteration, n_epoch)
-
-            t0 = time.time()
-            confs = batch_run(self.model, training_data)
-            preds = np.argmax(confs, axis=1).squeeze()
-            # TODO how to choose the number of boundary points?
-            num_adv_eg = num
-            border_points, _, _ = get_border_points(model=self.model, input_x=training_data, confs=confs, predictions=preds, device=self.DEVICE, l_bound=l_bound, num_adv_eg=num_adv_eg, lambd=0.05, verbose=0)
-            t1 = time.time()
-            time_borders_gen.append(round(t1 - t0, 4))
-
-            # get gap layer data
-            border_points = border_points.to(self.DEVICE)
-            border_centers = batch_run(repr_model, border_points)
-            location = os.path.join(self.model_path, "{}_{}".format(self.iteration_name, iteration), "{}_{:d}".format(self.epoch_name, n_epoch), "border_centers.npy")
-            np.save(location, border_centers)
-
-            location = os.path.join(self.model_path, "{}_{}".format(self.iteration_name, iteration), "{}_{:d}".format(self.epoch_name, n_epoch), "ori_border_centers.npy")
-            np.save(location, border_points.cpu().numpy())
-
-            num_adv_eg = num
-            border_points, _, _ = get_border_points(model=self.model, input_x=training_data, confs=confs, predictions=preds, device=self.DEVICE, l_bound=l_bound, num_adv_eg=num_adv_eg, lambd=0.05, verbose=0)
-
-            # get gap layer data
-            border_points = border_points.to(self.DEVICE)
-            border_centers = batch_run(repr_model, border_points)
-            location = os.path.join(self.model_path, "{}_{}".format(self.iteration_name, iteration), "{}_{:d}".format(self.epoch_nanme, n_epoch), "test_border_centers.npy")
-            np.save(location, border_centers)
-
-            location = os.path.join(self.model_path, "{}_{}".format(self.iteration_name, iteration), "{}_{:d}".format(self.epoch_name, n_epoch), "test_ori_border_centers.npy")
-            np.save(location, border_points.cpu().numpy())
-
-            if self.verbose > 0:
-                print("Finish generating borders for Epoch {:d}...".format(n_epoch))
-        print(
-            "Average time for generate border points for each iteration: {:.4f}".format(sum(time_borders_gen) / len(time_borders_gen)))
-
-        # save result
-        save_dir = os.path.join(self.model_path, "SV_time.json")
-        if not os.path.exists(save_dir):
-            evaluation = dict()
-        else:
-            f = open(save_dir, "r")
-            evaluation = json.load(f)
-            f.close()
-        evaluation["data_B_gene"] = round(sum(time_borders_gen) / len(time_borders_gen), 3)
-        with open(save_dir, 'w') as f:
-            json.dump(evaluation, f)
-
     def train_representation(self, iteration, epoch):
         # load train data
         train_data_loc = os.path.join(self.model_path, "{}_{:d}".format(self.iteration_name, iteration), "{}_{}".format(self.epoch_name, epoch), "train_data.npy")
-        lb_idxs = self.get_labeled_idx(iteration)
+        index_file = os.path.join(self.model_path, "{}_{:d}".format(self.iteration_name, iteration), "index.json")
         try:
-            train_data = np.load(train_data_loc)[lb_idxs]
+            train_data = self.store.get(train_data_loc, index_file)
         except Exception as e:
             print("no train data saved for Iteration {}".format(iteration))
             train_data = None
@@ -877,7 +963,7 @@ class DenseActiveLearningDataProvider(ActiveLearningDataProvider):
         # load train data
         train_data_loc = os.path.join(self.model_path, "{}_{}".format(self.iteration_name, iteration), "{}_{:d}".format(self.epoch_name, epoch), "train_data.npy")
         try:
-            train_data = np.load(train_data_loc)
+            train_data = self.store.get(train_data_loc)
         except Exception as e:
             print("no train data saved for Iteration {} Epoch {}".format(iteration, epoch))
             train_data = None
@@ -886,12 +972,9 @@ class DenseActiveLearningDataProvider(ActiveLearningDataProvider):
     def train_representation_ulb(self, iteration, epoch):
         # load train data
         train_data_loc = os.path.join(self.model_path, "{}_{:d}".format(self.iteration_name, iteration), "{}_{}".format(self.epoch_name, epoch), "train_data.npy")
-        lb_idxs = self.get_labeled_idx(iteration)
+        index_file = os.path.join(self.model_path, "{}_{:d}".format(self.iteration_name, iteration), "index.json")
         try:
-            train_data = np.load(train_data_loc)
-            pool_num = len(train_data)
-            ulb_idx = self.get_unlabeled_idx(pool_num=pool_num, lb_idx=lb_idxs)
-            train_data = train_data[ulb_idx]
+            train_data = self.store.get(train_data_loc, index_file, complement=True)
         except Exception as e:
             print("no train data saved for Iteration {}".format(iteration))
             train_data = None
@@ -913,8 +996,7 @@ class DenseActiveLearningDataProvider(ActiveLearningDataProvider):
     def train_labels(self, iteration):
         # load labelled train labels
         training_data_loc = os.path.join(self.content_path, "Training_data", "training_dataset_label.pth")
-        index_file = os.path.join(self.model_path, "{}_{:d}".format(self.iteration_name, iteration), "index.json")
-        lb_idxs = np.array(load_labelled_data_index(index_file))
+        lb_idxs = self.get_labeled_idx(iteration)
         try:
             training_labels = torch.load(training_data_loc, map_location="cpu")
             training_labels = training_labels[lb_idxs]
@@ -936,11 +1018,11 @@ class DenseActiveLearningDataProvider(ActiveLearningDataProvider):
     def test_representation(self, iteration, epoch):
         data_loc = os.path.join(self.model_path, "{}_{}".format(self.iteration_name, iteration), "{}_{}".format(self.epoch_name, epoch), "test_data.npy")
         try:
-            test_data = np.load(data_loc)
             index_file = os.path.join(self.model_path, "{}_{}".format(self.iteration_name, iteration), "test_index.json")
             if os.path.exists(index_file):
-                index = load_labelled_data_index(index_file)
-                test_data = test_data[index]
+                test_data = self.store.get(data_loc, index_file)
+            else:
+                test_data = self.store.get(data_loc)
         except Exception as e:
             print("no test data saved for Iteration {} Epoch {}".format(iteration, epoch))
             test_data = None
@@ -950,7 +1032,7 @@ class DenseActiveLearningDataProvider(ActiveLearningDataProvider):
         border_centers_loc = os.path.join(self.model_path, "{}_{}".format(self.iteration_name, iteration), "{}_{:d}".format(self.epoch_name, epoch),
                                           "border_centers.npy")
         try:
-            border_centers = np.load(border_centers_loc)
+            border_centers = self.store.get(border_centers_loc)
         except Exception as e:
             print("no border points saved for Epoch {}".format(epoch))
             border_centers = np.array([])
@@ -960,7 +1042,7 @@ class DenseActiveLearningDataProvider(ActiveLearningDataProvider):
         border_centers_loc = os.path.join(self.model_path, "{}_{}".format(self.iteration_name, iteration), "{}_{:d}".format(self.epoch_name, epoch),
                                           "test_border_centers.npy")
         try:
-            border_centers = np.load(border_centers_loc)
+            border_centers = self.store.get(border_centers_loc)
         except Exception as e:
             print("no border points saved for Iteration {} Epoch {}".format(iteration, epoch))
             border_centers = np.array([])
@@ -969,30 +1051,40 @@ class DenseActiveLearningDataProvider(ActiveLearningDataProvider):
     def max_norm(self, iteration, epoch):
         train_data_loc = os.path.join(self.model_path, "{}_{}".format(self.iteration_name, iteration), "{}_{:d}".format(self.epoch_name, epoch), "train_data.npy")
         index_file = os.path.join(self.model_path, "{}_{}".format(self.iteration_name, iteration), "index.json")
-        index = load_labelled_data_index(index_file)
         try:
-            train_data = np.load(train_data_loc)
-            train_data = train_data[index]
+            train_data = self.store.get(train_data_loc, index_file)
             max_x = np.linalg.norm(train_data, axis=1).max()
         except Exception as e:
             print("no train data saved for Iteration {} Epoch {}".format(iteration, epoch))
             max_x = None
         return max_x
 
+    def all_representation(self, iteration, rebuild=False):
+        """
+        stack the representations of all samples of all epochs in iteration into one memory-mapped file
+        :param iteration: int
+        :param rebuild: bool, rewrite the file even if it is up to date
+        :return: RepresentationTensor of shape (epochs, samples, dim)
+        """
+        epochs = list(range(1, self.epoch_num + 1, 1))
+        sources = [os.path.join(self.single_checkpoint_path(iteration, epoch), "train_data.npy") for epoch in epochs]
+
+        def load(epoch):
+            return self.store.array(os.path.join(self.single_checkpoint_path(iteration, epoch), "train_data.npy"))
+
+        path = os.path.join(self.checkpoint_path(iteration), "all_train_data.npy")
+        return self.store.consolidate(path, epochs, sources, load, rebuild)
+
     def prediction_function(self, iteration, epoch):
         model_location = os.path.join(self.model_path, "{}_{}".format(self.iteration_name, iteration), "{}_{:d}".format(self.epoch_name, epoch), "subject_model.pth")
-        self.model.load_state_dict(torch.load(model_location, map_location=torch.device("cpu")))
-        self.model.to(self.DEVICE)
-        self.model.eval()
+        self._load_subject_model(os.path.dirname(model_location))
 
         pred_fn = self.model.prediction
         return pred_fn
 
     def feature_function(self, iteration, epoch):
         model_location = os.path.join(self.model_path, "{}_{}".format(self.iteration_name, iteration), "{}_{:d}".format(self.epoch_name, epoch), "subject_model.pth")
-        self.model.load_state_dict(torch.load(model_location, map_location=torch.device("cpu")))
-        self.model = self.model.to(self.DEVICE)
-        self.model.eval()
+        self._load_subject_model(os.path.dirname(model_location))
 
         fea_fn = self.model.feature
         return fea_fn
@@ -1023,7 +1115,7 @@ class DenseActiveLearningDataProvider(ActiveLearningDataProvider):
         labels = self.test_labels(epoch)
         test_index_file = os.path.join(self.model_path,"{}_{}".format(self.iteration_name, iteration), "{}_{}".format(self.epoch_name, epoch), "test_index.json")
         if os.path.exists(test_index_file):
-            index = load_labelled_data_index(test_index_file)
+            index = self.store.index(test_index_file)
             labels = labels[index]
         pred = self.get_pred(epoch, data).argmax(-1)
         val = evaluate_inv_accu(labels, pred)
@@ -7,6 +7,14 @@ from PIL import Image
 import tensorflow as tf
 import numpy as np
 
+def vertex_attention(attention, idx, dim):
+    """attention of vertex idx, attention may be absent (None) or a constant shared by all vertices"""
+    if attention is None:
+        return np.zeros(dim, dtype=np.float32)
+    if np.isscalar(attention):
+        return np.full(dim, attention, dtype=np.float32)
+    return attention[idx]
+
 class DataHandlerAbstractClass(Dataset, ABC):
     def __init__(self, edge_to, edge_from, feature_vector) -> None:
         super().__init__()
@@ -36,8 +44,8 @@ class DataHandler(Dataset):
         edge_from_idx = self.edge_from[item]
         edge_to = self.data[edge_to_idx]
         edge_from = self.data[edge_from_idx]
-        a_to = self.attention[edge_to_idx]
-        a_from = self.attention[edge_from_idx]
+        a_to = vertex_attention(self.attention, edge_to_idx, edge_to.shape)
+        a_from = vertex_attention(self.attention, edge_from_idx, edge_from.shape)
         if self.transform is not None:
             # TODO correct or not?
             edge_to = Image.fromarray(edge_to)
@@ -67,8 +75,8 @@ class HybridDataHandler(Dataset):
         edge_from_idx = self.edge_from[item]
         edge_to = self.data[edge_to_idx]
         edge_from = self.data[edge_from_idx]
-        a_to = self.attention[edge_to_idx]
-        a_from = self.attention[edge_from_idx]
+        a_to = vertex_attention(self.attention, edge_to_idx, edge_to.shape)
+        a_from = vertex_attention(self.attention, edge_from_idx, edge_from.shape)
 
         embedded_to = self.embedded[edge_to_idx]
         coeffi_to = self.coefficient[edge_to_idx]
@@ -97,8 +105,8 @@ class DVIDataHandler(Dataset):
         edge_from_idx = self.edge_from[item]
         edge_to = self.data[edge_to_idx]
         edge_from = self.data[edge_from_idx]
-        a_to = self.attention[edge_to_idx]
-        a_from = self.attention[edge_from_idx]
+        a_to = vertex_attention(self.attention, edge_to_idx, edge_to.shape)
+        a_from = vertex_attention(self.attention, edge_from_idx, edge_from.shape)
         if self.transform is not None:
             # TODO correct or not?
             edge_to = Image.fromarray(edge_to)
@@ -122,6 +130,9 @@ def construct_edge_dataset(
     def gather_alpha(index):
         return alpha[index]
 
+    # attention may be absent (None) or a constant shared by all vertices
+    constant_alpha = None if isinstance(alpha, np.ndarray) else (0.0 if alpha is None else float(alpha))
+
     gather_indices_in_python = True if data.nbytes * 1e-9 > 0.5 else False
 
     def gather_X(edge_to, edge_from, weight):
@@ -129,14 +140,19 @@ def construct_edge_dataset(
             # if True:
             edge_to_batch = tf.py_function(gather_index, [edge_to], [tf.float32])[0]
             edge_from_batch = tf.py_function(gather_index, [edge_from], [tf.float32])[0]
-            alpha_to = tf.py_function(gather_alpha, [edge_to], [tf.float32])[0]
-            alpha_from = tf.py_function(gather_alpha, [edge_from], [tf.float32])[0]
         else:
             edge_to_batch = tf.gather(data, edge_to)
             edge_from_batch = tf.gather(data, edge_from)
+        if constant_alpha is not None:
+            alpha_to = tf.fill(tf.shape(edge_to_batch), constant_alpha)
+            alpha_from = tf.fill(tf.shape(edge_from_batch), constant_alpha)
+        elif gather_indices_in_python:
+            alpha_to = tf.py_function(gather_alpha, [edge_to], [tf.float32])[0]
+            alpha_from = tf.py_function(gather_alpha, [edge_from], [tf.float32])[0]
+        else:
             alpha_to = tf.gather(alpha, edge_to)
             alpha_from = tf.gather(alpha, edge_from)
-            
+
         to_n_rate = tf.gather(n_rates, edge_to)
         outputs = {"umap": 0}
         outputs["reconstruction"] = edge_to_batch
@@ -0,0 +1,104 @@
+"""
+Edge loader from temporal complex
+Drop-in replacement of DataLoader(DataHandler, sampler=WeightedRandomSampler) for the trainers:
+edges are sampled per batch from the cumulative weights and every batch is built with one gather per tensor.
+"""
+import math
+import numpy as np
+import torch
+
+
+class EdgeLoader:
+    '''Iterate over n_samples edges drawn with replacement proportional to probs, in batches of (edge_to, edge_from, a_to, a_from)'''
+    def __init__(self, edge_to, edge_from, probs, feature_vectors, attention, n_samples, batch_size=1000, device=None, chunk_size=2**20):
+        """
+        Parameters
+        ----------
+        edge_to : ndarray
+            head of each edge
+        edge_from : ndarray
+            tail of each edge
+        probs : ndarray
+            sampling weight of each edge, not necessarily normalized
+        feature_vectors : ndarray
+            representation of each vertex
+        attention : ndarray, float or None
+            attention of each vertex, a constant for all vertices or None for no attention
+        n_samples : int
+            number of edges drawn in one pass (epoch)
+        batch_size : int, by default 1000
+        device : torch.device, optional
+            where tensors and batches live, by default cpu
+        chunk_size : int, by default 2**20
+            number of edge indices drawn at once
+        """
+        self.device = torch.device("cpu") if device is None else device
+        # indices keep their (int32) dtype and are widened per batch
+        self.edge_to = self._tensor(edge_to)
+        self.edge_from = self._tensor(edge_from)
+        self.data = self._tensor(feature_vectors, dtype=torch.float32)
+        self.attention = self._attention(attention)
+        # inverse transform sampling, unlike torch.multinomial it has no limit of 2^24 categories
+        self.cdf = torch.cumsum(self._tensor(probs, dtype=torch.float64), dim=0)
+        self.n_samples = int(n_samples)
+        self.batch_size = int(batch_size)
+        self.chunk_size = max(int(chunk_size) // self.batch_size, 1) * self.batch_size
+
+    def _tensor(self, array, dtype=None):
+        return torch.as_tensor(np.ascontiguousarray(array)).to(device=self.device, dtype=dtype)
+
+    def _attention(self, attention):
+        # a constant is kept as a 0-dim tensor and broadcast in ReconstructionLoss
+        if attention is None:
+            return torch.zeros((), dtype=torch.float32, device=self.device)
+        if np.isscalar(attention):
+            return torch.tensor(attention, dtype=torch.float32, device=self.device)
+        return self._tensor(attention, dtype=torch.float32)
+
+    def _vertex_attention(self, idxs):
+        if self.attention.dim() == 0:
+            return self.attention
+        return self.attention[idxs]
+
+    def sample(self, num):
+        """draw num edge indices with replacement"""
+        u = torch.rand(num, dtype=torch.float64, device=self.device) * self.cdf[-1]
+        idxs = torch.searchsorted(self.cdf, u, right=True)
+        return idxs.clamp_(max=len(self.cdf) - 1)
+
+    def gather(self, idxs):
+        to_idxs = self.edge_to[idxs].long()
+        from_idxs = self.edge_from[idxs].long()
+        return self.data[to_idxs], self.data[from_idxs], self._vertex_attention(to_idxs), self._vertex_attention(from_idxs)
+
+    def __iter__(self):
+        for start in range(0, self.n_samples, self.chunk_size):
+            idxs = self.sample(min(self.chunk_size, self.n_samples - start))
+            for batch in torch.split(idxs, self.batch_size):
+                yield self.gather(batch)
+
+    def __len__(self):
+        # number of batches, same as DataLoader with drop_last=False
+        return math.ceil(self.n_samples / self.batch_size)
+
+
+class HybridEdgeLoader(EdgeLoader):
+    '''EdgeLoader yielding (edge_to, edge_from, a_to, a_from, embedded_to, coeffi_to) for HybridVisTrainer'''
+    def __init__(self, edge_to, edge_from, probs, feature_vectors, attention, embedded, coefficient, n_samples, batch_size=1000, device=None, chunk_size=2**20):
+        """
+        Parameters
+        ----------
+        embedded : ndarray
+            replay of positions generated by previous visualization
+        coefficient : ndarray
+            whether samples have generated positions
+        see EdgeLoader for the others
+        """
+        super().__init__(edge_to, edge_from, probs, feature_vectors, attention, n_samples, batch_size, device, chunk_size)
+        self.embedded = self._tensor(embedded, dtype=torch.float32)
+        self.coefficient = self._tensor(coefficient, dtype=torch.float32)
+
+    def gather(self, idxs):
+        to_idxs = self.edge_to[idxs].long()
+        from_idxs = self.edge_from[idxs].long()
+        return self.data[to_idxs], self.data[from_idxs], self._vertex_attention(to_idxs), self._vertex_attention(from_idxs), self.embedded[to_idxs], self.coefficient[to_idxs]
@@ -3,7 +3,7 @@ Help functions to evaluate our visualization system
 """
 
 import numpy as np
-from pynndescent import NNDescent
+from singleVis.knn_graph import neighbor_graph
 from sklearn.neighbors import NearestNeighbors
 from sklearn.manifold import trustworthiness
 from scipy.stats import kendalltau, spearmanr, pearsonr, rankdata
@@ -21,26 +21,8 @@ def evaluate_proj_nn_perseverance_knn(data, embedding, n_neighbors, metric="eucl
     n_trees = 5 + int(round((data.shape[0]) ** 0.5 / 20.0))
     n_iters = max(5, int(round(np.log2(data.shape[0]))))
     # get nearest neighbors
-    nnd = NNDescent(
-        data,
-        n_neighbors=n_neighbors,
-        metric=metric,
-        n_trees=n_trees,
-        n_iters=n_iters,
-        max_candidates=60,
-        verbose=True
-    )
-    high_ind, _ = nnd.neighbor_graph
-    nnd = NNDescent(
-        embedding,
-        n_neighbors=n_neighbors,
-        metric=metric,
-        n_trees=n_trees,
-        n_iters=n_iters,
-        max_candidates=60,
-        verbose=True
-    )
-    low_ind, _ = nnd.neighbor_graph
+    high_ind, _ = neighbor_graph(data, n_neighbors, metric=metric, n_trees=n_trees, n_iters=n_iters, verbose=True)
+    low_ind, _ = neighbor_graph(embedding, n_neighbors, metric=metric, n_trees=n_trees, n_iters=n_iters, verbose=True)
 
     border_pres = np.zeros(len(data))
     for i in range(len(data)):
@@ -278,13 +278,13 @@ class Evaluator(EvaluatorAbstractClass):
         epoch_num = (self.data_provider.e - self.data_provider.s) // self.data_provider.p + 1
         train_num = self.data_provider.train_num
 
-        high_features = np.zeros((epoch_num*train_num, feature_dim))
-        low_features = np.zeros((epoch_num*train_num, 2))
-
-        for t in range(epoch_num):
-            data = self.data_provider.train_representation(t * self.data_provider.p + self.data_provider.s)
-            high_features[t*train_num:(t+1)*train_num] = np.copy(data)
-            low_features[t*train_num:(t+1)*train_num] = self.projector.batch_project(t * self.data_provider.p + self.data_provider.s, data)
+        # the consolidated file is contiguous, so flattening it does not copy
+        all_train_repr = self.data_provider.all_representation("train")
+        high_features = all_train_repr.data.reshape(epoch_num*train_num, feature_dim)
+        # (train_num, epoch_num, 2) -> epoch-major like high_features
+        epochs = list(range(self.data_provider.s, self.data_provider.e+1, self.data_provider.p))
+        embedding_cube = self.projector.project_all_epochs(epochs, lambda epoch: np.array(all_train_repr.epoch(epoch)))
+        low_features = embedding_cube.transpose(1, 0, 2).reshape(epoch_num*train_num, 2)
         
         val = evaluate_proj_nn_perseverance_knn(high_features, low_features, n_neighbors)
 
@@ -326,15 +326,13 @@ class Evaluator(EvaluatorAbstractClass):
         # set parameters
         LEN = self.data_provider.train_num
         EPOCH = (end - start) // period + 1
-        repr_dim = self.data_provider.representation_dim
-        all_train_repr = np.zeros((EPOCH,LEN,repr_dim))
+        # view over the consolidated representation vectors
+        all_train_repr = self.data_provider.all_representation("train").epoch_range(start, end, period)
         low_repr = np.zeros((EPOCH,LEN,2))
 
-        # save all representation vectors
         for i in range(start,end + 1, period):
             index = (i - start) //  period
-            all_train_repr[index] = self.data_provider.train_representation(i)
-            low_repr[index] = self.projector.batch_project(i, all_train_repr[index])
+            low_repr[index] = self.projector.batch_project(i, np.array(all_train_repr[index]))
         
         corrs = np.zeros(LEN)
         ps = np.zeros(LEN)
@@ -358,14 +356,13 @@ class Evaluator(EvaluatorAbstractClass):
             period = self.data_provider.p
         TEST_LEN = self.data_provider.test_num
         EPOCH = (end - start) // period + 1
-        repr_dim = self.data_provider.representation_dim
 
-        all_test_repr = np.zeros((EPOCH,TEST_LEN,repr_dim))
+        # view over the consolidated representation vectors
+        all_test_repr = self.data_provider.all_representation("test").epoch_range(start, end, period)
         low_repr = np.zeros((EPOCH,TEST_LEN,2))
         for i in range(start,end + 1, period):
             index = (i - start) //  period
-            all_test_repr[index] = self.data_provider.test_representation(i)
-            low_repr[index] = self.projector.batch_project(i, all_test_repr[index])
+            low_repr[index] = self.projector.batch_project(i, np.array(all_test_repr[index]))
 
         corrs = np.zeros(TEST_LEN)
         ps = np.zeros(TEST_LEN)
@@ -389,15 +386,13 @@ class Evaluator(EvaluatorAbstractClass):
         # set parameters
         LEN = self.data_provider.train_num
         EPOCH = (end - start) // period + 1
-        repr_dim = self.data_provider.representation_dim
-        all_train_repr = np.zeros((EPOCH,LEN,repr_dim))
+        # view over the consolidated representation vectors
+        all_train_repr = self.data_provider.all_representation("train").epoch_range(start, end, period)
         low_repr = np.zeros((EPOCH,LEN,2))
 
-        # save all representation vectors
         for i in range(start,end + 1, period):
             index = (i - start) //  period
-            all_train_repr[index] = self.data_provider.train_representation(i)
-            low_repr[index] = self.projector.batch_project(i, all_train_repr[index])
+            low_repr[index] = self.projector.batch_project(i, np.array(all_train_repr[index]))
         
         corrs = np.zeros(LEN)
         for i in range(LEN):
@@ -422,14 +417,13 @@ class Evaluator(EvaluatorAbstractClass):
             period = self.data_provider.p
         TEST_LEN = self.data_provider.test_num
         EPOCH = (end - start) // period + 1
-        repr_dim = self.data_provider.representation_dim
 
-        all_test_repr = np.zeros((EPOCH,TEST_LEN,repr_dim))
+        # view over the consolidated representation vectors
+        all_test_repr = self.data_provider.all_representation("test").epoch_range(start, end, period)
         low_repr = np.zeros((EPOCH,TEST_LEN,2))
         for i in range(start,end + 1, period):
             index = (i - start) //  period
-            all_test_repr[index] = self.data_provider.test_representation(i)
-            low_repr[index] = self.projector.batch_project(i, all_test_repr[index])
+            low_repr[index] = self.projector.batch_project(i, np.array(all_test_repr[index]))
 
         corrs = np.zeros(TEST_LEN)
         e = (epoch - start) // period
@@ -459,17 +453,15 @@ class Evaluator(EvaluatorAbstractClass):
         # set parameters
         LEN = self.data_provider.train_num
         EPOCH = len(selected_stage)
-        repr_dim = self.data_provider.representation_dim
-        all_train_repr = np.zeros((EPOCH,LEN,repr_dim))
         low_repr = np.zeros((EPOCH,LEN,2))
 
         s = selected_stage[0]
 
-        # save all representation vectors
+        # view over the consolidated representation vectors
+        all_train_repr = self.data_provider.all_representation("train").epoch_range(s, selected_stage[-1], period)
         for i in selected_stage:
             index = (i - s) //  period
-            all_train_repr[index] = self.data_provider.train_representation(i)
-            low_repr[index] = self.projector.batch_project(i, all_train_repr[index])
+            low_repr[index] = self.projector.batch_project(i, np.array(all_train_repr[index]))
         
         corrs = np.zeros(LEN)
         for i in range(LEN):
@@ -497,14 +489,13 @@ class Evaluator(EvaluatorAbstractClass):
 
         TEST_LEN = self.data_provider.test_num
         EPOCH = len(selected_stage)
-        repr_dim = self.data_provider.representation_dim
 
-        all_test_repr = np.zeros((EPOCH,TEST_LEN,repr_dim))
+        # view over the consolidated representation vectors
+        all_test_repr = self.data_provider.all_representation("test").epoch_range(s, selected_stage[-1], period)
         low_repr = np.zeros((EPOCH,TEST_LEN,2))
         for i in selected_stage:
             index = (i-s)//period
-            all_test_repr[index] = self.data_provider.test_representation(i)
-            low_repr[index] = self.projector.batch_project(i, all_test_repr[index])
+            low_repr[index] = self.projector.batch_project(i, np.array(all_test_repr[index]))
 
         corrs = np.zeros(TEST_LEN)
         e = (epoch - s) // period
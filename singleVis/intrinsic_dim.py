@@ -1,6 +1,6 @@
 from audioop import mul
 import numpy as np
-from pynndescent import NNDescent
+from singleVis.knn_graph import neighbor_graph
 from sklearn.linear_model import LinearRegression
 from tqdm import tqdm
 
@@ -15,22 +15,8 @@ class IntrinsicDim:
 
 
     def find_mu(self):
-        # number of trees in random projection forest
-        n_trees = min(64, 5 + int(round((self.data.shape[0]) ** 0.5 / 20.0)))
-        # max number of nearest neighbor iters to perform
-        n_iters = max(5, int(round(np.log2(self.data.shape[0]))))
-        # distance metric
         # get nearest neighbors
-        nnd = NNDescent(
-            self.data,
-            n_neighbors=3,
-            metric=self.metric,
-            n_trees=n_trees,
-            n_iters=n_iters,
-            max_candidates=10,
-            verbose=False
-        )
-        _, knn_dists = nnd.neighbor_graph
+        _, knn_dists = neighbor_graph(self.data, 3, metric=self.metric, max_candidates=10)
         mu = knn_dists[:, 2] / knn_dists[:, 1]
         return mu
 
@@ -32,17 +32,95 @@ from __future__ import print_function
 import time
 import numpy as np
 import math
+from concurrent.futures import ThreadPoolExecutor
 from sklearn.metrics import pairwise_distances
 
 class kCenterGreedy(object):
 
-  def __init__(self, X, metric='euclidean'):
+  def __init__(self, X, metric='euclidean', backend='sklearn', n_jobs=None, working_memory=256, device=None):
+    """
+    Args:
+      X: features, flattened to (n_obs, -1)
+      metric: distance metric passed to pairwise_distances
+      backend: 'sklearn' (exact, the default) or 'torch' (torch.cdist, euclidean
+        only, may round the last bits differently and thus break ties differently)
+      n_jobs: number of threads the distance rows are split over, None for one
+      working_memory: MiB of distances kept alive at once
+      device: torch device for the 'torch' backend
+    """
     self.features = X.reshape(len(X), -1)
     self.name = 'kcenter'
     self.metric = metric
+    self.backend = backend
+    self.n_jobs = n_jobs
+    self.working_memory = working_memory
+    self.device = device
     self.min_distances = None
     self.n_obs = self.features.shape[0]
     self.already_selected = []
+    # O(1) membership test for selected centers
+    self.selected_mask = np.zeros(self.n_obs, dtype=bool)
+    self._pool = None
+    self._features_t = None
+
+  def close(self):
+    """Shut down the worker threads of n_jobs, they are started again if needed."""
+    if getattr(self, "_pool", None) is not None:
+      self._pool.shutdown(wait=False)
+      self._pool = None
+
+  def __del__(self):
+    self.close()
+
+  def _chunk_size(self, n_centers):
+    itemsize = 4 if self.features.dtype == np.float32 else 8
+    rows = max(1, int(self.working_memory * 2 ** 20 // (itemsize * max(n_centers, 1))))
+    if self.n_jobs is not None and self.n_jobs > 1:
+      rows = min(rows, math.ceil(self.n_obs / self.n_jobs))
+    return rows
+
+  def _min_distances(self, cluster_centers):
+    """min distance of every point to cluster_centers, (n_obs, 1)
+
+    Rows are computed in chunks so that at most working_memory MiB of the
+    n_obs x len(cluster_centers) distance matrix is alive at once.
+    """
+    x = self.features[cluster_centers]
+    if self.backend == 'torch':
+      return self._torch_min_distances(x)
+
+    dtype = np.float32 if self.features.dtype == np.float32 and x.dtype == np.float32 else np.float64
+    min_distances = np.empty((self.n_obs, 1), dtype=dtype)
+    chunk_size = self._chunk_size(len(x))
+
+    def fill(start):
+      dist = pairwise_distances(self.features[start:start + chunk_size], x, metric=self.metric)
+      min_distances[start:start + chunk_size, 0] = np.min(dist, axis=1)
+
+    starts = range(0, self.n_obs, chunk_size)
+    if self.n_jobs is not None and self.n_jobs > 1 and len(starts) > 1:
+      if self._pool is None:
+        self._pool = ThreadPoolExecutor(max_workers=self.n_jobs)
+      list(self._pool.map(fill, starts))
+    else:
+      for start in starts:
+        fill(start)
+    return min_distances
+
+  def _torch_min_distances(self, x):
+    import torch
+    if self.metric != 'euclidean':
+      raise NotImplementedError("torch backend only supports euclidean distance, got {}".format(self.metric))
+    if self._features_t is None:
+      self._features_t = torch.from_numpy(np.ascontiguousarray(self.features)).to(device=self.device)
+    x = torch.from_numpy(np.ascontiguousarray(x)).to(device=self.device, dtype=self._features_t.dtype)
+    chunk_size = self._chunk_size(len(x))
+    min_distances = torch.empty(self.n_obs, dtype=self._features_t.dtype, device=self.device)
+    with torch.no_grad():
+      for start in range(0, self.n_obs, chunk_size):
+        dist = torch.cdist(self._features_t[start:start + chunk_size], x)
+        min_distances[start:start + chunk_size] = dist.min(dim=1)[0]
+    return min_distances.cpu().numpy().reshape(-1, 1)
 
   def update_distances(self, cluster_centers, only_new=True, reset_dist=False):
     """Update min distances given cluster centers.
@@ -56,18 +134,19 @@ class kCenterGreedy(object):
 
     if reset_dist:
       self.min_distances = None
+      self.selected_mask[:] = False
+    cluster_centers = np.asarray(cluster_centers, dtype=np.int64).reshape(-1)
     if only_new:
-      cluster_centers = [d for d in cluster_centers
-                         if d not in self.already_selected]
-    if cluster_centers is not None:
+      cluster_centers = cluster_centers[~self.selected_mask[cluster_centers]]
+    if len(cluster_centers) > 0:
       # Update min_distances for all examples given new cluster center.
-      x = self.features[cluster_centers]
-      dist = pairwise_distances(self.features, x, metric=self.metric)
+      dist = self._min_distances(cluster_centers)
 
       if self.min_distances is None:
-        self.min_distances = np.min(dist, axis=1).reshape(-1,1)
+        self.min_distances = dist
       else:
-        self.min_distances = np.minimum(self.min_distances, dist)
+        np.minimum(self.min_distances, dist, out=self.min_distances)
+      self.selected_mask[cluster_centers] = True
 
   def select_batch_with_budgets(self, already_selected, budgets, return_min=False):
     """
@@ -94,7 +173,7 @@ class kCenterGreedy(object):
       ind = np.argmax(self.min_distances)
       # New examples should not be in already selected since those points
       # should have min_distance of zero to a cluster center.
-      assert ind not in already_selected
+      assert not self.selected_mask[ind]
 
       self.update_distances([ind], only_new=True, reset_dist=False)
       new_batch.append(ind)
@@ -142,7 +221,7 @@ class kCenterGreedy(object):
         break
       # New examples should not be in already selected since those points
       # should have min_distance of zero to a cluster center.
-      assert ind not in already_selected
+      assert not self.selected_mask[ind]
 
       self.update_distances([ind], only_new=True, reset_dist=False)
       new_batch.append(ind)
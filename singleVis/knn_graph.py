@@ -0,0 +1,189 @@
+"""kNN graph service: every NNDescent graph over the same data is built once and shared by all call sites"""
+import os
+import re
+import glob
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+from pynndescent import NNDescent
+
+
+def nndescent_params(n):
+    """default number of trees in random projection forest and max number of nearest neighbor iters for n samples"""
+    n_trees = min(64, 5 + int(round(n ** 0.5 / 20.0)))
+    n_iters = max(5, int(round(np.log2(n))))
+    return n_trees, n_iters
+
+
+def map_init_graph(prev_indices, prev_idxs, curr_idxs, n_neighbors, random_state=None):
+    """
+    seed for NNDescent(init_graph=...) over the samples curr_idxs from a knn graph over the samples prev_idxs,
+    e.g. the graph of the previous epoch mapped through the selected-index lists
+    :param prev_indices: ndarray, (len(prev_idxs), k), the previous graph as positions into prev_idxs
+    :param prev_idxs: ndarray, sample ids of the previous graph
+    :param curr_idxs: ndarray, sample ids of the new graph
+    :param n_neighbors: int
+    :param random_state: int, seed of the random neighbors filled in for entries that cannot be mapped
+    :return: ndarray, (len(curr_idxs), n_neighbors), positions into curr_idxs
+    """
+    prev_idxs = np.asarray(prev_idxs, dtype=np.int64)
+    curr_idxs = np.asarray(curr_idxs, dtype=np.int64)
+    n = len(curr_idxs)
+    size = int(max(prev_idxs.max(), curr_idxs.max())) + 1
+    curr_pos = np.full(size, -1, dtype=np.int64)
+    curr_pos[curr_idxs] = np.arange(n)
+    prev_pos = np.full(size, -1, dtype=np.int64)
+    prev_pos[prev_idxs] = np.arange(len(prev_idxs))
+
+    init_graph = np.random.RandomState(random_state).randint(0, n, size=(n, n_neighbors))
+    # row of each current sample in the previous graph
+    rows = prev_pos[curr_idxs]
+    has_row = rows >= 0
+    k = min(n_neighbors, prev_indices.shape[1])
+    neighbors = prev_indices[rows[has_row], :k]
+    mapped = np.where(neighbors >= 0, curr_pos[prev_idxs[np.maximum(neighbors, 0)]], -1)
+    block = init_graph[has_row, :k]
+    np.copyto(block, mapped, where=mapped >= 0)
+    init_graph[has_row, :k] = block
+    return init_graph.astype(np.int32)
+
+
+def fingerprint(data):
+    """content hash of an array, identifies an (epoch, subset) of representations without knowing where it comes from"""
+    data = np.ascontiguousarray(data)
+    h = hashlib.blake2b(digest_size=16)
+    h.update("{}{}".format(data.shape, data.dtype.str).encode())
+    h.update(memoryview(data).cast("B"))
+    return h.hexdigest()
+
+
+class KNNGraphService:
+    '''Build kNN graphs with NNDescent once and serve them afterwards.
+
+    Graphs are keyed by (content of the data, metric) and hold k neighbors; a request for any k smaller than
+    a cached graph is served by its first k columns. A graph is only served to requests whose NNDescent
+    parameters (n_trees, n_iters, max_candidates) are at most the ones it was built with.
+    Graphs are kept in an in-memory LRU bounded by max_bytes and, when a save_dir is given (e.g. the checkpoint
+    directory next to train_data.npy), persisted there as .npy files, the least recently used beyond max_disk_graphs are removed.
+    '''
+    def __init__(self, max_bytes=1024**3, max_disk_graphs=4):
+        """
+        Parameters
+        ----------
+        max_bytes : int
+            memory budget of the graphs kept in memory, by default 1GB, the most recent graph is always kept
+        max_disk_graphs : int
+            the number of graphs to keep in each save_dir, by default 4
+        """
+        self.max_bytes = max_bytes
+        self.max_disk_graphs = max_disk_graphs
+        self._graphs = OrderedDict()
+        self._nbytes = 0
+
+    def _remember(self, key, graph):
+        if key in self._graphs:
+            self._nbytes -= sum(a.nbytes for a in self._graphs.pop(key))
+        self._graphs[key] = graph
+        self._nbytes += sum(a.nbytes for a in graph)
+        while self._nbytes > self.max_bytes and len(self._graphs) > 1:
+            _, old = self._graphs.popitem(last=False)
+            self._nbytes -= sum(a.nbytes for a in old)
+
+    @staticmethod
+    def _serves(k, build, n_neighbors, request):
+        # build and request are (n_trees, n_iters, max_candidates)
+        return k >= n_neighbors and all(b >= r for b, r in zip(build, request))
+
+    def _from_memory(self, key, metric, n_neighbors, request):
+        for (fp, m, k, build), graph in self._graphs.items():
+            if fp == key and m == metric and self._serves(k, build, n_neighbors, request):
+                self._graphs.move_to_end((fp, m, k, build))
+                return graph
+        return None
+
+    def _from_disk(self, key, metric, n_neighbors, request, save_dir):
+        best = None
+        for path in glob.glob(os.path.join(save_dir, "knn_{}_{}_k*_indices.npy".format(key, metric))):
+            match = re.search(r"_k(\d+)_t(\d+)_i(\d+)_c(\d+)_indices\.npy$", path)
+            if match is None:
+                continue
+            k, build = int(match.group(1)), tuple(int(g) for g in match.group(2, 3, 4))
+            if self._serves(k, build, n_neighbors, request) and (best is None or k < best[0]):
+                best = (k, build, path)
+        if best is None:
+            return None
+        k, build, path = best
+        dists_path = path[:-len("_indices.npy")] + "_dists.npy"
+        graph = (np.load(path), np.load(dists_path))
+        # mark as recently used
+        os.utime(path)
+        self._remember((key, metric, k, build), graph)
+        return graph
+
+    def _prune(self, save_dir):
+        """remove the least recently used graphs of save_dir beyond max_disk_graphs"""
+        paths = sorted(glob.glob(os.path.join(save_dir, "knn_*_indices.npy")), key=os.path.getmtime)
+        for path in paths[:max(len(paths) - self.max_disk_graphs, 0)]:
+            for f in [path, path[:-len("_indices.npy")] + "_dists.npy"]:
+                try:
+                    os.remove(f)
+                except FileNotFoundError:
+                    pass
+
+    def neighbor_graph(self, data, n_neighbors, metric="euclidean", save_dir=None, n_trees=None, n_iters=None, max_candidates=60, verbose=False, init_graph=None):
+        """
+        kNN graph of data, the same as NNDescent(data, ...).neighbor_graph
+        :param data: ndarray, (N, dim)
+        :param n_neighbors: int, number of neighbors (including the point itself)
+        :param metric: str, by default "euclidean"
+        :param save_dir: str, directory to persist the graph in, None to keep it in memory only
+        :param n_trees, n_iters, max_candidates, verbose: NNDescent parameters used when the graph has to be built
+        :param init_graph: ndarray, (N, n_neighbors), warm start NNDescent from this graph instead of random projection trees, see map_init_graph
+        :return: (knn_indices, knn_dists), (N, n_neighbors)
+        """
+        key = fingerprint(data)
+        default_trees, default_iters = nndescent_params(len(data))
+        n_trees = default_trees if n_trees is None else n_trees
+        n_iters = default_iters if n_iters is None else n_iters
+        # a warm start replaces the random projection trees
+        request = (0 if init_graph is not None else n_trees, n_iters, max_candidates)
+        graph = self._from_memory(key, metric, n_neighbors, request)
+        if graph is None and save_dir is not None:
+            graph = self._from_disk(key, metric, n_neighbors, request, save_dir)
+        if graph is None:
+            warm_start = dict() if init_graph is None else dict(init_graph=init_graph, tree_init=False)
+            nnd = NNDescent(
+                data,
+                n_neighbors=n_neighbors,
+                metric=metric,
+                n_trees=n_trees,
+                n_iters=n_iters,
+                max_candidates=max_candidates,
+                verbose=verbose,
+                **warm_start
+            )
+            graph = nnd.neighbor_graph
+            self._remember((key, metric, n_neighbors, request), graph)
+            if save_dir is not None:
+                prefix = os.path.join(save_dir, "knn_{}_{}_k{}_t{}_i{}_c{}".format(key, metric, n_neighbors, *request))
+                np.save(prefix + "_dists.npy", graph[1])
+                # the indices file marks the graph as complete
+                np.save(prefix + "_indices.npy", graph[0])
+                self._prune(save_dir)
+        knn_indices, knn_dists = graph
+        # copies, so that callers cannot modify the cached graph
+        return np.array(knn_indices[:, :n_neighbors]), np.array(knn_dists[:, :n_neighbors])
+
+    def clear(self):
+        self._graphs.clear()
+        self._nbytes = 0
+
+
+# shared by every call site
+knn_service = KNNGraphService()
+
+
+def neighbor_graph(data, n_neighbors, metric="euclidean", save_dir=None, **kwargs):
+    """kNN graph of data from the shared KNNGraphService, see KNNGraphService.neighbor_graph"""
+    return knn_service.neighbor_graph(data, n_neighbors, metric=metric, save_dir=save_dir, **kwargs)
@@ -74,9 +74,15 @@ class ReconstructionLoss(nn.Module):
         super(ReconstructionLoss, self).__init__()
         self._beta = beta
 
+    def _weight(self, a):
+        # attention may be absent (None), a constant or a per sample tensor
+        if a is None:
+            return 1.0
+        return torch.pow((1+torch.as_tensor(a)), self._beta)
+
     def forward(self, edge_to, edge_from, recon_to, recon_from, a_to, a_from):
-        loss1 = torch.mean(torch.mean(torch.multiply(torch.pow((1+a_to), self._beta), torch.pow(edge_to - recon_to, 2)), 1))
-        loss2 = torch.mean(torch.mean(torch.multiply(torch.pow((1+a_from), self._beta), torch.pow(edge_from - recon_from, 2)), 1))
+        loss1 = torch.mean(torch.mean(torch.multiply(self._weight(a_to), torch.pow(edge_to - recon_to, 2)), 1))
+        loss2 = torch.mean(torch.mean(torch.multiply(self._weight(a_from), torch.pow(edge_from - recon_from, 2)), 1))
         # without attention weights
         # loss1 = torch.mean(torch.mean(torch.pow(edge_to - recon_to, 2), 1))
         # loss2 = torch.mean(torch.mean(torch.pow(edge_from - recon_from, 2), 1))
@@ -0,0 +1,54 @@
+"""Producer/consumer pipeline: build the complex of the next time step (or segment) while the current one trains"""
+import queue
+import threading
+
+_END = object()
+
+
+def prefetch(items, depth=1):
+    """
+    iterate items in a worker thread, at most depth items ahead of the consumer
+    the worker is a thread so that items can close over the data provider and the subject model (CUDA, tensorflow),
+    NNDescent (numba), the distance computations (BLAS) and torch release the GIL while they run
+    :param items: iterable, e.g. a generator yielding the complex of every time step; it is only advanced in the worker
+    :param depth: int, the number of items built but not consumed yet, 0 to iterate items in the caller
+    :return: generator of items in order, an exception raised by items is raised to the consumer
+    """
+    if depth <= 0:
+        yield from items
+        return
+
+    q = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(value):
+        # give up once the consumer is gone, instead of blocking on a full queue forever
+        while not stop.is_set():
+            try:
+                q.put(value, timeout=.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def work():
+        try:
+            for item in items:
+                if not put((item, None)):
+                    return
+            put((_END, None))
+        except BaseException as e:
+            put((_END, e))
+
+    worker = threading.Thread(target=work, daemon=True)
+    worker.start()
+    try:
+        while True:
+            item, error = q.get()
+            if error is not None:
+                raise error
+            if item is _END:
+                return
+            yield item
+    finally:
+        stop.set()
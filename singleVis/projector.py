@@ -2,9 +2,12 @@
 from abc import ABC, abstractmethod
 import os
 import json
+from collections import OrderedDict
 import numpy as np
 import torch
 
+from singleVis.knn_graph import fingerprint
+
 class ProjectorAbstractClass(ABC):
 
     @abstractmethod
@@ -32,236 +35,442 @@ class ProjectorAbstractClass(ABC):
         pass
 
 class Projector(ProjectorAbstractClass):
-    def __init__(self, vis_model, content_path, vis_model_name, device):
+    def __init__(self, vis_model, content_path, vis_model_name, device, batch_size=10000, state_cache_size=8, embedding_cache_size=32):
+        """
+        Parameters
+        ----------
+        vis_model : VisModel
+        content_path : str
+        vis_model_name : str
+        device : torch.device
+        batch_size : int, by default 10000
+            number of samples pushed through the encoder/decoder at once
+        state_cache_size : int, by default 8
+            number of visualization model state dicts kept in memory, so that switching epochs does not read the .pth again
+        embedding_cache_size : int, by default 32
+            number of batch_project results kept in memory, keyed by the loaded model and the content of the data
+        """
         self.vis_model = vis_model
         self.content_path = content_path
         self.vis_model_name = vis_model_name
         self.DEVICE = device
-    
+        self.batch_size = batch_size
+        self.state_cache_size = state_cache_size
+        self.embedding_cache_size = embedding_cache_size
+        self._states = OrderedDict()
+        self._embeddings = OrderedDict()
+        # (file path, modification time) of the state dict in vis_model
+        self._loaded = None
+
     def load(self, iteration):
         raise NotImplementedError
-    
+
+    def _remember(self, cache, key, value, capacity):
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > capacity:
+            cache.popitem(last=False)
+
+    def _state_path(self, iteration):
+        """.pth file of the visualization model used for iteration"""
+        raise NotImplementedError
+
+    def _state_dict(self, file_path):
+        key = (file_path, os.stat(file_path).st_mtime_ns)
+        if key in self._states:
+            self._states.move_to_end(key)
+        else:
+            self._remember(self._states, key, torch.load(file_path, map_location="cpu")["state_dict"], self.state_cache_size)
+        return key, self._states[key]
+
+    def _load_state(self, file_path):
+        """
+        load the state dict saved in file_path into vis_model
+        :param file_path: str, .pth file with a "state_dict"
+        :return: bool, False if it is in vis_model already
+        """
+        if (file_path, os.stat(file_path).st_mtime_ns) == self._loaded:
+            return False
+        key, state_dict = self._state_dict(file_path)
+        self.vis_model.load_state_dict(state_dict)
+        self.vis_model.to(self.DEVICE)
+        self.vis_model.eval()
+        self._loaded = key
+        return True
+
+    def _infer(self, module, data):
+        """run module over data in chunks of batch_size without building autograd graphs"""
+        outputs = list()
+        with torch.inference_mode():
+            # an empty input still goes through module once for the output shape
+            for start in range(0, max(len(data), 1), self.batch_size):
+                batch = torch.from_numpy(np.ascontiguousarray(data[start:start+self.batch_size])).to(dtype=torch.float32, device=self.DEVICE)
+                outputs.append(module(batch).cpu().numpy())
+        return np.concatenate(outputs, axis=0)
+
+    def _embed(self, data):
+        """encoder output of data for the loaded model, memoized"""
+        key = (self._loaded, fingerprint(data))
+        if key in self._embeddings:
+            self._embeddings.move_to_end(key)
+        else:
+            self._remember(self._embeddings, key, self._infer(self.vis_model.encoder, data), self.embedding_cache_size)
+        return self._embeddings[key].copy()
+
+    @property
+    def cache_nbytes(self):
+        """bytes held by the cached state dicts and embeddings"""
+        states = sum(t.numel()*t.element_size() for state_dict in self._states.values() for t in state_dict.values())
+        return states + sum(e.nbytes for e in self._embeddings.values())
+
+    def clear_cache(self):
+        self._states.clear()
+        self._embeddings.clear()
+        self._loaded = None
+
+    def _stacked_layers(self, state_dicts):
+        """
+        encoder weights of several models stacked along a new first axis, one (weight, bias) per Linear layer and None per ReLU
+        :return: list, None if the encoder is not a sequence of Linear and ReLU layers
+        """
+        layers = list()
+        for name, module in self.vis_model.encoder.named_children():
+            if isinstance(module, torch.nn.Linear) and module.bias is not None:
+                weight = torch.stack([state_dict["encoder.{}.weight".format(name)] for state_dict in state_dicts])
+                bias = torch.stack([state_dict["encoder.{}.bias".format(name)] for state_dict in state_dicts])
+                layers.append((weight.to(dtype=torch.float32, device=self.DEVICE), bias.to(dtype=torch.float32, device=self.DEVICE)))
+            elif isinstance(module, torch.nn.ReLU):
+                layers.append(None)
+            else:
+                return None
+        return layers
+
+    def _stacked_encode(self, layers, x):
+        # x: (models, batch, dim), every layer of every model in one batched matmul
+        for layer in layers:
+            if layer is None:
+                x = torch.relu(x)
+            else:
+                weight, bias = layer
+                x = torch.baddbmm(bias.unsqueeze(1), x, weight.transpose(1, 2))
+        return x
+
+    def _project_all(self, paths, epochs, data_source, out=None, save_path=None, stack_size=8):
+        """
+        project the samples of every epoch with the model saved in paths, see project_all_epochs
+        :param paths: list of str, .pth file of every epoch
+        """
+        # every model of the run stays resident during the pass
+        state_dicts = dict()
+        for path in paths:
+            if path not in state_dicts:
+                state_dicts[path] = self._state_dict(path)[1]
+        stackable = len(paths) > 0 and self._stacked_layers([state_dicts[paths[0]]]) is not None
+        epoch_num = len(epochs)
+        # readers trust an existing save_path, so it only appears once complete
+        tmp_path = None if save_path is None else save_path + ".tmp"
+        with torch.inference_mode():
+            for start in range(0, epoch_num, stack_size):
+                cols = list(range(start, min(start+stack_size, epoch_num)))
+                data = [data_source(epochs[t]) for t in cols]
+                if out is None:
+                    shape = (len(data[0]), epoch_num, 2)
+                    out = np.zeros(shape, dtype=np.float32) if save_path is None else np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=shape)
+                if not stackable:
+                    for t, d in zip(cols, data):
+                        self._load_state(paths[t])
+                        out[:, t] = self._infer(self.vis_model.encoder, d)
+                    # the models were loaded behind load()
+                    self._reset_range()
+                    continue
+                layers = self._stacked_layers([state_dicts[paths[t]] for t in cols])
+                rows = max(self.batch_size // len(cols), 1)
+                for row in range(0, len(data[0]), rows):
+                    x = torch.from_numpy(np.stack([d[row:row+rows] for d in data])).to(dtype=torch.float32, device=self.DEVICE)
+                    out[row:row+rows, start:start+len(cols)] = self._stacked_encode(layers, x).transpose(0, 1).cpu().numpy()
+        if save_path is not None:
+            if isinstance(out, np.memmap) and out.filename == os.path.abspath(tmp_path):
+                out.flush()
+            else:
+                _save_npy(tmp_path, out)
+            os.replace(tmp_path, save_path)
+        return out
+
+    def _reset_range(self):
+        """forget which range load() put in vis_model, for subclasses that skip reloading by range"""
+        pass
+
+    def project_all_epochs(self, epochs, data_source, out=None, save_path=None, stack_size=8):
+        """
+        project the samples of every epoch in one pass, e.g. the trajectories of all training samples
+        the models of all epochs (e.g. the segments of DeepDebugger) are loaded once, and up to stack_size epochs are
+        encoded together with the weights of their models stacked
+        :param epochs: list of int
+        :param data_source: function, epoch -> ndarray (N, dim), e.g. data_provider.train_representation
+        :param out: ndarray (N, len(epochs), 2), optional, preallocated result
+        :param save_path: str, optional, .npy file of the embedding cube, filled in place (memory-mapped) unless out is given
+        :param stack_size: int, number of epochs encoded together
+        :return: ndarray, (N, len(epochs), 2), float32
+        """
+        paths = [self._state_path(epoch) for epoch in epochs]
+        return self._project_all(paths, epochs, data_source, out, save_path, stack_size)
+
     def batch_project(self, iteration, data):
         self.load(iteration)
-        embedding = self.vis_model.encoder(torch.from_numpy(data).to(dtype=torch.float32, device=self.DEVICE)).cpu().detach().numpy()
-        return embedding
-    
+        return self._embed(data)
+
     def individual_project(self, iteration, data):
         self.load(iteration)
-        embedding = self.vis_model.encoder(torch.from_numpy(np.expand_dims(data, axis=0)).to(dtype=torch.float32, device=self.DEVICE)).cpu().detach().numpy()
+        embedding = self._infer(self.vis_model.encoder, np.expand_dims(data, axis=0))
         return embedding.squeeze(axis=0)
-    
+
     def batch_inverse(self, iteration, embedding):
         self.load(iteration)
-        data = self.vis_model.decoder(torch.from_numpy(embedding).to(dtype=torch.float32, device=self.DEVICE)).cpu().detach().numpy()
-        return data
-    
+        return self._infer(self.vis_model.decoder, embedding)
+
     def individual_inverse(self, iteration, embedding):
         self.load(iteration)
-        data = self.vis_model.decoder(torch.from_numpy(np.expand_dims(embedding, axis=0)).to(dtype=torch.float32, device="cpu")).cpu().detach().numpy()
+        data = self._infer(self.vis_model.decoder, np.expand_dims(embedding, axis=0))
         return data.squeeze(axis=0)
-    
+
 class DeepDebuggerProjector(Projector):
-    def __init__(self, vis_model, content_path, vis_model_name, segments, device):
-        super().__init__(vis_model, content_path, vis_model_name, device)
+    def __init__(self, vis_model, content_path, vis_model_name, segments, device, **kwargs):
+        super().__init__(vis_model, content_path, vis_model_name, device, **kwargs)
         self.segments = segments
         self.segments = segments    #[(1,6),(6, 15),(15,42),(42,200)]
         self.current_range = (-1,-1)
 
-    def load(self, iteration):
-        # [s,e)
+    def _reset_range(self):
+        self.current_range = (-1,-1)
+
+    def _segment(self, iteration):
         init_e = self.segments[-1][1]
-        if (iteration >= self.current_range[0] and iteration <self.current_range[1]) or (iteration == init_e and self.current_range[1] == init_e):
-            print("Same range as current visualization model...")
-            return 
-        # else
         for i in range(len(self.segments)):
             s = self.segments[i][0]
             e = self.segments[i][1]
             # range [s,e)
             if (iteration >= s and iteration < e) or (iteration == init_e and e == init_e):
-                idx = i
-                break
+                return i, s, e
+
+    def _state_path(self, iteration):
+        idx, _, _ = self._segment(iteration)
         # TODO vis model name as a hyperparameter
-        file_path = os.path.join(self.content_path, "Model", "{}_{}.pth".format(self.vis_model_name, idx))
-        save_model = torch.load(file_path, map_location="cpu")
-        self.vis_model.load_state_dict(save_model["state_dict"])
-        self.vis_model.to(self.DEVICE)
-        self.vis_model.eval()
+        return os.path.join(self.content_path, "Model", "{}_{}.pth".format(self.vis_model_name, idx))
+
+    def load(self, iteration):
+        # [s,e)
+        init_e = self.segments[-1][1]
+        if (iteration >= self.current_range[0] and iteration <self.current_range[1]) or (iteration == init_e and self.current_range[1] == init_e):
+            print("Same range as current visualization model...")
+            return
+        # else
+        _, s, e = self._segment(iteration)
+        self._load_state(self._state_path(iteration))
         self.current_range = (s, e)
         print("Successfully load the visualization model for range ({},{})...".format(s,e))
 
 
 class ALProjector(Projector):
-    def __init__(self, vis_model, content_path, vis_model_name, device) -> None:
-        super().__init__(vis_model, content_path,vis_model_name, device)
+    def __init__(self, vis_model, content_path, vis_model_name, device, **kwargs) -> None:
+        super().__init__(vis_model, content_path,vis_model_name, device, **kwargs)
         self.current_range = None
 
-    def load(self, iteration):
-        file_path=os.path.join(self.content_path, "Model", "Iteration_{}".format(iteration), self.vis_model_name+".pth")
+    def _state_path(self, iteration):
+        return os.path.join(self.content_path, "Model", "Iteration_{}".format(iteration), self.vis_model_name+".pth")
 
-        save_model = torch.load(file_path, map_location=torch.device("cpu"))
-        self.vis_model.load_state_dict(save_model["state_dict"])
-        self.vis_model.to(self.DEVICE)
-        self.vis_model.eval()
-        print("Successfully load the visualization model for Iteration {}...".format(iteration))
+    def load(self, iteration):
+        if self._load_state(self._state_path(iteration)):
+            print("Successfully load the visualization model for Iteration {}...".format(iteration))
 
 
 class DenseALProjector(DeepDebuggerProjector):
-    def __init__(self, vis_model, content_path, vis_model_name, device) -> None:
-        super().__init__(vis_model, content_path, vis_model_name, None, device)
+    def __init__(self, vis_model, content_path, vis_model_name, device, **kwargs) -> None:
+        super().__init__(vis_model, content_path, vis_model_name, None, device, **kwargs)
         self.current_range = [-1,-1,-1] # iteration, e_s, e_e
 
-    def load(self, iteration, epoch):
-        # [s,e)
-        curr_iteration, curr_s, curr_e = self.current_range
+    def _reset_range(self):
+        self.current_range = [-1,-1,-1]
+
+    def _dense_segment(self, iteration, epoch):
         segment_path = os.path.join(self.content_path, "Model", "Iteration_{}".format(iteration), "segments.json")
         with open(segment_path, "r") as f:
             segments = json.load(f)
         init_e = segments[-1][1]
-        # [s,e)
-        if iteration == curr_iteration:
-            if (curr_e==init_e and epoch == curr_e) or (epoch >= curr_s and epoch < curr_e):
-                print("Same range as current visualization model...")
-                return
-        
         for i in range(len(segments)):
             s = segments[i][0]
             e = segments[i][1]
             # range [s, e)
             if (epoch >= s and epoch < e) or (e == init_e and epoch == e):
-                idx = i
-                break
-        file_path = os.path.join(self.content_path, "Model", "Iteration_{}".format(iteration), "{}_{}.pth".format(self.vis_model_name, idx))
-        save_model = torch.load(file_path, map_location=self.DEVICE)
-        self.vis_model.load_state_dict(save_model["state_dict"])
-        self.vis_model.to(self.DEVICE)
-        self.vis_model.eval()
+                return i, s, e, init_e
+
+    def _state_path(self, iteration, epoch):
+        idx, _, _, _ = self._dense_segment(iteration, epoch)
+        return os.path.join(self.content_path, "Model", "Iteration_{}".format(iteration), "{}_{}.pth".format(self.vis_model_name, idx))
+
+    def load(self, iteration, epoch):
+        # [s,e)
+        curr_iteration, curr_s, curr_e = self.current_range
+        _, s, e, init_e = self._dense_segment(iteration, epoch)
+        # [s,e)
+        if iteration == curr_iteration:
+            if (curr_e==init_e and epoch == curr_e) or (epoch >= curr_s and epoch < curr_e):
+                print("Same range as current visualization model...")
+                return
+
+        self._load_state(self._state_path(iteration, epoch))
         self.current_range = (iteration, s, e)
         print("Successfully load the visualization model in iteration {} for range ({},{}]...".format(iteration, s,e))
-    
+
     def batch_project(self, iteration, epoch, data):
         self.load(iteration, epoch)
-        embedding = self.vis_model.encoder(torch.from_numpy(data).to(dtype=torch.float32, device=self.DEVICE)).cpu().detach().numpy()
-        return embedding
-    
+        return self._embed(data)
+
+    def project_all_epochs(self, iteration, epochs, data_source, out=None, save_path=None, stack_size=8):
+        """project the samples of every epoch of iteration in one pass, see Projector.project_all_epochs"""
+        paths = [self._state_path(iteration, epoch) for epoch in epochs]
+        return self._project_all(paths, epochs, data_source, out, save_path, stack_size)
+
     def individual_project(self, iteration, epoch, data):
         self.load(iteration, epoch)
-        embedding = self.vis_model.encoder(torch.from_numpy(np.expand_dims(data, axis=0)).to(dtype=torch.float32, device=self.DEVICE)).cpu().detach().numpy()
+        embedding = self._infer(self.vis_model.encoder, np.expand_dims(data, axis=0))
         return embedding.squeeze(axis=0)
-    
+
     def batch_inverse(self, iteration, epoch, embedding):
         self.load(iteration, epoch)
-        data = self.vis_model.decoder(torch.from_numpy(embedding).to(dtype=torch.float32, device=self.DEVICE)).cpu().detach().numpy()
-        return data
-    
+        return self._infer(self.vis_model.decoder, embedding)
+
     def individual_inverse(self, iteration, epoch, embedding):
         self.load(iteration, epoch)
-        data = self.vis_model.decoder(torch.from_numpy(np.expand_dims(embedding, axis=0)).to(dtype=torch.float32, device=self.DEVICE)).cpu().detach().numpy()
+        data = self._infer(self.vis_model.decoder, np.expand_dims(embedding, axis=0))
         return data.squeeze(axis=0)
 
 
 class EvalProjector(DeepDebuggerProjector):
-    def __init__(self, vis_model, content_path, vis_model_name, device, exp) -> None:
-        super().__init__(vis_model, content_path, vis_model_name, None, device)
+    def __init__(self, vis_model, content_path, vis_model_name, device, exp, **kwargs) -> None:
+        super().__init__(vis_model, content_path, vis_model_name, None, device, **kwargs)
         self.exp = exp
         file_path = os.path.join(content_path, "Model", "{}".format(exp), "segments.json")
         with open(file_path, "r") as f:
             self.segments = json.load(f)
-    
+
+    def _segment(self, iteration):
+        init_s = self.segments[0][0]
+        for i in range(len(self.segments)):
+            s = self.segments[i][0]
+            e = self.segments[i][1]
+            # range (s,e]
+            if (iteration > s and iteration <= e) or (iteration == init_s and s == init_s):
+                return i, s, e
+
+    def _state_path(self, iteration):
+        idx, _, _ = self._segment(iteration)
+        return os.path.join(self.content_path, "Model", "{}".format(self.exp), "tnn_hybrid_{}.pth".format(idx))
+
     def load(self, iteration):
         # (s, e]
         # (s,e]
         init_s = self.segments[0][0]
         if (iteration > self.current_range[0] and iteration <=self.current_range[1]) or (iteration == init_s and self.current_range[0] == init_s):
             print("Same range as current visualization model...")
-            return 
+            return
         # else
-        for i in range(len(self.segments)):
-            s = self.segments[i][0]
-            e = self.segments[i][1]
-            # range (s,e]
-            if (iteration > s and iteration <= e) or (iteration == init_s and s == init_s):
-                idx = i
-                break
-        file_path = os.path.join(self.content_path, "Model", "{}".format(self.exp), "tnn_hybrid_{}.pth".format(idx))
-        save_model = torch.load(file_path, map_location="cpu")
-        self.vis_model.load_state_dict(save_model["state_dict"])
-        self.vis_model.to(self.DEVICE)
-        self.vis_model.eval()
+        _, s, e = self._segment(iteration)
+        self._load_state(self._state_path(iteration))
         self.current_range = (s, e)
         print("Successfully load the visualization model for range ({},{})...".format(s,e))
-        
+
 
 class DVIProjector(Projector):
-    def __init__(self, vis_model, content_path, vis_model_name, device) -> None:
-        super().__init__(vis_model, content_path, vis_model_name, device)
+    def __init__(self, vis_model, content_path, vis_model_name, device, **kwargs) -> None:
+        super().__init__(vis_model, content_path, vis_model_name, device, **kwargs)
+
+    def _state_path(self, iteration):
+        return os.path.join(self.content_path, "Model", "Epoch_{}".format(iteration), "{}.pth".format(self.vis_model_name))
 
     def load(self, iteration):
-        file_path = os.path.join(self.content_path, "Model", "Epoch_{}".format(iteration), "{}.pth".format(self.vis_model_name))
-        save_model = torch.load(file_path, map_location="cpu")
-        self.vis_model.load_state_dict(save_model["state_dict"])
-        self.vis_model.to(self.DEVICE)
-        self.vis_model.eval()
-        print("Successfully load the DVI visualization model for iteration {}".format(iteration))
+        if self._load_state(self._state_path(iteration)):
+            print("Successfully load the DVI visualization model for iteration {}".format(iteration))
 
 
 class TimeVisProjector(Projector):
-    def __init__(self, vis_model, content_path, vis_model_name, device, verbose=0) -> None:
-        super().__init__(vis_model, content_path, vis_model_name, device)
+    def __init__(self, vis_model, content_path, vis_model_name, device, verbose=0, **kwargs) -> None:
+        super().__init__(vis_model, content_path, vis_model_name, device, **kwargs)
         self.verbose = verbose
 
+    def _state_path(self, iteration):
+        # one model for all epochs
+        return os.path.join(self.content_path, "Model", "{}.pth".format(self.vis_model_name))
+
     def load(self, iteration):
-        file_path = os.path.join(self.content_path, "Model", "{}.pth".format(self.vis_model_name))
-        save_model = torch.load(file_path, map_location="cpu")
-        self.vis_model.load_state_dict(save_model["state_dict"])
-        self.vis_model.to(self.DEVICE)
-        self.vis_model.eval()
-        if self.verbose>0:
+        if self._load_state(self._state_path(iteration)) and self.verbose>0:
             print("Successfully load the TimeVis visualization model for iteration {}".format(iteration))
 
 
 class TimeVisDenseALProjector(Projector):
-    def __init__(self, vis_model, content_path, vis_model_name, device, verbose=0) -> None:
-        super().__init__(vis_model, content_path, vis_model_name, device)
+    def __init__(self, vis_model, content_path, vis_model_name, device, verbose=0, **kwargs) -> None:
+        super().__init__(vis_model, content_path, vis_model_name, device, **kwargs)
         self.verbose = verbose
         self.curr_iteration = -1
 
+    def _reset_range(self):
+        self.curr_iteration = -1
+
+    def _state_path(self, iteration, epoch):
+        return os.path.join(self.content_path, "Model", f'Iteration_{iteration}', "{}.pth".format(self.vis_model_name))
+
     def load(self, iteration, epoch):
         if iteration == self.curr_iteration:
             return
-        file_path = os.path.join(self.content_path, "Model", f'Iteration_{iteration}', "{}.pth".format(self.vis_model_name))
-        save_model = torch.load(file_path, map_location="cpu")
-        self.vis_model.load_state_dict(save_model["state_dict"])
-        self.vis_model.to(self.DEVICE)
-        self.vis_model.eval()
+        self._load_state(self._state_path(iteration, epoch))
         if self.verbose>0:
             print("Successfully load the TimeVis visualization model for iteration {}".format(iteration))
         self.curr_iteration = iteration
-        
-    
+
+
     def batch_project(self, iteration, epoch, data):
         self.load(iteration, epoch)
-        embedding = self.vis_model.encoder(torch.from_numpy(data).to(dtype=torch.float32, device=self.DEVICE)).cpu().detach().numpy()
-        return embedding
-    
+        return self._embed(data)
+
+    def project_all_epochs(self, iteration, epochs, data_source, out=None, save_path=None, stack_size=8):
+        """project the samples of every epoch of iteration in one pass, see Projector.project_all_epochs"""
+        paths = [self._state_path(iteration, epoch) for epoch in epochs]
+        return self._project_all(paths, epochs, data_source, out, save_path, stack_size)
+
     def individual_project(self, iteration, epoch, data):
         self.load(iteration, epoch)
-        embedding = self.vis_model.encoder(torch.from_numpy(np.expand_dims(data, axis=0)).to(dtype=torch.float32, device=self.DEVICE)).cpu().detach().numpy()
+        embedding = self._infer(self.vis_model.encoder, np.expand_dims(data, axis=0))
         return embedding.squeeze(axis=0)
-    
+
     def batch_inverse(self, iteration, epoch, embedding):
         self.load(iteration, epoch)
-        data = self.vis_model.decoder(torch.from_numpy(embedding).to(dtype=torch.float32, device=self.DEVICE)).cpu().detach().numpy()
-        return data
-    
+        return self._infer(self.vis_model.decoder, embedding)
+
     def individual_inverse(self, iteration, epoch, embedding):
         self.load(iteration, epoch)
-        data = self.vis_model.decoder(torch.from_numpy(np.expand_dims(embedding, axis=0)).to(dtype=torch.float32, device=self.DEVICE)).cpu().detach().numpy()
+        data = self._infer(self.vis_model.decoder, np.expand_dims(embedding, axis=0))
         return data.squeeze(axis=0)
 
 
 import tensorflow as tf
+def _project_epochs(project, epochs, data_source, out=None, save_path=None):
+    """per epoch fallback of Projector.project_all_epochs, project: function, (epoch, data) -> embedding"""
+    for t, epoch in enumerate(epochs):
+        embedding = project(epoch, data_source(epoch))
+        if out is None:
+            out = np.zeros((len(embedding), len(epochs), 2), dtype=np.float32)
+        out[:, t] = embedding
+    if save_path is not None:
+        _save_npy(save_path + ".tmp", out)
+        os.replace(save_path + ".tmp", save_path)
+    return out
+
+
+def _save_npy(path, array):
+    # np.save appends .npy to other file names
+    with open(path, "wb") as f:
+        np.save(f, array)
+
+
 class tfDVIProjector(ProjectorAbstractClass):
     def __init__(self, content_path, flag, verbose=0):
         self.content_path = content_path
@@ -298,6 +507,10 @@ class tfDVIProjector(ProjectorAbstractClass):
         embedding = self.encoder(data).cpu().numpy()
         return embedding
 
+    def project_all_epochs(self, epochs, data_source, out=None, save_path=None):
+        """project the samples of every epoch, see Projector.project_all_epochs"""
+        return _project_epochs(self.batch_project, epochs, data_source, out, save_path)
+
     def individual_project(self, epoch, data):
         '''
         project a data to 2D space
@@ -372,6 +585,10 @@ class tfDVIDenseALProjector(ProjectorAbstractClass):
         embedding = self.encoder(data).cpu().numpy()
         return embedding
 
+    def project_all_epochs(self, iteration, epochs, data_source, out=None, save_path=None):
+        """project the samples of every epoch of iteration, see Projector.project_all_epochs"""
+        return _project_epochs(lambda epoch, data: self.batch_project(iteration, epoch, data), epochs, data_source, out, save_path)
+
     def individual_project(self, iteration, epoch, data):
         '''
         project a data to 2D space
@@ -0,0 +1,182 @@
+"""The RepresentationStore serves the saved representations of checkpoints to DataProvider without re-reading them from disk"""
+import os
+import json
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+
+
+class RepresentationStore:
+    '''Keep .npy files memory-mapped, cache the parsed index files and keep the hot gathered arrays in RAM.
+
+    Every entry is keyed by the modification time of its files,
+    so re-running preprocessing never serves stale data.
+    Arrays returned by get are shared between callers and read-only, copy them before modifying.
+    '''
+    def __init__(self, capacity=8):
+        """
+        Parameters
+        ----------
+        capacity : int
+            the number of gathered arrays to keep in RAM, by default 8
+        """
+        self.capacity = capacity
+        self._arrays = dict()
+        self._indices = dict()
+        self._hot = OrderedDict()
+
+    def array(self, path):
+        """
+        memory-mapped (read-only) view of a .npy file
+        :param path: str, location of the .npy file
+        :return: numpy.memmap
+        """
+        mtime = os.stat(path).st_mtime_ns
+        cached = self._arrays.get(path)
+        if cached is None or cached[0] != mtime:
+            cached = (mtime, np.load(path, mmap_mode="r"))
+            self._arrays[path] = cached
+        return cached[1]
+
+    def index(self, path):
+        """
+        parsed index file, e.g. index.json or test_index.json
+        :param path: str, location of the .json file
+        :return: numpy.ndarray of int
+        """
+        mtime = os.stat(path).st_mtime_ns
+        cached = self._indices.get(path)
+        if cached is None or cached[0] != mtime:
+            with open(path, "r") as f:
+                index = np.array(json.load(f), dtype=np.int64)
+            cached = (mtime, index)
+            self._indices[path] = cached
+        return cached[1]
+
+    def get(self, path, index_path=None, complement=False):
+        """
+        rows of a .npy file selected by an index file, served from the LRU when possible
+        :param path: str, location of the .npy file
+        :param index_path: str, location of the index file, None to get all rows
+        :param complement: bool, get the rows not in the index file instead
+        :return: numpy.ndarray
+        """
+        key = (path, os.stat(path).st_mtime_ns, index_path, complement)
+        if index_path is not None:
+            key = key + (os.stat(index_path).st_mtime_ns,)
+        if key in self._hot:
+            self._hot.move_to_end(key)
+            return self._hot[key]
+
+        data = self.array(path)
+        if index_path is None:
+            data = np.array(data)
+        elif complement:
+            # !Noted that tot need to be the first arguement
+            data = data[np.setdiff1d(np.arange(len(data)), self.index(index_path))]
+        else:
+            data = data[self.index(index_path)]
+
+        # shared by every caller, an in-place write would corrupt later reads
+        data.setflags(write=False)
+        self._hot[key] = data
+        while len(self._hot) > self.capacity:
+            self._hot.popitem(last=False)
+        return data
+
+    @property
+    def nbytes(self):
+        """bytes held by the gathered arrays in RAM, the memory-mapped files are not counted"""
+        return sum(data.nbytes for data in self._hot.values())
+
+    def clear(self):
+        self._arrays.clear()
+        self._indices.clear()
+        self._hot.clear()
+
+    def consolidate(self, path, epochs, sources, load, rebuild=False):
+        """
+        write the representations of all epochs once into one contiguous (epochs, samples, dim) .npy file
+        :param path: str, location of the consolidated .npy file
+        :param epochs: list of int, the epochs to stack in order
+        :param sources: list of str, the files the epochs are read from, path is rebuilt if any of them is newer
+        :param load: function, epoch -> numpy.ndarray of shape (samples, dim)
+        :param rebuild: bool, rewrite path even if it is up to date
+        :return: RepresentationTensor
+        """
+        epochs = [int(e) for e in epochs]
+        meta_path = os.path.splitext(path)[0] + ".json"
+        if not rebuild and os.path.exists(path) and os.path.exists(meta_path):
+            with open(meta_path, "r") as f:
+                meta = json.load(f)
+            mtime = os.stat(path).st_mtime_ns
+            if meta["epochs"] == epochs and all(os.stat(source).st_mtime_ns <= mtime for source in sources):
+                return RepresentationTensor(path, epochs)
+
+        first = np.asarray(load(epochs[0]))
+        # unique, other processes may rebuild the same file at the same time
+        tmp_path = "{}.{}.tmp".format(path, uuid.uuid4().hex)
+        out = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=first.dtype, shape=(len(epochs),) + first.shape)
+        out[0] = first
+        del first
+        for i in range(1, len(epochs)):
+            out[i] = load(epochs[i])
+        out.flush()
+        del out
+        os.replace(tmp_path, path)
+        tmp_meta_path = "{}.{}.tmp".format(meta_path, uuid.uuid4().hex)
+        with open(tmp_meta_path, "w") as f:
+            json.dump({"epochs": epochs}, f)
+        os.replace(tmp_meta_path, meta_path)
+        return RepresentationTensor(path, epochs)
+
+
+class RepresentationTensor:
+    '''Read-only (epochs, samples, dim) view over a consolidated .npy file.
+
+    epoch, trajectory with an int or a slice and epoch_range with a period that is a multiple of the saved one
+    return views without copying; trajectory with a list of samples and epoch_range with any other period copy.
+    '''
+    def __init__(self, path, epochs):
+        """
+        Parameters
+        ----------
+        path : str
+            location of the consolidated .npy file
+        epochs : list
+            the epoch of each slice along the first axis, increasing
+        """
+        self.path = path
+        self.epochs = list(epochs)
+        self._pos = {e: i for i, e in enumerate(self.epochs)}
+        self.data = np.load(path, mmap_mode="r")
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    def epoch(self, epoch):
+        """representations of all samples at epoch, (samples, dim)"""
+        return self.data[self._pos[epoch]]
+
+    def trajectory(self, idxs):
+        """
+        representations of samples idxs through all epochs, (epochs, dim) for an int or (epochs, len(idxs), dim) otherwise
+        a view for an int or a slice, a copy for a list or an array of samples
+        """
+        return self.data[:, idxs]
+
+    def epoch_range(self, start, end, period=None):
+        """
+        representations from epoch start to epoch end (both included), (epochs, samples, dim)
+        a copy is only made if period is not a multiple of the saved epoch period
+        """
+        lo = self._pos[start]
+        hi = self._pos[end]
+        if period is None or len(self.epochs) < 2:
+            return self.data[lo:hi + 1]
+        step, remain = divmod(period, self.epochs[1] - self.epochs[0])
+        if remain == 0:
+            return self.data[lo:hi + 1:step]
+        return self.data[[self._pos[e] for e in range(start, end + 1, period)]]
@@ -2,16 +2,14 @@ import numpy as np
 import json
 import os
 from pynndescent import NNDescent
+from singleVis.knn_graph import nndescent_params
 
 # helper function
 def hausdorff_d(curr_data, prev_data):
-    # number of trees in random projection forest
-    n_trees = min(64, 5 + int(round((curr_data.shape[0]) ** 0.5 / 20.0)))
-    # max number of nearest neighbor iters to perform
-    n_iters = max(5, int(round(np.log2(curr_data.shape[0]))))
     # distance metric
     metric = "euclidean"
-    # get nearest neighbors
+    n_trees, n_iters = nndescent_params(curr_data.shape[0])
+    # get nearest neighbors, the index is queried once, so it is not cached
     nnd = NNDescent(
         curr_data,
         n_neighbors=1,
@@ -7,7 +7,6 @@ import math
 import json
 
 from umap.umap_ import fuzzy_simplicial_set, make_epochs_per_sample
-from pynndescent import NNDescent
 from sklearn.neighbors import NearestNeighbors
 from sklearn.utils import check_random_state
 
@@ -15,6 +14,7 @@ from singleVis.kcenter_greedy import kCenterGreedy
 from singleVis.intrinsic_dim import IntrinsicDim
 from singleVis.backend import get_graph_elements, get_attention
 from singleVis.utils import find_neighbor_preserving_rate
+from singleVis.knn_graph import neighbor_graph, map_init_graph
 
 class SpatialEdgeConstructorAbstractClass(ABC):
     @abstractmethod
@@ -56,28 +56,26 @@ class SpatialEdgeConstructor(SpatialEdgeConstructorAbstractClass):
         self.s_n_epochs = s_n_epochs
         self.b_n_epochs = b_n_epochs
         self.n_neighbors = n_neighbors
+        # warm start the knn graph of each time step from the one of the previous time step
+        self.warm_start = True
+        self._prev_graph = None
     
-    def _construct_fuzzy_complex(self, train_data):
+    def _construct_fuzzy_complex(self, train_data, save_dir=None, sample_idxs=None):
         """
         construct a vietoris-rips complex
+        :param save_dir: str, checkpoint directory to persist the knn graph in, by default None
+        :param sample_idxs: ndarray, sample ids of train_data, e.g. the selected idxs,
+            if given (here and in the previous call) and warm_start is set, NNDescent starts from the previous graph mapped through the ids
         """
-        # number of trees in random projection forest
-        n_trees = min(64, 5 + int(round((train_data.shape[0]) ** 0.5 / 20.0)))
-        # max number of nearest neighbor iters to perform
-        n_iters = max(5, int(round(np.log2(train_data.shape[0]))))
         # distance metric
         metric = "euclidean"
+        init_graph = None
+        if self.warm_start and sample_idxs is not None and self._prev_graph is not None:
+            prev_idxs, prev_indices = self._prev_graph
+            init_graph = map_init_graph(prev_indices, prev_idxs, sample_idxs, self.n_neighbors)
         # get nearest neighbors
-        nnd = NNDescent(
-            train_data,
-            n_neighbors=self.n_neighbors,
-            metric=metric,
-            n_trees=n_trees,
-            n_iters=n_iters,
-            max_candidates=60,
-            verbose=True
-        )
-        knn_indices, knn_dists = nnd.neighbor_graph
+        knn_indices, knn_dists = neighbor_graph(train_data, self.n_neighbors, metric=metric, save_dir=save_dir, verbose=True, init_graph=init_graph)
+        self._prev_graph = None if sample_idxs is None else (np.asarray(sample_idxs), knn_indices)
         random_state = check_random_state(None)
         complex, sigmas, rhos = fuzzy_simplicial_set(
             X=train_data,
@@ -134,6 +132,78 @@ class SpatialEdgeConstructor(SpatialEdgeConstructorAbstractClass):
         return head, tail, weight
     
 
+    def _allocate(self, name, shape, dtype, buffers=None):
+        """allocate the output array name, see _assemble_complex for buffers"""
+        if buffers is None:
+            return np.empty(shape, dtype=dtype)
+        if isinstance(buffers, str):
+            return np.lib.format.open_memmap(os.path.join(buffers, name + ".npy"), mode="w+", dtype=dtype, shape=shape)
+        if name not in buffers:
+            return np.empty(shape, dtype=dtype)
+        buffer = buffers[name]
+        if len(buffer) < shape[0] or buffer.shape[1:] != shape[1:]:
+            raise ValueError("buffer {} of shape {} cannot hold an array of shape {}".format(name, buffer.shape, shape))
+        return buffer[:shape[0]]
+
+    def _assemble_complex(self, pieces, buffers=None):
+        """
+        assemble the per time step pieces of the spatio-temporal complex,
+        each time step is shifted by the number of vertices before it in one pass so that every output is allocated and copied once
+        indices are stored as int32 (int64 only if the complex has more than 2^31 vertices) and floats as float32
+        :param pieces: list of dict, one per time step in temporal order, each with the same keys
+            (edge_to, edge_from, weight, feature_vectors, attention, sigmas, rhos, knn_indices)
+            a value that is not an array (e.g. a constant attention or None) must be the same for all time steps and is passed through
+        :param buffers: None to allocate new arrays,
+            dict of preallocated arrays by name, at least as long as the outputs,
+            or str, a directory to write the outputs into as memory-mapped .npy files
+        :return: dict of assembled arrays and the vertex offset of each time step
+        """
+        shifted = ("edge_to", "edge_from", "knn_indices")
+        vertex_nums = [len(piece["feature_vectors"]) for piece in pieces]
+        offsets = np.concatenate(([0], np.cumsum(vertex_nums)[:-1])).astype(np.int64)
+        index_dtype = np.int32 if sum(vertex_nums) <= np.iinfo(np.int32).max else np.int64
+
+        assembled = dict()
+        for name in pieces[0].keys():
+            parts = [piece[name] for piece in pieces]
+            if not isinstance(parts[0], np.ndarray):
+                assembled[name] = parts[0]
+                continue
+            if name in shifted:
+                dtype = index_dtype
+            else:
+                dtype = np.result_type(*set(part.dtype for part in parts))
+                if np.issubdtype(dtype, np.floating):
+                    dtype = np.float32
+            total = sum(len(part) for part in parts)
+            out = self._allocate(name, (total,) + parts[0].shape[1:], dtype, buffers)
+            start = 0
+            for offset, part in zip(offsets, parts):
+                end = start + len(part)
+                if name in shifted:
+                    np.add(part, offset, out=out[start:end], casting="unsafe")
+                else:
+                    out[start:end] = part
+                start = end
+            assembled[name] = out
+        return assembled, offsets
+
+    def replay_embeddings(self, time_step_nums, buffers=None):
+        """embedded positions of init_embeddings and the coefficient marking them, (vertex_num, 2) and (vertex_num,)
+        init_embeddings (of the hybrid constructors) belong to the last time step of the complex described by time_step_nums
+        """
+        init_embeddings = getattr(self, "init_embeddings", None)
+        vertex_num = sum(t_num + b_num for t_num, b_num in time_step_nums)
+        offset = vertex_num - sum(time_step_nums[-1])
+        coefficient = self._allocate("coefficient", (vertex_num,), np.float32, buffers)
+        embedded = self._allocate("embedded", (vertex_num, 2), np.float32, buffers)
+        coefficient[:] = 0
+        embedded[:] = 0
+        if init_embeddings is not None:
+            coefficient[offset:offset+len(init_embeddings)] = 1
+            embedded[offset:offset+len(init_embeddings)] = init_embeddings
+        return embedded, coefficient
+
     def construct(self):
         return NotImplemented
     
@@ -160,17 +230,9 @@ class RandomSpatialEdgeConstructor(SpatialEdgeConstructor):
     def __init__(self, data_provider, init_num, s_n_epochs, b_n_epochs, n_neighbors) -> None:
         super().__init__(data_provider, init_num, s_n_epochs, b_n_epochs, n_neighbors)
     
-    def construct(self):
-        # dummy input
-        edge_to = None
-        edge_from = None
-        sigmas = None
-        rhos = None
-        weight = None
-        probs = None
-        feature_vectors = None
-        attention = None
-        knn_indices = None
+    def construct(self, buffers=None):
+        # per time step pieces, assembled once at the end
+        pieces = list()
         time_step_nums = list()
         time_step_idxs_list = list()
 
@@ -184,6 +246,7 @@ class RandomSpatialEdgeConstructor(SpatialEdgeConstructor):
             train_data = self.data_provider.train_representation(t).squeeze()
 
             train_data = train_data[selected_idxs]
+            sample_idxs = selected_idxs
             time_step_idxs_list.append(selected_idxs_t.tolist())
 
             selected_idxs_t = np.random.choice(list(range(len(selected_idxs))), int(0.9*len(selected_idxs)), replace=False)
@@ -192,7 +255,7 @@ class RandomSpatialEdgeConstructor(SpatialEdgeConstructor):
             if self.b_n_epochs != 0:
                 border_centers = self.data_provider.border_representation(t).squeeze()
                 border_centers = border_centers
-                complex, sigmas_t1, rhos_t1, knn_idxs_t = self._construct_fuzzy_complex(train_data)
+                complex, sigmas_t1, rhos_t1, knn_idxs_t = self._construct_fuzzy_complex(train_data, save_dir=self.data_provider.checkpoint_path(t), sample_idxs=sample_idxs)
                 bw_complex, sigmas_t2, rhos_t2, _ = self._construct_boundary_wise_complex(train_data, border_centers)
                 edge_to_t, edge_from_t, weight_t = self._construct_step_edge_dataset(complex, bw_complex)
                 sigmas_t = np.concatenate((sigmas_t1, sigmas_t2[len(sigmas_t1):]), axis=0)
@@ -203,7 +266,7 @@ class RandomSpatialEdgeConstructor(SpatialEdgeConstructor):
                 t_num = len(train_data)
                 b_num = len(border_centers)
             else:
-                complex, sigmas_t, rhos_t, knn_idxs_t = self._construct_fuzzy_complex(train_data)
+                complex, sigmas_t, rhos_t, knn_idxs_t = self._construct_fuzzy_complex(train_data, save_dir=self.data_provider.checkpoint_path(t), sample_idxs=sample_idxs)
                 edge_to_t, edge_from_t, weight_t = self._construct_step_edge_dataset(complex, None, self.n_epochs)
                 fitting_data = np.copy(train_data)
                 pred_model = self.data_provider.prediction_function(t)
@@ -211,34 +274,20 @@ class RandomSpatialEdgeConstructor(SpatialEdgeConstructor):
                 t_num = len(train_data)
                 b_num = 0
 
-            if edge_to is None:
-                edge_to = edge_to_t
-                edge_from = edge_from_t
-                weight = weight_t
-                probs = weight_t / weight_t.max()
-                feature_vectors = fitting_data
-                attention = attention_t
-                sigmas = sigmas_t
-                rhos = rhos_t
-                knn_indices = knn_idxs_t
-                time_step_nums.append((t_num, b_num))
-            else:
-                # every round, we need to add len(data) to edge_to(as well as edge_from) index
-                increase_idx = len(feature_vectors)
-                edge_to = np.concatenate((edge_to, edge_to_t + increase_idx), axis=0)
-                edge_from = np.concatenate((edge_from, edge_from_t + increase_idx), axis=0)
-                # normalize weight to be in range (0, 1)
-                weight = np.concatenate((weight, weight_t), axis=0)
-                probs_t = weight_t / weight_t.max()
-                probs = np.concatenate((probs, probs_t), axis=0)
-                sigmas = np.concatenate((sigmas, sigmas_t), axis=0)
-                rhos = np.concatenate((rhos, rhos_t), axis=0)
-                feature_vectors = np.concatenate((feature_vectors, fitting_data), axis=0)
-                attention = np.concatenate((attention, attention_t), axis=0)
-                knn_indices = np.concatenate((knn_indices, knn_idxs_t+increase_idx), axis=0)
-                time_step_nums.append((t_num, b_num))
-
-        return edge_to, edge_from, weight, feature_vectors, time_step_nums, time_step_idxs_list, knn_indices , sigmas, rhos, attention
+            pieces.append({
+                "edge_to": edge_to_t,
+                "edge_from": edge_from_t,
+                "weight": weight_t,
+                "feature_vectors": fitting_data,
+                "attention": attention_t,
+                "sigmas": sigmas_t,
+                "rhos": rhos_t,
+                "knn_indices": knn_idxs_t,
+            })
+            time_step_nums.append((t_num, b_num))
+
+        assembled, _ = self._assemble_complex(pieces, buffers)
+        return assembled["edge_to"], assembled["edge_from"], assembled["weight"], assembled["feature_vectors"], time_step_nums, time_step_idxs_list, assembled["knn_indices"], assembled["sigmas"], assembled["rhos"], assembled["attention"]
     
 
 class kcSpatialEdgeConstructor(SpatialEdgeConstructor):
@@ -267,25 +316,22 @@ class kcSpatialEdgeConstructor(SpatialEdgeConstructor):
         t1 = time.time()
         return c0, d0, "{:.1f}".format(t1-t0)
     
-    def construct(self):
+    def construct(self, buffers=None):
         """construct spatio-temporal complex and get edges
 
+        Parameters
+        ----------
+        buffers : dict or str, optional
+            preallocated arrays by name or a directory for memory-mapped outputs, by default None
+
         Returns
         -------
         _type_
             _description_
         """
 
-        # dummy input
-        edge_to = None
-        edge_from = None
-        sigmas = None
-        rhos = None
-        weight = None
-        probs = None
-        feature_vectors = None
-        attention = None
-        knn_indices = None
+        # per time step pieces, assembled once at the end
+        pieces = list()
         time_step_nums = list()
         time_step_idxs_list = list()
 
@@ -342,7 +388,7 @@ class kcSpatialEdgeConstructor(SpatialEdgeConstructor):
                 t_num = len(selected_idxs)
                 b_num = len(border_centers)
 
-                complex, sigmas_t1, rhos_t1, knn_idxs_t = self._construct_fuzzy_complex(train_data)
+                complex, sigmas_t1, rhos_t1, knn_idxs_t = self._construct_fuzzy_complex(train_data, save_dir=self.data_provider.checkpoint_path(t), sample_idxs=selected_idxs)
                 bw_complex, sigmas_t2, rhos_t2, _ = self._construct_boundary_wise_complex(train_data, border_centers)
                 edge_to_t, edge_from_t, weight_t = self._construct_step_edge_dataset(complex, bw_complex)
                 sigmas_t = np.concatenate((sigmas_t1, sigmas_t2[len(sigmas_t1):]), axis=0)
@@ -350,49 +396,37 @@ class kcSpatialEdgeConstructor(SpatialEdgeConstructor):
                 fitting_data = np.concatenate((train_data, border_centers), axis=0)
                 # pred_model = self.data_provider.prediction_function(t)
                 # attention_t = get_attention(pred_model, fitting_data, temperature=.01, device=self.data_provider.DEVICE, verbose=1)
-                attention_t = np.ones(fitting_data.shape)
+                # constant attention, broadcast in ReconstructionLoss
+                attention_t = 1.0
             else:
                 t_num = len(selected_idxs)
                 b_num = 0
 
-                complex, sigmas_t, rhos_t, knn_idxs_t = self._construct_fuzzy_complex(train_data)
+                complex, sigmas_t, rhos_t, knn_idxs_t = self._construct_fuzzy_complex(train_data, save_dir=self.data_provider.checkpoint_path(t), sample_idxs=selected_idxs)
                 edge_to_t, edge_from_t, weight_t = self._construct_step_edge_dataset(complex, None)
                 fitting_data = np.copy(train_data)
                 # pred_model = self.data_provider.prediction_function(t)
                 # attention_t = get_attention(pred_model, fitting_data, temperature=.01, device=self.data_provider.DEVICE, verbose=1)
-                attention_t = np.ones(fitting_data.shape)
+                # constant attention, broadcast in ReconstructionLoss
+                attention_t = 1.0
 
 
-            if edge_to is None:
-                edge_to = edge_to_t
-                edge_from = edge_from_t
-                weight = weight_t
-                probs = weight_t / weight_t.max()
-                feature_vectors = fitting_data
-                attention = attention_t
-                sigmas = sigmas_t
-                rhos = rhos_t
-                knn_indices = knn_idxs_t
-                # npr = npr_t
-                time_step_nums.insert(0, (t_num, b_num))
-            else:
-                # every round, we need to add len(data) to edge_to(as well as edge_from) index
-                increase_idx = len(fitting_data)
-                edge_to = np.concatenate((edge_to_t, edge_to + increase_idx), axis=0)
-                edge_from = np.concatenate((edge_from_t, edge_from + increase_idx), axis=0)
-                # normalize weight to be in range (0, 1)
-                weight = np.concatenate((weight_t, weight), axis=0)
-                probs_t = weight_t / weight_t.max()
-                probs = np.concatenate((probs_t, probs), axis=0)
-                sigmas = np.concatenate((sigmas_t, sigmas), axis=0)
-                rhos = np.concatenate((rhos_t, rhos), axis=0)
-                feature_vectors = np.concatenate((fitting_data, feature_vectors), axis=0)
-                attention = np.concatenate((attention_t, attention), axis=0)
-                knn_indices = np.concatenate((knn_idxs_t, knn_indices+increase_idx), axis=0)
-                # npr = np.concatenate((npr_t, npr), axis=0)
-                time_step_nums.insert(0, (t_num, b_num))
+            pieces.append({
+                "edge_to": edge_to_t,
+                "edge_from": edge_from_t,
+                "weight": weight_t,
+                "feature_vectors": fitting_data,
+                "attention": attention_t,
+                "sigmas": sigmas_t,
+                "rhos": rhos_t,
+                "knn_indices": knn_idxs_t,
+            })
+            time_step_nums.insert(0, (t_num, b_num))
 
-        return edge_to, edge_from, weight, feature_vectors, time_step_nums, time_step_idxs_list, knn_indices, sigmas, rhos, attention
+        # time steps were visited backwards
+        pieces.reverse()
+        assembled, _ = self._assemble_complex(pieces, buffers)
+        return assembled["edge_to"], assembled["edge_from"], assembled["weight"], assembled["feature_vectors"], time_step_nums, time_step_idxs_list, assembled["knn_indices"], assembled["sigmas"], assembled["rhos"], assembled["attention"]
 
 
 
@@ -488,7 +522,7 @@ class kcParallelSpatialEdgeConstructor(SpatialEdgeConstructor):
                 t_num = len(selected_idxs)
                 b_num = len(border_centers)
 
-                complex, sigmas_t1, rhos_t1, knn_idxs_t = self._construct_fuzzy_complex(train_data)
+                complex, sigmas_t1, rhos_t1, knn_idxs_t = self._construct_fuzzy_complex(train_data, save_dir=self.data_provider.checkpoint_path(t), sample_idxs=selected_idxs)
                 bw_complex, sigmas_t2, rhos_t2, _ = self._construct_boundary_wise_complex(train_data, border_centers)
                 edge_to_t, edge_from_t, weight_t = self._construct_step_edge_dataset(complex, bw_complex)
                 sigmas_t = np.concatenate((sigmas_t1, sigmas_t2[len(sigmas_t1):]), axis=0)
@@ -500,7 +534,7 @@ class kcParallelSpatialEdgeConstructor(SpatialEdgeConstructor):
                 t_num = len(selected_idxs)
                 b_num = 0
 
-                complex, sigmas_t, rhos_t, knn_idxs_t = self._construct_fuzzy_complex(train_data)
+                complex, sigmas_t, rhos_t, knn_idxs_t = self._construct_fuzzy_complex(train_data, save_dir=self.data_provider.checkpoint_path(t), sample_idxs=selected_idxs)
                 edge_to_t, edge_from_t, weight_t = self._construct_step_edge_dataset(complex, None)
                 fitting_data = np.copy(train_data)
                 pred_model = self.data_provider.prediction_function(t)
@@ -551,20 +585,22 @@ class SingleEpochSpatialEdgeConstructor(SpatialEdgeConstructor):
 
         if self.b_n_epochs > 0:
             border_centers = self.data_provider.border_representation(self.iteration).squeeze()
-            complex, _, _, _ = self._construct_fuzzy_complex(train_data)
+            complex, _, _, _ = self._construct_fuzzy_complex(train_data, save_dir=self.data_provider.checkpoint_path(self.iteration))
             bw_complex, _, _, _ = self._construct_boundary_wise_complex(train_data, border_centers)
             edge_to, edge_from, weight = self._construct_step_edge_dataset(complex, bw_complex)
             feature_vectors = np.concatenate((train_data, border_centers), axis=0)
             # pred_model = self.data_provider.prediction_function(self.iteration)
             # attention = get_attention(pred_model, feature_vectors, temperature=.01, device=self.data_provider.DEVICE, verbose=1)
-            attention = np.zeros(feature_vectors.shape)
+            # no attention, i.e. zero everywhere
+            attention = None
         elif self.b_n_epochs == 0:
-            complex, _, _, _ = self._construct_fuzzy_complex(train_data)
+            complex, _, _, _ = self._construct_fuzzy_complex(train_data, save_dir=self.data_provider.checkpoint_path(self.iteration))
             edge_to, edge_from, weight = self._construct_step_edge_dataset(complex, None)
             feature_vectors = np.copy(train_data)
             # pred_model = self.data_provider.prediction_function(self.iteration)
             # attention = get_attention(pred_model, feature_vectors, temperature=.01, device=self.data_provider.DEVICE, verbose=1)            
-            attention = np.zeros(feature_vectors.shape)
+            # no attention, i.e. zero everywhere
+            attention = None
         else: 
             raise Exception("Illegal border edges proposion!")
             
@@ -609,29 +645,24 @@ class kcHybridSpatialEdgeConstructor(SpatialEdgeConstructor):
         t1 = time.time()
         return c0, d0, "{:.1f}".format(t1-t0)
     
-    def construct(self):
+    def construct(self, buffers=None):
         """construct spatio-temporal complex and get edges
 
+        Parameters
+        ----------
+        buffers : dict or str, optional
+            preallocated arrays by name or a directory for memory-mapped outputs, by default None
+
         Returns
         -------
         _type_
             _description_
         """
 
-        # dummy input
-        edge_to = None
-        edge_from = None
-        sigmas = None
-        rhos = None
-        weight = None
-        probs = None
-        feature_vectors = None
-        attention = None
-        knn_indices = None
+        # per time step pieces, assembled once at the end
+        pieces = list()
         time_step_nums = list()
         time_step_idxs_list = list()
-        coefficient = None
-        embedded = None
 
         train_num = self.data_provider.train_num
         # load init_idxs
@@ -693,7 +724,7 @@ class kcHybridSpatialEdgeConstructor(SpatialEdgeConstructor):
                 t_num = len(selected_idxs)
                 b_num = len(border_centers)
 
-                complex, sigmas_t1, rhos_t1, knn_idxs_t = self._construct_fuzzy_complex(train_data)
+                complex, sigmas_t1, rhos_t1, knn_idxs_t = self._construct_fuzzy_complex(train_data, save_dir=self.data_provider.checkpoint_path(t), sample_idxs=selected_idxs)
                 bw_complex, sigmas_t2, rhos_t2, _ = self._construct_boundary_wise_complex(train_data, border_centers)
                 edge_to_t, edge_from_t, weight_t = self._construct_step_edge_dataset(complex, bw_complex)
                 sigmas_t = np.concatenate((sigmas_t1, sigmas_t2[len(sigmas_t1):]), axis=0)
@@ -705,56 +736,30 @@ class kcHybridSpatialEdgeConstructor(SpatialEdgeConstructor):
                 t_num = len(selected_idxs)
                 b_num = 0
 
-                complex, sigmas_t, rhos_t, knn_idxs_t = self._construct_fuzzy_complex(train_data)
+                complex, sigmas_t, rhos_t, knn_idxs_t = self._construct_fuzzy_complex(train_data, save_dir=self.data_provider.checkpoint_path(t), sample_idxs=selected_idxs)
                 edge_to_t, edge_from_t, weight_t = self._construct_step_edge_dataset(complex, None)
                 fitting_data = np.copy(train_data)
                 pred_model = self.data_provider.prediction_function(t)
                 attention_t = get_attention(pred_model, fitting_data, temperature=.01, device=self.data_provider.DEVICE, verbose=1)
             
-            if edge_to is None:
-                edge_to = edge_to_t
-                edge_from = edge_from_t
-                weight = weight_t
-                probs = weight_t / weight_t.max()
-                feature_vectors = fitting_data
-                attention = attention_t
-                sigmas = sigmas_t
-                rhos = rhos_t
-                knn_indices = knn_idxs_t
-                # npr = npr_t
-                time_step_nums.insert(0, (t_num, b_num))
-
-                if self.init_embeddings is None:
-                    coefficient = np.zeros(len(feature_vectors))
-                    embedded = np.zeros((len(feature_vectors), 2))
-                else:
-                    coefficient = np.zeros(len(feature_vectors))
-                    coefficient[:len(self.init_embeddings)] = 1
-                    embedded = np.zeros((len(feature_vectors), 2))
-                    embedded[:len(self.init_embeddings)] = self.init_embeddings
-
-            else:
-                # every round, we need to add len(data) to edge_to(as well as edge_from) index
-                increase_idx = len(fitting_data)
-                edge_to = np.concatenate((edge_to_t, edge_to + increase_idx), axis=0)
-                edge_from = np.concatenate((edge_from_t, edge_from + increase_idx), axis=0)
-                # normalize weight to be in range (0, 1)
-                weight = np.concatenate((weight_t, weight), axis=0)
-                probs_t = weight_t / weight_t.max()
-                probs = np.concatenate((probs_t, probs), axis=0)
-                sigmas = np.concatenate((sigmas_t, sigmas), axis=0)
-                rhos = np.concatenate((rhos_t, rhos), axis=0)
-                feature_vectors = np.concatenate((fitting_data, feature_vectors), axis=0) 
-                attention = np.concatenate((attention_t, attention), axis=0)
-                knn_indices = np.concatenate((knn_idxs_t, knn_indices+increase_idx), axis=0)
-                # npr = np.concatenate((npr_t, npr), axis=0)
-                time_step_nums.insert(0, (t_num, b_num))
-                coefficient = np.concatenate((np.zeros(len(fitting_data)), coefficient), axis=0)
-                embedded = np.concatenate((np.zeros((len(fitting_data), 2)), embedded), axis=0)
-
-                
-
-        return edge_to, edge_from, weight, feature_vectors, embedded, coefficient, time_step_nums, time_step_idxs_list, knn_indices, sigmas, rhos, attention, (c0, d0)
+            pieces.append({
+                "edge_to": edge_to_t,
+                "edge_from": edge_from_t,
+                "weight": weight_t,
+                "feature_vectors": fitting_data,
+                "attention": attention_t,
+                "sigmas": sigmas_t,
+                "rhos": rhos_t,
+                "knn_indices": knn_idxs_t,
+            })
+            time_step_nums.insert(0, (t_num, b_num))
+
+        # time steps were visited backwards
+        pieces.reverse()
+        assembled, _ = self._assemble_complex(pieces, buffers)
+        embedded, coefficient = self.replay_embeddings(time_step_nums, buffers)
+
+        return assembled["edge_to"], assembled["edge_from"], assembled["weight"], assembled["feature_vectors"], embedded, coefficient, time_step_nums, time_step_idxs_list, assembled["knn_indices"], assembled["sigmas"], assembled["rhos"], assembled["attention"], (c0, d0)
 
 
 class kcHybridDenseALSpatialEdgeConstructor(SpatialEdgeConstructor):
@@ -783,29 +788,24 @@ class kcHybridDenseALSpatialEdgeConstructor(SpatialEdgeConstructor):
         t1 = time.time()
         return c0, d0, "{:.1f}".format(t1-t0)
     
-    def construct(self):
+    def construct(self, buffers=None):
         """construct spatio-temporal complex and get edges
 
+        Parameters
+        ----------
+        buffers : dict or str, optional
+            preallocated arrays by name or a directory for memory-mapped outputs, by default None
+
         Returns
         -------
         _type_
             _description_
         """
 
-        # dummy input
-        edge_to = None
-        edge_from = None
-        sigmas = None
-        rhos = None
-        weight = None
-        probs = None
-        feature_vectors = None
-        attention = None
-        knn_indices = None
+        # per time step pieces, assembled once at the end
+        pieces = list()
         time_step_nums = list()
         time_step_idxs_list = list()
-        coefficient = None
-        embedded = None
 
         train_num = self.data_provider.label_num(self.iteration)
         # load init_idxs
@@ -867,7 +867,7 @@ class kcHybridDenseALSpatialEdgeConstructor(SpatialEdgeConstructor):
                 t_num = len(selected_idxs)
                 b_num = len(border_centers)
 
-                complex, sigmas_t1, rhos_t1, knn_idxs_t = self._construct_fuzzy_complex(train_data)
+                complex, sigmas_t1, rhos_t1, knn_idxs_t = self._construct_fuzzy_complex(train_data, save_dir=self.data_provider.single_checkpoint_path(self.iteration, t), sample_idxs=selected_idxs)
                 bw_complex, sigmas_t2, rhos_t2, _ = self._construct_boundary_wise_complex(train_data, border_centers)
                 edge_to_t, edge_from_t, weight_t = self._construct_step_edge_dataset(complex, bw_complex)
                 sigmas_t = np.concatenate((sigmas_t1, sigmas_t2[len(sigmas_t1):]), axis=0)
@@ -879,54 +879,30 @@ class kcHybridDenseALSpatialEdgeConstructor(SpatialEdgeConstructor):
                 t_num = len(selected_idxs)
                 b_num = 0
 
-                complex, sigmas_t, rhos_t, knn_idxs_t = self._construct_fuzzy_complex(train_data)
+                complex, sigmas_t, rhos_t, knn_idxs_t = self._construct_fuzzy_complex(train_data, save_dir=self.data_provider.single_checkpoint_path(self.iteration, t), sample_idxs=selected_idxs)
                 edge_to_t, edge_from_t, weight_t = self._construct_step_edge_dataset(complex, None)
                 fitting_data = np.copy(train_data)
                 pred_model = self.data_provider.prediction_function(self.iteration,t)
                 attention_t = get_attention(pred_model, fitting_data, temperature=.01, device=self.data_provider.DEVICE, verbose=1)
             
-            if edge_to is None:
-                edge_to = edge_to_t
-                edge_from = edge_from_t
-                weight = weight_t
-                probs = weight_t / weight_t.max()
-                feature_vectors = fitting_data
-                attention = attention_t
-                sigmas = sigmas_t
-                rhos = rhos_t
-                knn_indices = knn_idxs_t
-                # npr = npr_t
-                time_step_nums.insert(0, (t_num, b_num))
-
-                if self.init_embeddings is None:
-                    coefficient = np.zeros(len(feature_vectors))
-                    embedded = np.zeros((len(feature_vectors), 2))
-                else:
-                    coefficient = np.zeros(len(feature_vectors))
-                    coefficient[:len(self.init_embeddings)] = 1
-                    embedded = np.zeros((len(feature_vectors), 2))
-                    embedded[:len(self.init_embeddings)] = self.init_embeddings
-
-            else:
-                # every round, we need to add len(data) to edge_to(as well as edge_from) index
-                increase_idx = len(fitting_data)
-                edge_to = np.concatenate((edge_to_t, edge_to + increase_idx), axis=0)
-                edge_from = np.concatenate((edge_from_t, edge_from + increase_idx), axis=0)
-                # normalize weight to be in range (0, 1)
-                weight = np.concatenate((weight_t, weight), axis=0)
-                probs_t = weight_t / weight_t.max()
-                probs = np.concatenate((probs_t, probs), axis=0)
-                sigmas = np.concatenate((sigmas_t, sigmas), axis=0)
-                rhos = np.concatenate((rhos_t, rhos), axis=0)
-                feature_vectors = np.concatenate((fitting_data, feature_vectors), axis=0) 
-                attention = np.concatenate((attention_t, attention), axis=0)
-                knn_indices = np.concatenate((knn_idxs_t, knn_indices+increase_idx), axis=0)
-                # npr = np.concatenate((npr_t, npr), axis=0)
-                time_step_nums.insert(0, (t_num, b_num))
-                coefficient = np.concatenate((np.zeros(len(fitting_data)), coefficient), axis=0)
-                embedded = np.concatenate((np.zeros((len(fitting_data), 2)), embedded), axis=0)
-
-        return edge_to, edge_from, weight, feature_vectors, embedded, coefficient, time_step_nums, time_step_idxs_list, knn_indices, sigmas, rhos, attention, (c0, d0)
+            pieces.append({
+                "edge_to": edge_to_t,
+                "edge_from": edge_from_t,
+                "weight": weight_t,
+                "feature_vectors": fitting_data,
+                "attention": attention_t,
+                "sigmas": sigmas_t,
+                "rhos": rhos_t,
+                "knn_indices": knn_idxs_t,
+            })
+            time_step_nums.insert(0, (t_num, b_num))
+
+        # time steps were visited backwards
+        pieces.reverse()
+        assembled, _ = self._assemble_complex(pieces, buffers)
+        embedded, coefficient = self.replay_embeddings(time_step_nums, buffers)
+
+        return assembled["edge_to"], assembled["edge_from"], assembled["weight"], assembled["feature_vectors"], embedded, coefficient, time_step_nums, time_step_idxs_list, assembled["knn_indices"], assembled["sigmas"], assembled["rhos"], assembled["attention"], (c0, d0)
 
 
 class tfEdgeConstructor(SpatialEdgeConstructor):
@@ -975,21 +951,23 @@ class tfEdgeConstructor(SpatialEdgeConstructor):
         n_rate = find_neighbor_preserving_rate(prev_data, train_data, self.n_neighbors)
         if self.b_n_epochs > 0:
             border_centers = self.data_provider.border_representation(iteration).squeeze()
-            complex, _, _, _ = self._construct_fuzzy_complex(train_data)
+            complex, _, _, _ = self._construct_fuzzy_complex(train_data, save_dir=self.data_provider.checkpoint_path(iteration), sample_idxs=np.arange(len(train_data)))
             bw_complex, _, _, _ = self._construct_boundary_wise_complex(train_data, border_centers)
             edges_to_exp, edges_from_exp, weights_exp = self._construct_step_edge_dataset(complex, bw_complex)
             feature_vectors = np.concatenate((train_data, border_centers), axis=0)
             # pred_model = self.data_provider.prediction_function(self.iteration)
             # attention = get_attention(pred_model, feature_vectors, temperature=.01, device=self.data_provider.DEVICE, verbose=1)
-            attention = np.zeros(feature_vectors.shape)
+            # no attention, i.e. zero everywhere
+            attention = None
 
         elif self.b_n_epochs == 0:
-            complex, _, _, _ = self._construct_fuzzy_complex(train_data)
+            complex, _, _, _ = self._construct_fuzzy_complex(train_data, save_dir=self.data_provider.checkpoint_path(iteration), sample_idxs=np.arange(len(train_data)))
             edges_to_exp, edges_from_exp, weights_exp = self._construct_step_edge_dataset(complex, None)
             feature_vectors = np.copy(train_data)
             # pred_model = self.data_provider.prediction_function(self.iteration)
             # attention = get_attention(pred_model, feature_vectors, temperature=.01, device=self.data_provider.DEVICE, verbose=1)            
-            attention = np.zeros(feature_vectors.shape)
+            # no attention, i.e. zero everywhere
+            attention = None
         else: 
             raise Exception("Illegal border edges proposion!")
             
@@ -118,6 +118,48 @@ class TemporalEdgeConstructor(TemporalEdgeConstructorAbstractClass):
         result.eliminate_zeros()
         return result
         
+    def _temporal_knn(self, samples, candidate_idxs):
+        """
+        select the temporal neighbors of samples among their candidates in one batch
+
+        Parameters
+        ----------
+        samples : ndarray, shape (n,)
+            the vertex of each sample
+        candidate_idxs : ndarray, shape (n, T)
+            the vertex of each sample at every time step in temporal order, -1 if it does not exist
+
+        Returns
+        -------
+        top_k_idxs: ndarray, shape (n, n_neighbors), padded with -1
+        top_k_dists: ndarray, shape (n, n_neighbors), padded with 0.
+        """
+        n, T = candidate_idxs.shape
+        width = max(T, self.n_neighbors)
+        dist_dtype = np.result_type(self.features.dtype, np.float32)
+
+        # compact the candidates of each sample to the left
+        valid = candidate_idxs >= 0
+        n_valid = valid.sum(axis=1)
+        cols = np.cumsum(valid, axis=1) - 1
+        compact_idxs = - np.ones((n, width), dtype=int)
+        compact_dists = np.full((n, width), np.inf, dtype=dist_dtype)
+        for e in range(T):
+            rows = np.flatnonzero(valid[:, e])
+            candidates = candidate_idxs[rows, e]
+            compact_idxs[rows, cols[rows, e]] = candidates
+            compact_dists[rows, cols[rows, e]] = np.linalg.norm(self.features[candidates] - self.features[samples[rows]], axis=1)
+
+        # keep candidate j iff argsort(dists)[j] < n_neighbors, the selection rule of the per-sample version
+        order = np.argsort(compact_dists, axis=1, kind="stable")
+        keep = np.logical_and(order < self.n_neighbors, np.arange(width)[None, :] < n_valid[:, None])
+        # move kept candidates to the front without changing their order
+        front = np.argsort(~keep, axis=1, kind="stable")[:, :self.n_neighbors]
+        kept = np.take_along_axis(keep, front, axis=1)
+        top_k_idxs = np.where(kept, np.take_along_axis(compact_idxs, front, axis=1), -1)
+        top_k_dists = np.where(kept, np.take_along_axis(compact_dists, front, axis=1), 0.).astype(np.float32)
+        return top_k_idxs, top_k_dists
+
     def construct(self):
         return NotImplemented
 
@@ -162,6 +204,29 @@ class LocalTemporalEdgeConstructor(TemporalEdgeConstructor):
         self.time_step_idxs_list = time_step_idxs_list
         self.knn_indices = knn_indices
     
+    def _membership_strengths(self, row_idxs, knn_indices, knn_dists):
+        """
+        compute_membership_strengths restricted to the rows row_idxs
+
+        Parameters
+        ----------
+        row_idxs : ndarray, shape (n,)
+            the vertices the rows belong to, in increasing order
+        knn_indices : ndarray, shape (n, n_neighbors)
+        knn_dists : ndarray, shape (n, n_neighbors)
+
+        Returns
+        -------
+        rows, cols, vals of the edges with positive weight
+        """
+        n = len(row_idxs)
+        # shift neighbors past the local row numbers so that they are never taken as self loops,
+        # temporal neighbors always lie in another time step
+        shifted = np.where(knn_indices == -1, -1, knn_indices + n)
+        rows_t, cols_t, vals_t, _ = compute_membership_strengths(shifted, knn_dists, self.sigmas[row_idxs], self.rhos[row_idxs], return_dists=False)
+        idxs = vals_t > 0
+        return row_idxs[rows_t[idxs]].astype(np.int32), (cols_t[idxs] - n).astype(np.int32), vals_t[idxs]
+
     def construct(self):
         """construct temporal edges
 
@@ -170,9 +235,9 @@ class LocalTemporalEdgeConstructor(TemporalEdgeConstructor):
         time_complex: scipy matrix
             the temporal complex containing temporal edges
         """
-        rows = np.zeros(1, dtype=np.int32)
-        cols = np.zeros(1, dtype=np.int32)
-        vals = np.zeros(1, dtype=np.float32)
+        rows = [np.zeros(0, dtype=np.int32)]
+        cols = [np.zeros(0, dtype=np.int32)]
+        vals = [np.zeros(0, dtype=np.float32)]
 
         n_all = 0
         time_step_num = list()
@@ -186,56 +251,37 @@ class LocalTemporalEdgeConstructor(TemporalEdgeConstructor):
             n_all = n_all + i[0] + i[1]
         
         # forward
-        for window in range(1, self.persistent + 1, 1):
+        for window in range(1, self.persistence + 1, 1):
             for step in range(0, self.time_steps - window, 1):
-                knn_indices_in = - np.ones((n_all, self.n_neighbors))
-                knn_dist = np.zeros((n_all, self.n_neighbors))
-
                 next_knn = self.knn_indices[time_step_num[step+window]:time_step_num[step+window] + self.time_step_nums[step + window][0]]
+                next_idxs = np.asarray(self.time_step_idxs_list[step+window], dtype=int)
+                assert len(next_knn) == len(next_idxs)
 
-                # knn_indices_in[all_step_num[step]: all_step_num[step] + time_step_nums[step + window][0]] = next_knn
-                increase_idx = all_step_num[step]
-                assert len(next_knn) == len(self.time_step_idxs_list[step+window])
-                for i in range(len(self.time_step_idxs_list[step+window])):
-                    knn_indices_in[increase_idx + self.time_step_idxs_list[step+window][i]]=next_knn[i]
-                knn_indices_in = knn_indices_in.astype('int')
-
-                indices = np.arange(all_step_num[step], all_step_num[step] + self.time_step_nums[step][0], 1)[self.time_step_idxs_list[step+window]]
+                indices = np.arange(all_step_num[step], all_step_num[step] + self.time_step_nums[step][0], 1)[next_idxs]
                 knn_dists_t = knn_dists(self.features, indices, next_knn)
 
-                # knn_dist[all_step_num[step]:all_step_num[step] + time_step_nums[step + window][0]] = knn_dists_t
-                assert len(knn_dists_t) == len(self.time_step_idxs_list[step+window])
-                for i in range(len(self.time_step_idxs_list[step+window])):
-                    knn_dist[increase_idx + self.time_step_idxs_list[step+window][i]]=knn_dists_t[i]
-                knn_dist = knn_dist.astype('float32')
-
-                rows_t, cols_t, vals_t, _ = compute_membership_strengths(knn_indices_in, knn_dist, self.sigmas, self.rhos, return_dists=False)
-                idxs = vals_t > 0
-                rows = np.concatenate((rows, rows_t[idxs]), axis=0)
-                cols = np.concatenate((cols, cols_t[idxs]), axis=0)
-                vals = np.concatenate((vals, vals_t[idxs]), axis=0)
+                # only the rows linked to the next time step carry edges
+                order = np.argsort(indices, kind="stable")
+                rows_t, cols_t, vals_t = self._membership_strengths(indices[order], next_knn[order].astype('int'), knn_dists_t[order].astype('float32'))
+                rows.append(rows_t)
+                cols.append(cols_t)
+                vals.append(vals_t)
         # backward
-        for window in range(1, self.persistent + 1, 1):
+        for window in range(1, self.persistence + 1, 1):
             for step in range(self.time_steps-1, 0 + window, -1):
-                knn_indices_in = - np.ones((n_all, self.n_neighbors))
-                knn_dist = np.zeros((n_all, self.n_neighbors))
-
                 prev_knn = self.knn_indices[time_step_num[step-window]:time_step_num[step-window] + self.time_step_nums[step-window][0]]
-
-                knn_indices_in[all_step_num[step]: all_step_num[step] + self.time_step_nums[step][0]] = prev_knn[self.time_step_idxs_list[step]]
-                knn_indices_in = knn_indices_in.astype('int')
+                prev_knn = prev_knn[self.time_step_idxs_list[step]]
 
                 indices = np.arange(all_step_num[step], all_step_num[step] + self.time_step_nums[step][0], 1)
-                knn_dists_t = knn_dists(self.features, indices, prev_knn[self.time_step_idxs_list[step]])
-
-                knn_dist[all_step_num[step]:all_step_num[step] + self.time_step_nums[step][0]] = knn_dists_t
-                knn_dist = knn_dist.astype('float32')
-
-                rows_t, cols_t, vals_t, _ = compute_membership_strengths(knn_indices_in, knn_dist, self.sigmas, self.rhos, return_dists=False)
-                idxs = vals_t > 0
-                rows = np.concatenate((rows, rows_t[idxs]), axis=0)
-                cols = np.concatenate((cols, cols_t[idxs]), axis=0)
-                vals = np.concatenate((vals, vals_t[idxs]), axis=0)
+                knn_dists_t = knn_dists(self.features, indices, prev_knn)
+
+                rows_t, cols_t, vals_t = self._membership_strengths(indices, prev_knn.astype('int'), knn_dists_t.astype('float32'))
+                rows.append(rows_t)
+                cols.append(cols_t)
+                vals.append(vals_t)
+        rows = np.concatenate(rows, axis=0)
+        cols = np.concatenate(cols, axis=0)
+        vals = np.concatenate(vals, axis=0)
         time_complex = self.temporal_simplicial_set(rows=rows, cols=cols, vals=vals, n_vertice=len(self.features))
 
         # normalize for symmetry reason
@@ -251,23 +297,10 @@ class GlobalTemporalEdgeConstructor(TemporalEdgeConstructor):
         super().__init__(X, time_step_nums, sigmas, rhos, n_neighbors, n_epochs)
     
     def construct(self):
-        rows = np.zeros(1, dtype=np.int32)
-        cols = np.zeros(1, dtype=np.int32)
-        vals = np.zeros(1, dtype=np.float32)
-
         # base_idx denote the starting point of each time step (including borders)
-        base_idx = 0
-        base_idx_list = list()
-        for i in self.time_step_nums:
-            base_idx_list.append(base_idx)
-            base_idx = base_idx + i[0] + i[1]
-        base_idx_list = np.array(base_idx_list, dtype=int)
-
-        # denote the training data idxs range at each time step
-        valid_idx_list = list()
-        for i in range(len(self.time_step_nums)):
-            valid_idx_list.append(base_idx_list[i]+self.time_step_nums[i][0])
-        valid_idx_list = np.array(valid_idx_list, dtype=int)
+        train_nums = np.array([i[0] for i in self.time_step_nums], dtype=int)
+        all_nums = np.array([i[0] + i[1] for i in self.time_step_nums], dtype=int)
+        base_idx_list = np.concatenate(([0], np.cumsum(all_nums)[:-1])).astype(int)
         
         num = len(self.features)
 
@@ -276,23 +309,13 @@ class GlobalTemporalEdgeConstructor(TemporalEdgeConstructor):
         dists = np.zeros((num, self.n_neighbors), dtype=np.float32)
 
         for time_step in range(self.time_steps):
+            if train_nums[time_step] == 0:
+                continue
             start_idx = base_idx_list[time_step]
-            end_idx = start_idx + self.time_step_nums[time_step][0] - 1
-            move_positions = base_idx_list - start_idx
-            for train_sample_idx in range(start_idx, end_idx + 1, 1):
-                candidate_idxs = train_sample_idx + move_positions
-                candidate_idxs = candidate_idxs[np.logical_and(candidate_idxs>=base_idx_list, candidate_idxs<valid_idx_list)]
-                nn_dist = knn_dists(self.features, [train_sample_idx], candidate_idxs).squeeze(axis=0)
-                # find top k
-                order = np.argsort(nn_dist)
-                # deal with if len(candidate_idxs)<n_neighbors situation
-                top_k_idxs = candidate_idxs[order<self.n_neighbors]
-                top_k_idxs = np.pad(top_k_idxs, (0, self.n_neighbors-len(top_k_idxs)), 'constant', constant_values=-1).astype('int')
-                top_k_dists = nn_dist[order<self.n_neighbors]
-                top_k_dists = np.pad(top_k_dists, (0, self.n_neighbors-len(top_k_dists)), 'constant', constant_values=0.).astype(np.float32)
-
-                indices[train_sample_idx] = top_k_idxs
-                dists[train_sample_idx] = top_k_dists
+            local_idxs = np.arange(train_nums[time_step])
+            # the same sample at every time step where it is a training point
+            candidate_idxs = np.where(local_idxs[:, None] < train_nums[None, :], base_idx_list[None, :] + local_idxs[:, None], -1)
+            indices[start_idx:start_idx+len(local_idxs)], dists[start_idx:start_idx+len(local_idxs)] = self._temporal_knn(start_idx + local_idxs, candidate_idxs)
 
         rows, cols, vals, _ = compute_membership_strengths(indices, dists, self.sigmas, self.rhos, return_dists=False)
         # build time complex
@@ -323,32 +346,27 @@ class GlobalParallelTemporalEdgeConstructor(TemporalEdgeConstructor):
         indices = - np.ones((num, self.n_neighbors), dtype=int)
         dists = np.zeros((num, self.n_neighbors), dtype=np.float32)
 
+        # inverse index, sample id -> its vertex at every epoch (first occurrence), -1 if not selected
+        selected_idxs = [np.asarray(idxs, dtype=int) for idxs in self.selected_idxs]
+        ids = np.concatenate(selected_idxs)
+        epochs = np.concatenate([np.full(len(idxs), e, dtype=int) for e, idxs in enumerate(selected_idxs)])
+        positions = np.concatenate([np.arange(len(idxs)) for idxs in selected_idxs])
+        order = np.lexsort((positions, epochs, ids))
+        ids, epochs, positions = ids[order], epochs[order], positions[order]
+        # keep the first occurrence of a sample in each epoch
+        first = np.ones(len(ids), dtype=bool)
+        first[1:] = np.logical_or(ids[1:] != ids[:-1], epochs[1:] != epochs[:-1])
+        ids, epochs, positions = ids[first], epochs[first], positions[first]
+        unique_ids = np.unique(ids)
+        inverse_index = - np.ones((len(unique_ids), self.time_steps), dtype=int)
+        inverse_index[np.searchsorted(unique_ids, ids), epochs] = base_idx_list[epochs] + positions
+
         for time_step in range(self.time_steps):
-            for point_idx in range(len(self.selected_idxs[time_step])):
-                true_idx = self.selected_idxs[time_step][point_idx]
-
-                identical_self = list()
-                for e in range(self.time_steps):
-                    arg = np.argwhere(self.selected_idxs[e]==true_idx)
-                    if arg.shape[0]:
-                        target_idx = arg[0][0]
-                        identical_self.append(base_idx_list[e]+target_idx)
-                    
-                if len(identical_self) >0:
-                    # identical self number exceeds n_neighbors, need to select top n_neighbors
-                    curr_idx = base_idx_list[time_step]+point_idx
-                    candidate_idxs = np.array(identical_self)
-                    nn_dist = knn_dists(self.features, [curr_idx], candidate_idxs).squeeze(axis=0)
-                    # find top k
-                    order = np.argsort(nn_dist)
-                    # deal with if len(candidate_idxs)<n_neighbors situation
-                    top_k_idxs = candidate_idxs[order<self.n_neighbors]
-                    top_k_idxs = np.pad(top_k_idxs, (0, self.n_neighbors-len(top_k_idxs)), 'constant', constant_values=-1).astype('int')
-                    top_k_dists = nn_dist[order<self.n_neighbors]
-                    top_k_dists = np.pad(top_k_dists, (0, self.n_neighbors-len(top_k_dists)), 'constant', constant_values=0.).astype(np.float32)
-
-                    indices[curr_idx] = top_k_idxs
-                    dists[curr_idx] = top_k_dists
+            if len(selected_idxs[time_step]) == 0:
+                continue
+            curr_idxs = base_idx_list[time_step] + np.arange(len(selected_idxs[time_step]))
+            candidate_idxs = inverse_index[np.searchsorted(unique_ids, selected_idxs[time_step])]
+            indices[curr_idxs], dists[curr_idxs] = self._temporal_knn(curr_idxs, candidate_idxs)
 
         rows, cols, vals, _ = compute_membership_strengths(indices, dists, self.sigmas, self.rhos, return_dists=False)
         if len(rows)>0:
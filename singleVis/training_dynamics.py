@@ -33,21 +33,15 @@ class TD:
         EPOCH_END = self.data_provider.e
         EPOCH_PERIOD = self.data_provider.p
         labels = self.data_provider.train_labels(EPOCH_START)
+        # num, epoch, classes
+        preds = self.data_provider.get_pred_all_epochs(list(range(EPOCH_START, EPOCH_END+1, EPOCH_PERIOD)))
 
         # epoch, num, 1
-        losses = None
+        losses = list()
 
-        for epoch in range(EPOCH_START, EPOCH_END+1, EPOCH_PERIOD):
-            representation = self.data_provider.train_representation(epoch)
-            pred = self.data_provider.get_pred(epoch, representation)
-
-            loss = cross_entropy(pred, labels)
-
-            if losses is None:
-                losses = np.expand_dims(loss, axis=0)
-            else:
-                losses = np.concatenate((losses, np.expand_dims(loss, axis=0)), axis=0)
-        losses = np.transpose(losses, [1,0])
+        for t in range(preds.shape[1]):
+            losses.append(cross_entropy(preds[:, t], labels))
+        losses = np.stack(losses, axis=1)
         return losses
     
     def uncertainty_dynamics(self):
@@ -55,39 +49,17 @@ class TD:
         EPOCH_END = self.data_provider.e
         EPOCH_PERIOD = self.data_provider.p
         labels = self.data_provider.train_labels(EPOCH_START)
-
-        # epoch, num, 1
-        uncertainties = None
-
-        for epoch in range(EPOCH_START, EPOCH_END+1, EPOCH_PERIOD):
-            representation = self.data_provider.train_representation(epoch)
-            pred = self.data_provider.get_pred(epoch, representation)
-            uncertainty = pred[np.arange(len(labels)), labels]
-
-            if uncertainties is None:
-                uncertainties = np.expand_dims(uncertainty, axis=0)
-            else:
-                uncertainties = np.concatenate((uncertainties, np.expand_dims(uncertainty, axis=0)), axis=0)
-        uncertainties = np.transpose(uncertainties, [1,0])
+        # num, epoch, classes
+        preds = self.data_provider.get_pred_all_epochs(list(range(EPOCH_START, EPOCH_END+1, EPOCH_PERIOD)))
+        uncertainties = preds[np.arange(len(labels)), :, labels]
         return uncertainties
     
     def pred_dynamics(self):
         EPOCH_START = self.data_provider.s
         EPOCH_END = self.data_provider.e
         EPOCH_PERIOD = self.data_provider.p
-
-        # epoch, num, 1
-        preds = None
-
-        for epoch in range(EPOCH_START, EPOCH_END+1, EPOCH_PERIOD):
-            representation = self.data_provider.train_representation(epoch)
-            pred = self.data_provider.get_pred(epoch, representation)
-
-            if preds is None:
-                preds = np.expand_dims(pred, axis=0)
-            else:
-                preds = np.concatenate((preds, np.expand_dims(pred, axis=0)), axis=0)
-        preds = np.transpose(preds, [1,0, 2])
+        # num, epoch, classes
+        preds = self.data_provider.get_pred_all_epochs(list(range(EPOCH_START, EPOCH_END+1, EPOCH_PERIOD)))
         return preds
     
     def dloss_dt_dynamics(self, ):
@@ -97,18 +69,15 @@ class TD:
         EPOCH_START = self.data_provider.s
         EPOCH_END = self.data_provider.e
         EPOCH_PERIOD = self.data_provider.p
+        all_representation = self.data_provider.all_representation("train")
 
         # epoch, num, dims
-        embeddings = None
+        embeddings = list()
 
         for epoch in range(EPOCH_START, EPOCH_END+1, EPOCH_PERIOD):
-            representation = self.data_provider.train_representation(epoch)
-            embedding = self.projector.batch_project(epoch, representation)
-            if embeddings is None:
-                embeddings = np.expand_dims(embedding, axis=0)
-            else:
-                embeddings = np.concatenate((embeddings, np.expand_dims(embedding, axis=0)), axis=0)
-        embeddings = np.transpose(embeddings, [1,0,2])
+            representation = np.array(all_representation.epoch(epoch))
+            embeddings.append(self.projector.batch_project(epoch, representation))
+        embeddings = np.stack(embeddings, axis=1)
         return embeddings
     
     def velocity_dynamics(self,):
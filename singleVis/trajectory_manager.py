@@ -1,7 +1,7 @@
 import numpy as np
 from sklearn.linear_model import Ridge
 from sklearn.cluster import Birch
-from pynndescent import NNDescent
+from singleVis.knn_graph import neighbor_graph
 from sklearn.neighbors import NearestNeighbors
 # TODO random ignore
 
@@ -15,21 +15,8 @@ def find_cluster(trajectories, sub_labels, new_sample):
     samples_in_cls = trajectories[np.argwhere(sub_labels==cls_idx).squeeze()]
 
 
-    # number of trees in random projection forest
-    n_trees = min(64, 5 + int(round(samples_in_cls.shape[0] ** 0.5 / 20.0)))
-    # max number of nearest neighbor iters to perform
-    n_iters = max(5, int(round(np.log2(samples_in_cls.shape[0]))))
-    # get nearest neighbors
-    nnd = NNDescent(
-        samples_in_cls,
-        n_neighbors=2,
-        metric="euclidean",
-        n_trees=n_trees,
-        n_iters=n_iters,
-        max_candidates=60,
-        verbose=False
-    )
-    _, dists = nnd.neighbor_graph
+    # get nearest neighbors, the graph of a cluster is reused across queries
+    _, dists = neighbor_graph(samples_in_cls, 2, metric="euclidean")
     dists = dists[:, 1]
     max_dist = dists.max()
     if nearest_neighbor_dist< max_dist:
@@ -5,7 +5,7 @@ import tqdm
 import numpy as np
 import json
 import time
-from pynndescent import NNDescent
+from singleVis.knn_graph import neighbor_graph
 from sklearn.neighbors import KDTree
 from sklearn.metrics import pairwise_distances
 from scipy import stats as stats
@@ -65,8 +65,73 @@ def mixup_bi(model, image1, image2, label, target_cls, device, diff=0.1, max_ite
     return image_mix, successful, step
 
 
-def get_border_points(model, input_x, confs, predictions, device, num_adv_eg, l_bound=0.6, lambd=0.2, verbose=1):
+def batch_mixup_bi(model, image1, image2, label, target_cls, device, diff=0.1, max_iter=8, l_bound=0.8):
+    '''Get BPs based on mixup method for a batch of image pairs at once
+    each pair keeps its own upper/lower bound and stops as soon as it reaches the boundary
+    :param model: subject model
+    :param image1: images, torch.Tensor of shape (N, C, H, W)
+    :param image2: images, torch.Tensor of shape (N, C, H, W)
+    :param label: ndarray of shape (N,), prediction for image1
+    :param target_cls: ndarray of shape (N,), prediction for image2
+    :param device: the device to run code, torch cpu or torch cuda
+    :param diff: the difference between top1 and top2 logits we define as boundary, float by default 0.1
+    :param max_iter: binary search iteration maximum value, int by default 8
+    :param l_bound: lower bound of the weight on image1
+    :return image_mix: torch.Tensor of shape (N, C, H, W), the last mixed image of each pair
+    :return successful: torch.Tensor of shape (N,), bool, whether each pair reaches the boundary
+    :return steps: torch.Tensor of shape (N,), the step each pair stops at
+    '''
+    n = len(image1)
+    image1 = image1.to(device, dtype=torch.float)
+    image2 = image2.to(device, dtype=torch.float)
+    label = torch.as_tensor(label, dtype=torch.long, device=device)
+    target_cls = torch.as_tensor(target_cls, dtype=torch.long, device=device)
+    # broadcast per-pair weights to image shape
+    view = (-1,) + (1,) * (image1.dim() - 1)
+
+    # initialze upper and lower bound
+    # set a limitation to upper bound
+    upper = torch.ones(n, device=device)
+    lower = torch.full((n,), float(l_bound), device=device)
+    image_mix = torch.empty_like(image1)
+    successful = torch.zeros(n, dtype=torch.bool, device=device)
+    steps = torch.full((n,), max_iter - 1, dtype=torch.long, device=device)
+    active = torch.ones(n, dtype=torch.bool, device=device)
+
+    for step in range(max_iter):
+        idxs = torch.nonzero(active).squeeze(1)
+        if len(idxs) == 0:
+            break
+        # take middle point
+        lamb = (upper[idxs] + lower[idxs]) / 2
+        mix = lamb.view(view) * image1[idxs] + (1 - lamb.view(view)) * image2[idxs]
+        with torch.no_grad():
+            pred_new = model(mix)
+            conf_max = torch.max(pred_new, dim=1)[0]
+            conf_min = torch.min(pred_new, dim=1)[0]
+            normalized = (pred_new - conf_min[:, None]) / (conf_max - conf_min)[:, None]  # min-max rescaling
+        image_mix[idxs] = mix
+
+        # Bisection method
+        rows = torch.arange(len(idxs), device=device)
+        decrease = normalized[rows, label[idxs]] - normalized[rows, target_cls[idxs]] > 0
+        upper[idxs] = torch.where(decrease, lamb, upper[idxs])
+        lower[idxs] = torch.where(decrease, lower[idxs], lamb)
+
+        # Stop when reaching the decision boundary and abs(upper-lower) < 0.1
+        top2 = torch.topk(normalized, 2, dim=1)[0]
+        curr_diff = top2[:, 0] - top2[:, 1]
+        done = torch.logical_and(curr_diff < diff, (upper[idxs] - lower[idxs]) < 0.1)
+        finished = idxs[done]
+        successful[finished] = True
+        steps[finished] = step
+        active[finished] = False
+    return image_mix, successful, steps
+
+
+def get_border_points(model, input_x, confs, predictions, device, num_adv_eg, l_bound=0.6, lambd=0.2, batch_size=256, verbose=1):
     '''Get BPs
+    class pairs are sampled batch_size at a time and the mixup bisection runs on the whole batch
     :param model: subject model
     :param input_x: images, torch.Tensor of shape (N, C, H, W)
     :param confs: logits, numpy.ndarray of shape (N, class_num)
@@ -74,10 +139,11 @@ def get_border_points(model, input_x, confs, predictions, device, num_adv_eg, l_
     :param num_adv_eg: number of adversarial examples to be generated, int
     :param l_bound: lower bound to conduct mix-up attack, range (0, 1)
     :param lambd: trade-off between efficiency and diversity, (0, 1)
+    :param batch_size: the maximum number of class pairs attacked together, int
     :return adv_examples: adversarial images, torch.Tensor of shape (N, C, H, W)
     '''
 
-    adv_examples = torch.tensor([]).to(device)
+    adv_examples = list()
     num_adv = 0
     a = lambd
     # count valid classes
@@ -98,6 +164,25 @@ def get_border_points(model, input_x, confs, predictions, device, num_adv_eg, l_
             index_dict[idx] = (valid_cls[i], valid_cls[j])
             idx += 1
 
+    # the sampling distribution of each class pair only depends on confs, compute it once
+    pair_candidates = dict()
+    def get_candidates(selected):
+        if selected not in pair_candidates:
+            (cls1, cls2) = index_dict[selected]
+            data1_index = np.flatnonzero(predictions == cls1)
+            data2_index = np.flatnonzero(predictions == cls2)
+            conf1 = confs[data1_index]
+            conf2 = confs[data2_index]
+
+            # probability to be sampled is inversely proportional to the distance to "targeted" decision boundary
+            # smaller class1-class2 is preferred
+            pvec1 = (1 / (conf1[:, cls1] - conf1[:, cls2] + 1e-4)) / np.sum(
+                (1 / (conf1[:, cls1] - conf1[:, cls2] + 1e-4)))
+            pvec2 = (1 / (conf2[:, cls2] - conf2[:, cls1] + 1e-4)) / np.sum(
+                (1 / (conf2[:, cls2] - conf2[:, cls1] + 1e-4)))
+            pair_candidates[selected] = (data1_index, pvec1, data2_index, pvec2)
+        return pair_candidates[selected]
+
     t0 = time.time()
     while num_adv < num_adv_eg:
         idxs = np.argwhere(tot_num != 0).squeeze()
@@ -114,41 +199,43 @@ def get_border_points(model, input_x, confs, predictions, device, num_adv_eg, l_
         p = a*succ_rate + (1-a)*curr_rate
         p = p/(np.sum(p))
 
-        selected = np.random.choice(range(len(curr_samples)), size=1, p=p)[0]
-        (cls1, cls2) = index_dict[selected]
-        data1_index = np.argwhere(predictions == cls1).squeeze()
-        data2_index = np.argwhere(predictions == cls2).squeeze()
-        conf1 = confs[data1_index]
-        conf2 = confs[data2_index]
-
-        # probability to be sampled is inversely proportional to the distance to "targeted" decision boundary
-        # smaller class1-class2 is preferred
-        pvec1 = (1 / (conf1[:, cls1] - conf1[:, cls2] + 1e-4)) / np.sum(
-            (1 / (conf1[:, cls1] - conf1[:, cls2] + 1e-4)))
-        pvec2 = (1 / (conf2[:, cls2] - conf2[:, cls1] + 1e-4)) / np.sum(
-            (1 / (conf2[:, cls2] - conf2[:, cls1] + 1e-4)))
-
-        image1_idx = np.random.choice(range(len(data1_index)), size=1, p=pvec1)
-        image2_idx = np.random.choice(range(len(data2_index)), size=1, p=pvec2)
-
-        image1 = input_x[data1_index[image1_idx]]
-        image2 = input_x[data2_index[image2_idx]]
-
-        attack1, successful1, _ = mixup_bi(model, image1, image2, cls1, cls2, device, l_bound=l_bound)
-        if successful1:
-            adv_examples = torch.cat((adv_examples, attack1), dim=0)
-            num_adv += 1
-            curr_samples[selected] += 1
-        tot_num[selected] += 1
-
-        if num_adv < num_adv_eg:
-            attack2, successful2, _ = mixup_bi(model, image2, image1, cls2, cls1, device, l_bound=l_bound)
-            tot_num[selected] += 1
-            if successful2:
-                adv_examples = torch.cat((adv_examples, attack2), dim=0)
-                num_adv += 1
-                curr_samples[selected] += 1
-
+        # each pair is attacked in both directions
+        pair_num = min(batch_size, num_adv_eg - num_adv)
+        selected = np.random.choice(range(len(curr_samples)), size=pair_num, p=p)
+        pair_ids = list()
+        image1_idxs = list()
+        image2_idxs = list()
+        cls1_list = list()
+        cls2_list = list()
+        for s, cnt in zip(*np.unique(selected, return_counts=True)):
+            data1_index, pvec1, data2_index, pvec2 = get_candidates(s)
+            (cls1, cls2) = index_dict[s]
+            image1_idxs.append(data1_index[np.random.choice(range(len(data1_index)), size=cnt, p=pvec1)])
+            image2_idxs.append(data2_index[np.random.choice(range(len(data2_index)), size=cnt, p=pvec2)])
+            pair_ids.append(np.full(cnt, s))
+            cls1_list.append(np.full(cnt, cls1))
+            cls2_list.append(np.full(cnt, cls2))
+        pair_ids = np.concatenate(pair_ids)
+        image1 = input_x[torch.from_numpy(np.concatenate(image1_idxs))]
+        image2 = input_x[torch.from_numpy(np.concatenate(image2_idxs))]
+        cls1 = np.concatenate(cls1_list)
+        cls2 = np.concatenate(cls2_list)
+
+        attack, successful, _ = batch_mixup_bi(model, torch.cat((image1, image2), dim=0), torch.cat((image2, image1), dim=0),
+                                               np.concatenate((cls1, cls2)), np.concatenate((cls2, cls1)), device, l_bound=l_bound)
+        pair_ids = np.concatenate((pair_ids, pair_ids))
+        np.add.at(tot_num, pair_ids, 1)
+
+        succ_idxs = torch.nonzero(successful).squeeze(1).cpu().numpy()
+        succ_idxs = succ_idxs[:num_adv_eg - num_adv]
+        np.add.at(curr_samples, pair_ids[succ_idxs], 1)
+        adv_examples.append(attack[torch.from_numpy(succ_idxs).to(attack.device)])
+        num_adv += len(succ_idxs)
+
+    if len(adv_examples):
+        adv_examples = torch.cat(adv_examples, dim=0)
+    else:
+        adv_examples = torch.tensor([]).to(device)
     t1 = time.time()
     if verbose:
         print('Total time {:2f}'.format(t1 - t0))
@@ -184,23 +271,8 @@ def jaccard_similarity(l1, l2):
     return float(len(i)) / len(u)
 
 def knn(data, k):
-    # number of trees in random projection forest
-    n_trees = min(64, 5 + int(round((data.shape[0]) ** 0.5 / 20.0)))
-    # max number of nearest neighbor iters to perform
-    n_iters = max(5, int(round(np.log2(data.shape[0]))))
-    # distance metric
-    metric = "euclidean"
     # get nearest neighbors
-    nnd = NNDescent(
-        data,
-        n_neighbors=k,
-        metric=metric,
-        n_trees=n_trees,
-        n_iters=n_iters,
-        max_candidates=60,
-        verbose=True
-    )
-    knn_indices, knn_dists = nnd.neighbor_graph
+    knn_indices, knn_dists = neighbor_graph(data, k, metric="euclidean", verbose=True)
     return knn_indices, knn_dists
 
 
@@ -244,7 +316,7 @@ def is_B(preds):
     sort_preds = np.sort(preds)
     diff = (sort_preds[:, -1] - sort_preds[:, -2]) / (sort_preds[:, -1] - sort_preds[:, 0])
 
-    is_border = np.zeros(len(diff), dtype=np.bool)
+    is_border = np.zeros(len(diff), dtype=bool)
     is_border[diff < 0.1] = 1
     return is_border
     
@@ -256,24 +328,8 @@ def find_nearest(query):
     :param pool: ndarray (N, dim)
     :return dists: ndarray (N,)
     """
-    # number of trees in random projection forest
-    n_trees = min(64, 5 + int(round((query.shape[0]) ** 0.5 / 20.0)))
-    # max number of nearest neighbor iters to perform
-    n_iters = max(5, int(round(np.log2(query.shape[0]))))
-    # distance metric
-    metric = "euclidean"
-
     # get nearest neighbors
-    nnd = NNDescent(
-        query,
-        n_neighbors=2,
-        metric=metric,
-        n_trees=n_trees,
-        n_iters=n_iters,
-        max_candidates=60,
-        verbose=False
-    )
-    indices, distances = nnd.neighbor_graph
+    indices, distances = neighbor_graph(query, 2, metric="euclidean")
     return indices[:, 1], distances[:, 1]
 
 
@@ -287,33 +343,9 @@ def find_neighbor_preserving_rate(prev_data, train_data, n_neighbors):
     """
     if prev_data is None:
         return np.zeros(len(train_data))
-    # number of trees in random projection forest
-    n_trees = min(64, 5 + int(round((train_data.shape[0]) ** 0.5 / 20.0)))
-    # max number of nearest neighbor iters to perform
-    n_iters = max(5, int(round(np.log2(train_data.shape[0]))))
-    # distance metric
-    from pynndescent import NNDescent
-    # get nearest neighbors
-    nnd = NNDescent(
-        train_data,
-        n_neighbors=n_neighbors,
-        metric="euclidean",
-        n_trees=n_trees,
-        n_iters=n_iters,
-        max_candidates=60,
-        verbose=True
-    )
-    train_indices, _ = nnd.neighbor_graph
-    prev_nnd = NNDescent(
-        prev_data,
-        n_neighbors=n_neighbors,
-        metric="euclidean",
-        n_trees=n_trees,
-        n_iters=n_iters,
-        max_candidates=60,
-        verbose=True
-    )
-    prev_indices, _ = prev_nnd.neighbor_graph
+    # get nearest neighbors, the graph of prev_data is usually cached from the previous epoch
+    train_indices, _ = neighbor_graph(train_data, n_neighbors, metric="euclidean", verbose=False)
+    prev_indices, _ = neighbor_graph(prev_data, n_neighbors, metric="euclidean", verbose=False)
     temporal_pres = np.zeros(len(train_data))
     for i in range(len(train_indices)):
         pres = np.intersect1d(train_indices[i], prev_indices[i])
@@ -203,7 +203,7 @@ class visualizer(VisualizerAbstractClass):
 
         train_data = self.data_provider.train_representation(epoch)
         train_labels = self.data_provider.train_labels(epoch)
-        pred = self.data_provider.get_pred(epoch, train_data)
+        pred = self.data_provider.train_pred(epoch)
         pred = pred.argmax(axis=1)
 
         embedding = self.projector.batch_project(epoch, train_data)
@@ -242,7 +242,7 @@ class visualizer(VisualizerAbstractClass):
 
         train_data = self.data_provider.train_representation(epoch)
         train_labels = self.data_provider.train_labels(epoch)
-        pred = self.data_provider.get_pred(epoch, train_data)
+        pred = self.data_provider.train_pred(epoch)
         pred = pred.argmax(axis=1)
 
         embedding = self.projector.batch_project(epoch, train_data)
@@ -8,14 +8,14 @@ import os
 import time
 import numpy as np
 
-from torch.utils.data import DataLoader
-from torch.utils.data import WeightedRandomSampler
 from umap.umap_ import find_ab_params
 
-from singleVis.custom_weighted_random_sampler import CustomWeightedRandomSampler
 from singleVis.SingleVisualizationModel import VisModel, tfModel
 from singleVis.losses import HybridLoss, SmoothnessLoss, UmapLoss, ReconstructionLoss, TemporalLoss, DVILoss, SingleVisLoss, umap_loss, reconstruction_loss, regularize_loss
-from singleVis.edge_dataset import HybridDataHandler, DVIDataHandler, DataHandler, construct_edge_dataset
+from singleVis.edge_dataset import construct_edge_dataset
+from singleVis.edge_loader import EdgeLoader, HybridEdgeLoader
+from singleVis.complex_cache import ComplexCache
+from singleVis.prefetch import prefetch
 from singleVis.trainer import HybridVisTrainer, DVITrainer, SingleVisTrainer
 from singleVis.data import DataProviderAbstractClass, NormalDataProvider, ActiveLearningDataProvider, DenseActiveLearningDataProvider
 from singleVis.spatial_edge_constructor import kcHybridSpatialEdgeConstructor, SingleEpochSpatialEdgeConstructor, kcSpatialEdgeConstructor, tfEdgeConstructor
@@ -94,6 +94,35 @@ class StrategyAbstractClass(ABC):
         self._evaluate()
         self._visualize()
 
+    def _cached_complex(self, params, epochs, build):
+        """
+        outputs of build for the complex described by params and built from the checkpoints of epochs, served from the complex cache if possible
+        the cache lives in CONTENT_PATH/complex_cache and is configured by VISUALIZATION.CACHE_COMPLEX (by default false) and VISUALIZATION.CACHE_SIZE (GB, by default 20)
+        with the cache on, a rerun reuses the cached complex, including its random k-center initial selection
+        :param params: dict, the construction parameters
+        :param epochs: list of int
+        :param build: function, () -> dict of outputs, numpy arrays or json serializable values
+        :return: dict of outputs and the cache key (None if the cache is off)
+        """
+        VISUALIZATION_PARAMETER = self.config["VISUALIZATION"]
+        if not VISUALIZATION_PARAMETER.get("CACHE_COMPLEX", False):
+            return build(), None
+        cache = ComplexCache(os.path.join(self.CONTENT_PATH, "complex_cache"), max_bytes=int(VISUALIZATION_PARAMETER.get("CACHE_SIZE", 20) * 2**30))
+        files = list()
+        for epoch in epochs:
+            for file_name in ["train_data.npy", "index.json", "border_centers.npy", "subject_model.pth"]:
+                path = os.path.join(self.data_provider.checkpoint_path(epoch), file_name)
+                if os.path.exists(path):
+                    files.append(path)
+        key = cache.key(dict(params, VIS_METHOD=self.VIS_METHOD), files)
+        outputs = cache.load(key)
+        if outputs is None:
+            outputs = build()
+            cache.save(key, outputs)
+        else:
+            print("Load complex {} from cache...".format(key))
+        return outputs, key
+
 class DeepVisualInsight(StrategyAbstractClass):
     def __init__(self, CONTENT_PATH, config):
         super().__init__(CONTENT_PATH, config)
@@ -155,69 +184,82 @@ class DeepVisualInsight(StrategyAbstractClass):
         VISUALIZATION_PARAMETER = self.config["VISUALIZATION"]
         B_N_EPOCHS = VISUALIZATION_PARAMETER["BOUNDARY"]["B_N_EPOCHS"]
         L_BOUND = VISUALIZATION_PARAMETER["BOUNDARY"]["L_BOUND"]
+        SHARE_POOL = VISUALIZATION_PARAMETER["BOUNDARY"].get("SHARE_POOL", True)
+        REUSE_POOL = VISUALIZATION_PARAMETER["BOUNDARY"].get("REUSE_POOL", False)
         if PREPROCESS:
-            self.data_provider._meta_data()
-            if B_N_EPOCHS >0:
-                self.data_provider._estimate_boundary(LEN//10, l_bound=L_BOUND)
+            self.data_provider.initialize(LEN//10, l_bound=L_BOUND, estimate_boundary=B_N_EPOCHS > 0, share_pool=SHARE_POOL, reuse_pool=REUSE_POOL)
     
-    def _train(self):
+    def _complexes(self):
+        """
+        complex of every epoch in training order, they do not depend on the visualization model and can be built ahead of training
+        :return: generator of (iteration, neighbor preserving rate to the previous epoch (None for the first one), complex, construction time)
+        """
         EPOCH_START = self.config["EPOCH_START"]
         EPOCH_END = self.config["EPOCH_END"]
         EPOCH_PERIOD = self.config["EPOCH_PERIOD"]
+        VISUALIZATION_PARAMETER = self.config["VISUALIZATION"]
+        B_N_EPOCHS = VISUALIZATION_PARAMETER["BOUNDARY"]["B_N_EPOCHS"]
+        S_N_EPOCHS = VISUALIZATION_PARAMETER["S_N_EPOCHS"]
+        N_NEIGHBORS = VISUALIZATION_PARAMETER["N_NEIGHBORS"]
+
+        for iteration in range(EPOCH_START, EPOCH_END+EPOCH_PERIOD, EPOCH_PERIOD):
+            if iteration == EPOCH_START:
+                npr = None
+            else:
+                # TODO AL mode, redefine train_representation
+                prev_data = self.data_provider.train_representation(iteration-EPOCH_PERIOD)
+                curr_data = self.data_provider.train_representation(iteration)
+                npr = find_neighbor_preserving_rate(prev_data, curr_data, N_NEIGHBORS)
+            # Define Edge dataset
+            t0 = time.time()
+            spatial_cons = SingleEpochSpatialEdgeConstructor(self.data_provider, iteration, S_N_EPOCHS, B_N_EPOCHS, N_NEIGHBORS)
+
+            def build():
+                edge_to, edge_from, probs, feature_vectors, attention = spatial_cons.construct()
+                probs = probs / (probs.max()+1e-3)
+                eliminate_zeros = probs>1e-3
+                edge_to = edge_to[eliminate_zeros]
+                edge_from = edge_from[eliminate_zeros]
+                probs = probs[eliminate_zeros]
+                return {"edge_to": edge_to, "edge_from": edge_from, "probs": probs, "feature_vectors": feature_vectors, "attention": attention}
+
+            params = {"S_N_EPOCHS": S_N_EPOCHS, "B_N_EPOCHS": B_N_EPOCHS, "N_NEIGHBORS": N_NEIGHBORS, "ITERATION": iteration}
+            complex, _ = self._cached_complex(params, [iteration], build)
+            t1 = time.time()
+            yield iteration, npr, complex, t1-t0
+
+    def _train(self):
         VISUALIZATION_PARAMETER = self.config["VISUALIZATION"]
         LAMBDA1 = VISUALIZATION_PARAMETER["LAMBDA1"]
         LAMBDA2 = VISUALIZATION_PARAMETER["LAMBDA2"]
         ENCODER_DIMS = VISUALIZATION_PARAMETER["ENCODER_DIMS"]
         DECODER_DIMS = VISUALIZATION_PARAMETER["DECODER_DIMS"]
-        B_N_EPOCHS = VISUALIZATION_PARAMETER["BOUNDARY"]["B_N_EPOCHS"]
         S_N_EPOCHS = VISUALIZATION_PARAMETER["S_N_EPOCHS"]
-        N_NEIGHBORS = VISUALIZATION_PARAMETER["N_NEIGHBORS"]
         PATIENT = VISUALIZATION_PARAMETER["PATIENT"]
         MAX_EPOCH = VISUALIZATION_PARAMETER["MAX_EPOCH"]
         VIS_MODEL_NAME = VISUALIZATION_PARAMETER["VIS_MODEL_NAME"]
+        # number of complexes built ahead of training, 0 to build them in turn
+        PREFETCH = VISUALIZATION_PARAMETER.get("PREFETCH", 1)
         
-        start_flag = 1
         prev_model = VisModel(ENCODER_DIMS, DECODER_DIMS)
         prev_model.load_state_dict(self.model.state_dict())
         for param in prev_model.parameters():
             param.requires_grad = False
         w_prev = dict(self.model.named_parameters())
 
-        for iteration in range(EPOCH_START, EPOCH_END+EPOCH_PERIOD, EPOCH_PERIOD):
+        for iteration, npr, complex, construction_time in prefetch(self._complexes(), depth=PREFETCH):
             # Define DVI Loss
-            if start_flag:
+            if npr is None:
                 criterion = DVILoss(self.umap_fn, self.recon_fn, self.temporal_fn, lambd1=LAMBDA1, lambd2=0.0)
-                start_flag = 0
             else:
-                # TODO AL mode, redefine train_representation
-                prev_data = self.data_provider.train_representation(iteration-EPOCH_PERIOD)
-                curr_data = self.data_provider.train_representation(iteration)
-                npr = find_neighbor_preserving_rate(prev_data, curr_data, N_NEIGHBORS)
                 criterion = DVILoss(self.umap_fn, self.recon_fn, self.temporal_fn, lambd1=LAMBDA1, lambd2=LAMBDA2*npr)
             # Define training parameters
             optimizer = torch.optim.Adam(self.model.parameters(), lr=.01, weight_decay=1e-5)
             lr_scheduler = torch.optim.lr_scheduler.StepLR(optimizer, step_size=4, gamma=.1)
-            # Define Edge dataset
-            t0 = time.time()
-            spatial_cons = SingleEpochSpatialEdgeConstructor(self.data_provider, iteration, S_N_EPOCHS, B_N_EPOCHS, N_NEIGHBORS)
-            edge_to, edge_from, probs, feature_vectors, attention = spatial_cons.construct()
-            t1 = time.time()
-
-            probs = probs / (probs.max()+1e-3)
-            eliminate_zeros = probs>1e-3
-            edge_to = edge_to[eliminate_zeros]
-            edge_from = edge_from[eliminate_zeros]
-            probs = probs[eliminate_zeros]
-            
-            dataset = DVIDataHandler(edge_to, edge_from, feature_vectors, attention, w_prev)
+            edge_to, edge_from, probs, feature_vectors, attention = complex["edge_to"], complex["edge_from"], complex["probs"], complex["feature_vectors"], complex["attention"]
 
             n_samples = int(np.sum(S_N_EPOCHS * probs) // 1)
-            # chose sampler based on the number of dataset
-            if len(edge_to) > 2^24:
-                sampler = CustomWeightedRandomSampler(probs, n_samples, replacement=True)
-            else:
-                sampler = WeightedRandomSampler(probs, n_samples, replacement=True)
-            edge_loader = DataLoader(dataset, batch_size=1000, sampler=sampler)
+            edge_loader = EdgeLoader(edge_to, edge_from, probs, feature_vectors, attention, n_samples, batch_size=1000)
 
             ########################################################################################################################
             #                                                       TRAIN                                                          #
@@ -231,7 +273,7 @@ class DeepVisualInsight(StrategyAbstractClass):
 
             # save result
             save_dir = self.data_provider.model_path
-            trainer.record_time(save_dir, "time_{}.json".format(VIS_MODEL_NAME), "complex_construction", str(iteration), t1-t0)
+            trainer.record_time(save_dir, "time_{}.json".format(VIS_MODEL_NAME), "complex_construction", str(iteration), construction_time)
             trainer.record_time(save_dir, "time_{}.json".format(VIS_MODEL_NAME), "training", str(iteration), t3-t2)
             save_dir = os.path.join(self.data_provider.model_path, "Epoch_{}".format(iteration))
             trainer.save(save_dir=save_dir, file_name="{}".format(VIS_MODEL_NAME))
@@ -318,10 +360,10 @@ class tfDeepVisualInsight(StrategyAbstractClass):
         VISUALIZATION_PARAMETER = self.config["VISUALIZATION"]
         B_N_EPOCHS = VISUALIZATION_PARAMETER["BOUNDARY"]["B_N_EPOCHS"]
         L_BOUND = VISUALIZATION_PARAMETER["BOUNDARY"]["L_BOUND"]
+        SHARE_POOL = VISUALIZATION_PARAMETER["BOUNDARY"].get("SHARE_POOL", True)
+        REUSE_POOL = VISUALIZATION_PARAMETER["BOUNDARY"].get("REUSE_POOL", False)
         if PREPROCESS:
-            self.data_provider._meta_data()
-            if B_N_EPOCHS >0:
-                self.data_provider._estimate_boundary(LEN//10, l_bound=L_BOUND)
+            self.data_provider.initialize(LEN//10, l_bound=L_BOUND, estimate_boundary=B_N_EPOCHS > 0, share_pool=SHARE_POOL, reuse_pool=REUSE_POOL)
     
     def _train(self):
         EPOCH_START = self.config["EPOCH_START"]
@@ -383,15 +425,21 @@ class tfDeepVisualInsight(StrategyAbstractClass):
         ]
         # edge constructor
         spatial_cons = tfEdgeConstructor(self.data_provider, S_N_EPOCHS, B_N_EPOCHS, N_NEIGHBORS)
-
+        # number of complexes built ahead of training, 0 to build them in turn
+        PREFETCH = VISUALIZATION_PARAMETER.get("PREFETCH", 1)
+
+        def complexes():
+            # complexes do not depend on the visualization model, only prev_trainable_variables carries over
+            for iteration in range(EPOCH_START, EPOCH_END+EPOCH_PERIOD, EPOCH_PERIOD):
+                t0 = time.time()
+                outputs = spatial_cons.construct(iteration-EPOCH_PERIOD, iteration)
+                t1 = time.time()
+                yield iteration, outputs, t1-t0
         
-        for iteration in range(EPOCH_START, EPOCH_END+EPOCH_PERIOD, EPOCH_PERIOD):
+        for iteration, (edge_to, edge_from, probs, feature_vectors, attention, n_rate), construction_time in prefetch(complexes(), depth=PREFETCH):
             self.model.compile(
                 optimizer=optimizer, loss=losses, loss_weights=loss_weights,
             )
-            t0 = time.time()
-            edge_to, edge_from, probs, feature_vectors, attention, n_rate = spatial_cons.construct(iteration-EPOCH_PERIOD, iteration)
-            t1 = time.time()
             edge_dataset = construct_edge_dataset(edge_to, edge_from, probs, feature_vectors, attention, n_rate, BATCH_SIZE)
             steps_per_epoch = int(
                 len(edge_to) / BATCH_SIZE / 10
@@ -416,7 +464,7 @@ class tfDeepVisualInsight(StrategyAbstractClass):
             # save time result
             # TODO
             # save_dir = self.data_provider.model_path
-            # trainer.record_time(save_dir, "time_{}.json".format(VIS_MODEL_NAME), "complex_construction", str(iteration), t1-t0)
+            # trainer.record_time(save_dir, "time_{}.json".format(VIS_MODEL_NAME), "complex_construction", str(iteration), construction_time)
             # trainer.record_time(save_dir, "time_{}.json".format(VIS_MODEL_NAME), "training", str(iteration), t3-t2)
     
     def _visualize(self):
@@ -505,10 +553,10 @@ class TimeVis(StrategyAbstractClass):
         VISUALIZATION_PARAMETER = self.config["VISUALIZATION"]
         B_N_EPOCHS = VISUALIZATION_PARAMETER["BOUNDARY"]["B_N_EPOCHS"]
         L_BOUND = VISUALIZATION_PARAMETER["BOUNDARY"]["L_BOUND"]
+        SHARE_POOL = VISUALIZATION_PARAMETER["BOUNDARY"].get("SHARE_POOL", True)
+        REUSE_POOL = VISUALIZATION_PARAMETER["BOUNDARY"].get("REUSE_POOL", False)
         if PREPROCESS:
-            self.data_provider._meta_data()
-            if B_N_EPOCHS >0:
-                self.data_provider._estimate_boundary(LEN//10, l_bound=L_BOUND)
+            self.data_provider.initialize(LEN//10, l_bound=L_BOUND, estimate_boundary=B_N_EPOCHS > 0, share_pool=SHARE_POOL, reuse_pool=REUSE_POOL)
     
     def _train(self):
         VISUALIZATION_PARAMETER = self.config["VISUALIZATION"]
@@ -528,29 +576,30 @@ class TimeVis(StrategyAbstractClass):
         lr_scheduler = torch.optim.lr_scheduler.StepLR(optimizer, step_size=4, gamma=.1)
 
         t0 = time.time()
-        spatial_cons = kcSpatialEdgeConstructor(data_provider=self.data_provider, init_num=INIT_NUM, s_n_epochs=S_N_EPOCHS, b_n_epochs=B_N_EPOCHS, n_neighbors=N_NEIGHBORS, MAX_HAUSDORFF=MAX_HAUSDORFF, ALPHA=ALPHA, BETA=BETA)
-        s_edge_to, s_edge_from, s_probs, feature_vectors, time_step_nums, time_step_idxs_list, knn_indices, sigmas, rhos, attention = spatial_cons.construct()
-        temporal_cons = GlobalTemporalEdgeConstructor(X=feature_vectors, time_step_nums=time_step_nums, sigmas=sigmas, rhos=rhos, n_neighbors=N_NEIGHBORS, n_epochs=T_N_EPOCHS)
-        t_edge_to, t_edge_from, t_probs = temporal_cons.construct()
-        t1 = time.time()
+        def build():
+            spatial_cons = kcSpatialEdgeConstructor(data_provider=self.data_provider, init_num=INIT_NUM, s_n_epochs=S_N_EPOCHS, b_n_epochs=B_N_EPOCHS, n_neighbors=N_NEIGHBORS, MAX_HAUSDORFF=MAX_HAUSDORFF, ALPHA=ALPHA, BETA=BETA)
+            s_edge_to, s_edge_from, s_probs, feature_vectors, time_step_nums, time_step_idxs_list, knn_indices, sigmas, rhos, attention = spatial_cons.construct()
+            temporal_cons = GlobalTemporalEdgeConstructor(X=feature_vectors, time_step_nums=time_step_nums, sigmas=sigmas, rhos=rhos, n_neighbors=N_NEIGHBORS, n_epochs=T_N_EPOCHS)
+            t_edge_to, t_edge_from, t_probs = temporal_cons.construct()
 
-        edge_to = np.concatenate((s_edge_to, t_edge_to),axis=0)
-        edge_from = np.concatenate((s_edge_from, t_edge_from), axis=0)
-        probs = np.concatenate((s_probs, t_probs), axis=0)
-        probs = probs / (probs.max()+1e-3)
-        eliminate_zeros = probs>1e-3
-        edge_to = edge_to[eliminate_zeros]
-        edge_from = edge_from[eliminate_zeros]
-        probs = probs[eliminate_zeros]
+            edge_to = np.concatenate((s_edge_to, t_edge_to),axis=0)
+            edge_from = np.concatenate((s_edge_from, t_edge_from), axis=0)
+            probs = np.concatenate((s_probs, t_probs), axis=0)
+            probs = probs / (probs.max()+1e-3)
+            eliminate_zeros = probs>1e-3
+            edge_to = edge_to[eliminate_zeros]
+            edge_from = edge_from[eliminate_zeros]
+            probs = probs[eliminate_zeros]
+            return {"edge_to": edge_to, "edge_from": edge_from, "probs": probs, "feature_vectors": feature_vectors, "attention": attention}
+
+        s, e, p = self.data_provider.s, self.data_provider.e, self.data_provider.p
+        params = {"INIT_NUM": INIT_NUM, "MAX_HAUSDORFF": MAX_HAUSDORFF, "ALPHA": ALPHA, "BETA": BETA, "S_N_EPOCHS": S_N_EPOCHS, "B_N_EPOCHS": B_N_EPOCHS, "T_N_EPOCHS": T_N_EPOCHS, "N_NEIGHBORS": N_NEIGHBORS, "EPOCHS": [s, e, p]}
+        complex, _ = self._cached_complex(params, range(s, e+1, p), build)
+        edge_to, edge_from, probs, feature_vectors, attention = complex["edge_to"], complex["edge_from"], complex["probs"], complex["feature_vectors"], complex["attention"]
+        t1 = time.time()
 
-        dataset = DataHandler(edge_to, edge_from, feature_vectors, attention)
         n_samples = int(np.sum(S_N_EPOCHS * probs) // 1)
-        # chose sampler based on the number of dataset
-        if len(edge_to) > 2^24:
-            sampler = CustomWeightedRandomSampler(probs, n_samples, replacement=True)
-        else:
-            sampler = WeightedRandomSampler(probs, n_samples, replacement=True)
-        edge_loader = DataLoader(dataset, batch_size=1000, sampler=sampler)
+        edge_loader = EdgeLoader(edge_to, edge_from, probs, feature_vectors, attention, n_samples, batch_size=1000)
 
         ########################################################################################################################
         #                                                       TRAIN                                                          #
@@ -658,10 +707,10 @@ class DeepDebugger(StrategyAbstractClass):
         VISUALIZATION_PARAMETER = self.config["VISUALIZATION"]
         B_N_EPOCHS = VISUALIZATION_PARAMETER["BOUNDARY"]["B_N_EPOCHS"]
         L_BOUND = VISUALIZATION_PARAMETER["BOUNDARY"]["L_BOUND"]
+        SHARE_POOL = VISUALIZATION_PARAMETER["BOUNDARY"].get("SHARE_POOL", True)
+        REUSE_POOL = VISUALIZATION_PARAMETER["BOUNDARY"].get("REUSE_POOL", False)
         if PREPROCESS:
-            self.data_provider._meta_data()
-            if B_N_EPOCHS >0:
-                self.data_provider._estimate_boundary(LEN//10, l_bound=L_BOUND)
+            self.data_provider.initialize(LEN//10, l_bound=L_BOUND, estimate_boundary=B_N_EPOCHS > 0, share_pool=SHARE_POOL, reuse_pool=REUSE_POOL)
     
     def _segment(self):
         VISUALIZATION_PARAMETER = self.config["VISUALIZATION"]
@@ -673,7 +722,13 @@ class DeepDebugger(StrategyAbstractClass):
         self.segmenter.record_time(self.data_provider.model_path, "time_{}.json".format(VIS_MODEL_NAME), t1-t0)
         print("Segmentation takes {:.1f} seconds.".format(round(t1-t0, 3)))
     
-    def _train(self):
+    def _complexes(self):
+        """
+        complex of every segment in training order, from the last segment to the first one
+        a complex depends on the previous one (selected idxs, c0 and d0) but not on the visualization model,
+        init_embeddings are left to the consumer, see kcHybridSpatialEdgeConstructor.replay_embeddings
+        :return: generator of (seg, spatial edge constructor, complex, construction time)
+        """
         TRAINING_PARAMETER = self.config["TRAINING"]
         LEN = TRAINING_PARAMETER["train_num"]
         VISUALIZATION_PARAMETER = self.config["VISUALIZATION"]
@@ -686,49 +741,74 @@ class DeepDebugger(StrategyAbstractClass):
         S_N_EPOCHS = VISUALIZATION_PARAMETER["S_N_EPOCHS"]
         T_N_EPOCHS = VISUALIZATION_PARAMETER["T_N_EPOCHS"]
         N_NEIGHBORS = VISUALIZATION_PARAMETER["N_NEIGHBORS"]
-        PATIENT = VISUALIZATION_PARAMETER["PATIENT"]
-        MAX_EPOCH = VISUALIZATION_PARAMETER["MAX_EPOCH"]
-        VIS_MODEL_NAME = VISUALIZATION_PARAMETER["VIS_MODEL_NAME"]
-        
+
         prev_selected = np.random.choice(np.arange(LEN), size=INIT_NUM, replace=False)
-        prev_embedding = None
         start_point = len(SEGMENTS)-1
         c0=None
         d0=None
-
+        # complexes of later segments depend on the previous one through prev_selected, c0 and d0
+        prev_key = None
 
         for seg in range(start_point,-1,-1):
+            epoch_start, epoch_end = SEGMENTS[seg]
+            # a data provider of its own, the consumer may still be training on the previous segment,
+            # fork gives it its own store and subject state cache since neither is locked
+            data_provider = self.data_provider.fork()
+            data_provider.update_interval(epoch_s=epoch_start, epoch_e=epoch_end)
+
+            t0 = time.time()
+            spatial_cons = kcHybridSpatialEdgeConstructor(data_provider=data_provider, init_num=INIT_NUM, s_n_epochs=S_N_EPOCHS, b_n_epochs=B_N_EPOCHS, n_neighbors=N_NEIGHBORS, MAX_HAUSDORFF=MAX_HAUSDORFF, ALPHA=ALPHA, BETA=BETA, init_idxs=prev_selected, init_embeddings=None, c0=c0, d0=d0)
+
+            def build():
+                s_edge_to, s_edge_from, s_probs, feature_vectors, _, _, time_step_nums, time_step_idxs_list, knn_indices, sigmas, rhos, attention, (c0_t, d0_t) = spatial_cons.construct()
+                temporal_cons = GlobalTemporalEdgeConstructor(X=feature_vectors, time_step_nums=time_step_nums, sigmas=sigmas, rhos=rhos, n_neighbors=N_NEIGHBORS, n_epochs=T_N_EPOCHS)
+                t_edge_to, t_edge_from, t_probs = temporal_cons.construct()
+
+                edge_to = np.concatenate((s_edge_to, t_edge_to),axis=0)
+                edge_from = np.concatenate((s_edge_from, t_edge_from), axis=0)
+                probs = np.concatenate((s_probs, t_probs), axis=0)
+                probs = probs / (probs.max()+1e-3)
+                eliminate_zeros = probs>1e-3
+                edge_to = edge_to[eliminate_zeros]
+                edge_from = edge_from[eliminate_zeros]
+                probs = probs[eliminate_zeros]
+                return {"edge_to": edge_to, "edge_from": edge_from, "probs": probs, "feature_vectors": feature_vectors, "attention": attention,
+                        "time_step_nums": [list(nums) for nums in time_step_nums], "selected": np.asarray(time_step_idxs_list[0]), "c0": float(c0_t), "d0": float(d0_t)}
+
+            params = {"LEN": LEN, "INIT_NUM": INIT_NUM, "MAX_HAUSDORFF": MAX_HAUSDORFF, "ALPHA": ALPHA, "BETA": BETA, "S_N_EPOCHS": S_N_EPOCHS, "B_N_EPOCHS": B_N_EPOCHS, "T_N_EPOCHS": T_N_EPOCHS, "N_NEIGHBORS": N_NEIGHBORS,
+                      "SEGMENT": [epoch_start, epoch_end, self.data_provider.p], "PREV": prev_key}
+            complex, prev_key = self._cached_complex(params, range(epoch_start, epoch_end+1, self.data_provider.p), build)
+            c0, d0 = complex["c0"], complex["d0"]
+            prev_selected = complex["selected"]
+            t1 = time.time()
+            yield seg, spatial_cons, complex, t1-t0
+
+    def _train(self):
+        VISUALIZATION_PARAMETER = self.config["VISUALIZATION"]
+        SEGMENTS = self.segmenter.segments
+        S_N_EPOCHS = VISUALIZATION_PARAMETER["S_N_EPOCHS"]
+        PATIENT = VISUALIZATION_PARAMETER["PATIENT"]
+        MAX_EPOCH = VISUALIZATION_PARAMETER["MAX_EPOCH"]
+        VIS_MODEL_NAME = VISUALIZATION_PARAMETER["VIS_MODEL_NAME"]
+        # number of complexes built ahead of training, 0 to build them in turn
+        PREFETCH = VISUALIZATION_PARAMETER.get("PREFETCH", 1)
+
+        prev_embedding = None
+
+        for seg, spatial_cons, complex, construction_time in prefetch(self._complexes(), depth=PREFETCH):
             epoch_start, epoch_end = SEGMENTS[seg]
             self.data_provider.update_interval(epoch_s=epoch_start, epoch_e=epoch_end)
 
             optimizer = torch.optim.Adam(self.model.parameters(), lr=.01, weight_decay=1e-5)
             lr_scheduler = torch.optim.lr_scheduler.StepLR(optimizer, step_size=4, gamma=.1)
 
-            t0 = time.time()
-            spatial_cons = kcHybridSpatialEdgeConstructor(data_provider=self.data_provider, init_num=INIT_NUM, s_n_epochs=S_N_EPOCHS, b_n_epochs=B_N_EPOCHS, n_neighbors=N_NEIGHBORS, MAX_HAUSDORFF=MAX_HAUSDORFF, ALPHA=ALPHA, BETA=BETA, init_idxs=prev_selected, init_embeddings=prev_embedding, c0=c0, d0=d0)
-            s_edge_to, s_edge_from, s_probs, feature_vectors, embedded, coefficient, time_step_nums, time_step_idxs_list, knn_indices, sigmas, rhos, attention, (c0,d0) = spatial_cons.construct()
+            edge_to, edge_from, probs, feature_vectors, attention = complex["edge_to"], complex["edge_from"], complex["probs"], complex["feature_vectors"], complex["attention"]
+            # the embeddings of the previous segment are only known now
+            spatial_cons.init_embeddings = prev_embedding
+            embedded, coefficient = spatial_cons.replay_embeddings(complex["time_step_nums"])
 
-            temporal_cons = GlobalTemporalEdgeConstructor(X=feature_vectors, time_step_nums=time_step_nums, sigmas=sigmas, rhos=rhos, n_neighbors=N_NEIGHBORS, n_epochs=T_N_EPOCHS)
-            t_edge_to, t_edge_from, t_probs = temporal_cons.construct()
-            t1 = time.time()
-
-            edge_to = np.concatenate((s_edge_to, t_edge_to),axis=0)
-            edge_from = np.concatenate((s_edge_from, t_edge_from), axis=0)
-            probs = np.concatenate((s_probs, t_probs), axis=0)
-            probs = probs / (probs.max()+1e-3)
-            eliminate_zeros = probs>1e-3
-            edge_to = edge_to[eliminate_zeros]
-            edge_from = edge_from[eliminate_zeros]
-            probs = probs[eliminate_zeros]
-
-            dataset = HybridDataHandler(edge_to, edge_from, feature_vectors, attention, embedded, coefficient)
             n_samples = int(np.sum(S_N_EPOCHS * probs) // 1)
-            # chose sampler based on the number of dataset
-            if len(edge_to) > 2^24:
-                sampler = CustomWeightedRandomSampler(probs, n_samples, replacement=True)
-            else:
-                sampler = WeightedRandomSampler(probs, n_samples, replacement=True)
-            edge_loader = DataLoader(dataset, batch_size=1000, sampler=sampler)
+            edge_loader = HybridEdgeLoader(edge_to, edge_from, probs, feature_vectors, attention, embedded, coefficient, n_samples, batch_size=1000)
 
             ########################################################################################################################
             #                                                       TRAIN                                                          #
@@ -741,15 +821,14 @@ class DeepDebugger(StrategyAbstractClass):
             t3 = time.time()
 
             file_name = "time_{}".format(VIS_MODEL_NAME)
-            trainer.record_time(self.data_provider.model_path, file_name, "complex_construction", seg, t1-t0)
+            trainer.record_time(self.data_provider.model_path, file_name, "complex_construction", seg, construction_time)
             trainer.record_time(self.data_provider.model_path, file_name, "training", seg, t3-t2)
 
             trainer.save(save_dir=self.data_provider.model_path, file_name="{}_{}".format(VIS_MODEL_NAME, seg))
             self.model = trainer.model
 
-            # update prev_idxs and prev_embedding
-            prev_selected = time_step_idxs_list[0]
-            prev_data = torch.from_numpy(feature_vectors[:len(prev_selected)]).to(dtype=torch.float32, device=self.DEVICE)
+            # update prev_embedding, prev_idxs are carried over by _complexes
+            prev_data = torch.from_numpy(feature_vectors[:len(complex["selected"])]).to(dtype=torch.float32, device=self.DEVICE)
             self.model = self.model.to(device=self.DEVICE)
             prev_embedding = self.model.encoder(prev_data).cpu().detach().numpy()
     
@@ -825,12 +904,12 @@ class DVIAL(StrategyAbstractClass):
         PREPROCESS = self.config["VISUALIZATION"]["PREPROCESS"]
         B_N_EPOCHS = self.config["VISUALIZATION"]["BOUNDARY"]["B_N_EPOCHS"]
         L_BOUND = self.config["VISUALIZATION"]["BOUNDARY"]["L_BOUND"]
+        SHARE_POOL = self.config["VISUALIZATION"]["BOUNDARY"].get("SHARE_POOL", True)
+        REUSE_POOL = self.config["VISUALIZATION"]["BOUNDARY"].get("REUSE_POOL", False)
 
         if PREPROCESS:
-            self.data_provider._meta_data(iteration)
             LEN = len(self.data_provider.train_labels(iteration))
-            if B_N_EPOCHS >0:
-                self.data_provider._estimate_boundary(iteration, LEN//10, l_bound=L_BOUND)
+            self.data_provider.initialize_iteration(iteration, LEN//10, l_bound=L_BOUND, estimate_boundary=B_N_EPOCHS > 0, share_pool=SHARE_POOL, reuse_pool=REUSE_POOL)
 
     def _train(self, iteration):
         S_N_EPOCHS = self.config["VISUALIZATION"]["S_N_EPOCHS"]
@@ -852,14 +931,8 @@ class DVIAL(StrategyAbstractClass):
 
         spatial_cons.record_time(self.data_provider.model_path, "time_{}".format(VIS_MODEL_NAME), "complex_construction", t1-t0)
 
-        dataset = DataHandler(edge_to, edge_from, feature_vectors, attention)
         n_samples = int(np.sum(S_N_EPOCHS * probs) // 1)
-        # chosse sampler based on the number of dataset
-        if len(edge_to) > 2^24:
-            sampler = CustomWeightedRandomSampler(probs, n_samples, replacement=True)
-        else:
-            sampler = WeightedRandomSampler(probs, n_samples, replacement=True)
-        edge_loader = DataLoader(dataset, batch_size=1024, sampler=sampler)
+        edge_loader = EdgeLoader(edge_to, edge_from, probs, feature_vectors, attention, n_samples, batch_size=1024)
 
         negative_sample_rate = 5
         min_dist = .1
@@ -959,12 +1032,12 @@ class tfDVIDenseAL(DenseAL):
         PREPROCESS = self.config["VISUALIZATION"]["PREPROCESS"]
         B_N_EPOCHS = self.config["VISUALIZATION"]["BOUNDARY"]["B_N_EPOCHS"]
         L_BOUND = self.config["VISUALIZATION"]["BOUNDARY"]["L_BOUND"]
+        SHARE_POOL = self.config["VISUALIZATION"]["BOUNDARY"].get("SHARE_POOL", True)
+        REUSE_POOL = self.config["VISUALIZATION"]["BOUNDARY"].get("REUSE_POOL", False)
 
         if PREPROCESS:
-            self.data_provider._meta_data(iteration)
             LEN = len(self.data_provider.train_labels(iteration))
-            if B_N_EPOCHS >0:
-                self.data_provider._estimate_boundary(iteration, LEN//10, l_bound=L_BOUND)
+            self.data_provider.initialize_iteration(iteration, LEN//10, l_bound=L_BOUND, estimate_boundary=B_N_EPOCHS > 0, share_pool=SHARE_POOL, reuse_pool=REUSE_POOL)
 
     def _train(self, iteration):
         # TODO
@@ -1031,12 +1104,12 @@ class TimeVisDenseAL(DenseAL):
         PREPROCESS = self.config["VISUALIZATION"]["PREPROCESS"]
         B_N_EPOCHS = self.config["VISUALIZATION"]["BOUNDARY"]["B_N_EPOCHS"]
         L_BOUND = self.config["VISUALIZATION"]["BOUNDARY"]["L_BOUND"]
+        SHARE_POOL = self.config["VISUALIZATION"]["BOUNDARY"].get("SHARE_POOL", True)
+        REUSE_POOL = self.config["VISUALIZATION"]["BOUNDARY"].get("REUSE_POOL", False)
 
         if PREPROCESS:
-            self.data_provider._meta_data(iteration)
             LEN = len(self.data_provider.train_labels(iteration))
-            if B_N_EPOCHS >0:
-                self.data_provider._estimate_boundary(iteration, LEN//10, l_bound=L_BOUND)
+            self.data_provider.initialize_iteration(iteration, LEN//10, l_bound=L_BOUND, estimate_boundary=B_N_EPOCHS > 0, share_pool=SHARE_POOL, reuse_pool=REUSE_POOL)
 
     def _train(self, iteration):
         # TODO
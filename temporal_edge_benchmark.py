@@ -0,0 +1,226 @@
+"""Benchmark the temporal edge constructors on synthetic data and check their edges against the per-sample reference"""
+import time
+import argparse
+
+import numpy as np
+from umap.umap_ import compute_membership_strengths
+
+from singleVis.backend import get_graph_elements
+from singleVis.temporal_edge_constructor import LocalTemporalEdgeConstructor, GlobalTemporalEdgeConstructor, GlobalParallelTemporalEdgeConstructor, knn_dists
+
+########################################################################################################################
+#                                                 REFERENCE IMPLEMENTATIONS                                            #
+########################################################################################################################
+class LoopGlobalTemporalEdgeConstructor(GlobalTemporalEdgeConstructor):
+    '''per-sample GlobalTemporalEdgeConstructor.construct before vectorization'''
+    def construct(self):
+        base_idx = 0
+        base_idx_list = list()
+        for i in self.time_step_nums:
+            base_idx_list.append(base_idx)
+            base_idx = base_idx + i[0] + i[1]
+        base_idx_list = np.array(base_idx_list, dtype=int)
+
+        valid_idx_list = list()
+        for i in range(len(self.time_step_nums)):
+            valid_idx_list.append(base_idx_list[i]+self.time_step_nums[i][0])
+        valid_idx_list = np.array(valid_idx_list, dtype=int)
+
+        num = len(self.features)
+        indices = - np.ones((num, self.n_neighbors), dtype=int)
+        dists = np.zeros((num, self.n_neighbors), dtype=np.float32)
+
+        for time_step in range(self.time_steps):
+            start_idx = base_idx_list[time_step]
+            end_idx = start_idx + self.time_step_nums[time_step][0] - 1
+            move_positions = base_idx_list - start_idx
+            for train_sample_idx in range(start_idx, end_idx + 1, 1):
+                candidate_idxs = train_sample_idx + move_positions
+                candidate_idxs = candidate_idxs[np.logical_and(candidate_idxs>=base_idx_list, candidate_idxs<valid_idx_list)]
+                nn_dist = knn_dists(self.features, [train_sample_idx], candidate_idxs).squeeze(axis=0)
+                order = np.argsort(nn_dist)
+                top_k_idxs = candidate_idxs[order<self.n_neighbors]
+                top_k_idxs = np.pad(top_k_idxs, (0, self.n_neighbors-len(top_k_idxs)), 'constant', constant_values=-1).astype('int')
+                top_k_dists = nn_dist[order<self.n_neighbors]
+                top_k_dists = np.pad(top_k_dists, (0, self.n_neighbors-len(top_k_dists)), 'constant', constant_values=0.).astype(np.float32)
+                indices[train_sample_idx] = top_k_idxs
+                dists[train_sample_idx] = top_k_dists
+
+        rows, cols, vals, _ = compute_membership_strengths(indices, dists, self.sigmas, self.rhos, return_dists=False)
+        time_complex = self.temporal_simplicial_set(rows=rows, cols=cols, vals=vals, n_vertice=num)
+        _, heads, tails, weights, _ = get_graph_elements(time_complex, n_epochs=self.n_epochs)
+        return heads, tails, weights
+
+
+class LoopGlobalParallelTemporalEdgeConstructor(GlobalParallelTemporalEdgeConstructor):
+    '''per-point GlobalParallelTemporalEdgeConstructor.construct before the inverse index'''
+    def construct(self):
+        base_idx = 0
+        base_idx_list = list()
+        for i in self.time_step_nums:
+            base_idx_list.append(base_idx)
+            base_idx = base_idx + i[0] + i[1]
+        base_idx_list = np.array(base_idx_list, dtype=int)
+
+        num = len(self.features)
+        indices = - np.ones((num, self.n_neighbors), dtype=int)
+        dists = np.zeros((num, self.n_neighbors), dtype=np.float32)
+
+        for time_step in range(self.time_steps):
+            for point_idx in range(len(self.selected_idxs[time_step])):
+                true_idx = self.selected_idxs[time_step][point_idx]
+                identical_self = list()
+                for e in range(self.time_steps):
+                    arg = np.argwhere(self.selected_idxs[e]==true_idx)
+                    if arg.shape[0]:
+                        target_idx = arg[0][0]
+                        identical_self.append(base_idx_list[e]+target_idx)
+                if len(identical_self) >0:
+                    curr_idx = base_idx_list[time_step]+point_idx
+                    candidate_idxs = np.array(identical_self)
+                    nn_dist = knn_dists(self.features, [curr_idx], candidate_idxs).squeeze(axis=0)
+                    order = np.argsort(nn_dist)
+                    top_k_idxs = candidate_idxs[order<self.n_neighbors]
+                    top_k_idxs = np.pad(top_k_idxs, (0, self.n_neighbors-len(top_k_idxs)), 'constant', constant_values=-1).astype('int')
+                    top_k_dists = nn_dist[order<self.n_neighbors]
+                    top_k_dists = np.pad(top_k_dists, (0, self.n_neighbors-len(top_k_dists)), 'constant', constant_values=0.).astype(np.float32)
+                    indices[curr_idx] = top_k_idxs
+                    dists[curr_idx] = top_k_dists
+
+        rows, cols, vals, _ = compute_membership_strengths(indices, dists, self.sigmas, self.rhos, return_dists=False)
+        time_complex = self.temporal_simplicial_set(rows=rows, cols=cols, vals=vals, n_vertice=num)
+        _, heads, tails, weights, _ = get_graph_elements(time_complex, n_epochs=self.n_epochs)
+        return heads, tails, weights
+
+
+class LoopLocalTemporalEdgeConstructor(LocalTemporalEdgeConstructor):
+    '''LocalTemporalEdgeConstructor.construct over full n_all x n_neighbors arrays per (window, step)'''
+    def construct(self):
+        rows = np.zeros(1, dtype=np.int32)
+        cols = np.zeros(1, dtype=np.int32)
+        vals = np.zeros(1, dtype=np.float32)
+
+        n_all = 0
+        time_step_num = list()
+        for i in self.time_step_nums:
+            time_step_num.append(n_all)
+            n_all = n_all + i[0]
+        n_all = 0
+        all_step_num = list()
+        for i in self.time_step_nums:
+            all_step_num.append(n_all)
+            n_all = n_all + i[0] + i[1]
+
+        for window in range(1, self.persistence + 1, 1):
+            for step in range(0, self.time_steps - window, 1):
+                knn_indices_in = - np.ones((n_all, self.n_neighbors))
+                knn_dist = np.zeros((n_all, self.n_neighbors))
+                next_knn = self.knn_indices[time_step_num[step+window]:time_step_num[step+window] + self.time_step_nums[step + window][0]]
+                increase_idx = all_step_num[step]
+                for i in range(len(self.time_step_idxs_list[step+window])):
+                    knn_indices_in[increase_idx + self.time_step_idxs_list[step+window][i]]=next_knn[i]
+                knn_indices_in = knn_indices_in.astype('int')
+                indices = np.arange(all_step_num[step], all_step_num[step] + self.time_step_nums[step][0], 1)[self.time_step_idxs_list[step+window]]
+                knn_dists_t = knn_dists(self.features, indices, next_knn)
+                for i in range(len(self.time_step_idxs_list[step+window])):
+                    knn_dist[increase_idx + self.time_step_idxs_list[step+window][i]]=knn_dists_t[i]
+                knn_dist = knn_dist.astype('float32')
+                rows_t, cols_t, vals_t, _ = compute_membership_strengths(knn_indices_in, knn_dist, self.sigmas, self.rhos, return_dists=False)
+                idxs = vals_t > 0
+                rows = np.concatenate((rows, rows_t[idxs]), axis=0)
+                cols = np.concatenate((cols, cols_t[idxs]), axis=0)
+                vals = np.concatenate((vals, vals_t[idxs]), axis=0)
+        for window in range(1, self.persistence + 1, 1):
+            for step in range(self.time_steps-1, 0 + window, -1):
+                knn_indices_in = - np.ones((n_all, self.n_neighbors))
+                knn_dist = np.zeros((n_all, self.n_neighbors))
+                prev_knn = self.knn_indices[time_step_num[step-window]:time_step_num[step-window] + self.time_step_nums[step-window][0]]
+                knn_indices_in[all_step_num[step]: all_step_num[step] + self.time_step_nums[step][0]] = prev_knn[self.time_step_idxs_list[step]]
+                knn_indices_in = knn_indices_in.astype('int')
+                indices = np.arange(all_step_num[step], all_step_num[step] + self.time_step_nums[step][0], 1)
+                knn_dists_t = knn_dists(self.features, indices, prev_knn[self.time_step_idxs_list[step]])
+                knn_dist[all_step_num[step]:all_step_num[step] + self.time_step_nums[step][0]] = knn_dists_t
+                knn_dist = knn_dist.astype('float32')
+                rows_t, cols_t, vals_t, _ = compute_membership_strengths(knn_indices_in, knn_dist, self.sigmas, self.rhos, return_dists=False)
+                idxs = vals_t > 0
+                rows = np.concatenate((rows, rows_t[idxs]), axis=0)
+                cols = np.concatenate((cols, cols_t[idxs]), axis=0)
+                vals = np.concatenate((vals, vals_t[idxs]), axis=0)
+        time_complex = self.temporal_simplicial_set(rows=rows, cols=cols, vals=vals, n_vertice=len(self.features))
+        _, heads, tails, weights, _ = get_graph_elements(time_complex, n_epochs=self.n_epochs)
+        return heads, tails, weights
+
+########################################################################################################################
+#                                                    SYNTHETIC DATA                                                    #
+########################################################################################################################
+def synthetic_complex(time_steps, train_num, border_num, dim, seed=0):
+    """
+    feature vectors of a spatio-temporal complex, the number of selected samples shrinks along time like k-center selections
+    :return: features, time_step_nums, sigmas, rhos
+    """
+    rng = np.random.RandomState(seed)
+    time_step_nums = list()
+    for t in range(time_steps):
+        time_step_nums.append((int(train_num * (1 - 0.5 * t / max(time_steps - 1, 1))), border_num))
+    num = sum(t_num + b_num for t_num, b_num in time_step_nums)
+    features = rng.normal(size=(num, dim)).astype(np.float32)
+    sigmas = rng.uniform(0.5, 2., size=num).astype(np.float32)
+    rhos = rng.uniform(0., 0.5, size=num).astype(np.float32)
+    return features, time_step_nums, sigmas, rhos
+
+
+def synthetic_selections(time_step_nums, pool_num, seed=0):
+    """independent selections of every time step from a pool of pool_num samples, as parallel k-center selection does"""
+    rng = np.random.RandomState(seed)
+    return [rng.choice(pool_num, size=t_num, replace=False) for t_num, _ in time_step_nums]
+
+
+def synthetic_spatial_knn(time_step_nums, n_neighbors, seed=0):
+    """
+    spatial knn of the training points of every time step and the index lists linking each time step to the previous one
+    :return: knn_indices, time_step_idxs_list
+    """
+    rng = np.random.RandomState(seed)
+    knn_indices = list()
+    time_step_idxs_list = list()
+    base_idx = 0
+    prev_num = time_step_nums[0][0]
+    for t_num, b_num in time_step_nums:
+        knn_indices.append(rng.randint(base_idx, base_idx + t_num + b_num, size=(t_num, n_neighbors)))
+        time_step_idxs_list.append(rng.choice(prev_num, size=t_num, replace=False).tolist())
+        base_idx = base_idx + t_num + b_num
+        prev_num = t_num
+    return np.concatenate(knn_indices, axis=0), time_step_idxs_list
+
+
+def compare(name, reference, candidate):
+    t0 = time.time()
+    ref_edges = reference.construct()
+    t1 = time.time()
+    new_edges = candidate.construct()
+    t2 = time.time()
+    identical = all(np.array_equal(a, b) for a, b in zip(ref_edges, new_edges))
+    print("{}:\treference {:.2f}s\tvectorized {:.2f}s\tspeedup {:.1f}x\tidentical edges: {}".format(name, t1-t0, t2-t1, (t1-t0)/max(t2-t1, 1e-6), identical))
+    return identical
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark temporal edge constructors...')
+    parser.add_argument('--time_steps', type=int, default=10)
+    parser.add_argument('--train_num', type=int, default=5000)
+    parser.add_argument('--border_num', type=int, default=500)
+    parser.add_argument('--dim', type=int, default=512)
+    parser.add_argument('--n_neighbors', type=int, default=15)
+    parser.add_argument('--n_epochs', type=int, default=5)
+    parser.add_argument('--persistent', type=int, default=2)
+    args = parser.parse_args()
+
+    features, time_step_nums, sigmas, rhos = synthetic_complex(args.time_steps, args.train_num, args.border_num, args.dim)
+    params = dict(X=features, time_step_nums=time_step_nums, sigmas=sigmas, rhos=rhos, n_neighbors=args.n_neighbors, n_epochs=args.n_epochs)
+    compare("GlobalTemporalEdgeConstructor", LoopGlobalTemporalEdgeConstructor(**params), GlobalTemporalEdgeConstructor(**params))
+
+    knn_indices, time_step_idxs_list = synthetic_spatial_knn(time_step_nums, args.n_neighbors)
+    compare("LocalTemporalEdgeConstructor", LoopLocalTemporalEdgeConstructor(persistent=args.persistent, time_step_idxs_list=time_step_idxs_list, knn_indices=knn_indices, **params), LocalTemporalEdgeConstructor(persistent=args.persistent, time_step_idxs_list=time_step_idxs_list, knn_indices=knn_indices, **params))
+
+    selected_idxs_lists = synthetic_selections(time_step_nums, args.train_num)
+    compare("GlobalParallelTemporalEdgeConstructor", LoopGlobalParallelTemporalEdgeConstructor(selected_idxs_lists=selected_idxs_lists, **params), GlobalParallelTemporalEdgeConstructor(selected_idxs_lists=selected_idxs_lists, **params))